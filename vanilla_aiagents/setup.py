@@ -32,6 +32,7 @@ setup(
             "cloudevents>=1.11.0",
         ],
         "extras": ["llmlingua"],
+        "semantic": ["numpy"],
     },
     entry_points={
         "console_scripts": [],
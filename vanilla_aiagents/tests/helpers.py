@@ -0,0 +1,143 @@
+import threading
+from types import SimpleNamespace
+
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+
+from vanilla_aiagents.agent import Agent, handoff_tool_name
+from vanilla_aiagents.conversation import Conversation
+from vanilla_aiagents.llm import LLM, AzureOpenAILLM
+from vanilla_aiagents.team import AgentChoiceResponse
+
+
+USAGE = {"completion_tokens": 1, "prompt_tokens": 1, "total_tokens": 2}
+
+
+class ScriptedStream(list):
+    """Completion stream of the given chunks."""
+
+    def close(self):
+        pass
+
+
+class ScriptedClient:
+    """Stand-in for the AzureOpenAI client, answering each completion with the message returned by `respond(messages, tools)`.
+
+    Streamed completions send the message in a single delta, followed by the usage.
+    """
+
+    def __init__(self, respond):
+        self.respond = respond
+        self.requests = []
+        self.chat = self
+        self.completions = self
+        self._lock = threading.Lock()
+
+    def create(self, **kwargs):
+        with self._lock:
+            self.requests.append(kwargs)
+        messages = [m if isinstance(m, dict) else m.model_dump() for m in kwargs["messages"]]
+        tools = kwargs.get("tools")
+        tools = tools if isinstance(tools, list) else []
+        message = self.respond(messages, tools)
+        if not kwargs.get("stream"):
+            return ChatCompletion(
+                id="completion",
+                object="chat.completion",
+                created=0,
+                model="fake",
+                choices=[{"index": 0, "finish_reason": "stop", "message": message}],
+                usage=USAGE,
+            )
+        delta = dict(message)
+        if delta.get("tool_calls"):
+            delta["tool_calls"] = [{**tool_call, "index": i} for i, tool_call in enumerate(delta["tool_calls"])]
+        return ScriptedStream(
+            [
+                ChatCompletionChunk(
+                    id="chunk",
+                    object="chat.completion.chunk",
+                    created=0,
+                    model="fake",
+                    choices=[{"index": 0, "delta": delta, "finish_reason": None}],
+                ),
+                ChatCompletionChunk(id="chunk", object="chat.completion.chunk", created=0, model="fake", choices=[], usage=USAGE),
+            ]
+        )
+
+
+FAKE_CONFIG = {
+    "azure_deployment": "fake",
+    "azure_endpoint": "http://localhost:1",
+    "api_key": "fake",
+    "api_version": "2024-08-01-preview",
+}
+
+
+def scripted_llm(respond) -> AzureOpenAILLM:
+    """An AzureOpenAILLM whose completions are answered by `respond(messages, tools)`, without calling any model."""
+    llm = AzureOpenAILLM(FAKE_CONFIG)
+    llm.client = ScriptedClient(respond)
+    return llm
+
+
+def tool_call_message(name: str, arguments: str = "{}", id: str = "call_1") -> dict:
+    """An assistant message calling the given tool."""
+    return {
+        "role": "assistant",
+        "content": None,
+        "tool_calls": [{"id": id, "type": "function", "function": {"name": name, "arguments": arguments}}],
+    }
+
+
+class ReplyLLM(AzureOpenAILLM):
+    """AzureOpenAILLM replying with a fixed text through a scripted client, handing off to the given agent when it has the tool."""
+
+    def __init__(self, reply: str, target: str = None):
+        super().__init__(FAKE_CONFIG)
+        self.reply = reply
+        self.target = target
+        self.client = ScriptedClient(self._respond)
+
+    @property
+    def calls(self) -> int:
+        """The number of completions requested."""
+        return len(self.client.requests)
+
+    @property
+    def tools(self) -> list[str]:
+        """The names of the tools sent with the last completion request."""
+        tools = self.client.requests[-1].get("tools") if self.client.requests else None
+        return [tool["function"]["name"] for tool in tools] if isinstance(tools, list) else []
+
+    def _respond(self, messages, tools):
+        names = [tool["function"]["name"] for tool in tools]
+        if self.target is not None and handoff_tool_name(self.target) in names and messages[-1]["role"] != "tool":
+            return tool_call_message(handoff_tool_name(self.target))
+        return {"role": "assistant", "content": self.reply}
+
+
+class OrchestratorLLM(LLM):
+    """Orchestrator LLM choosing the given agents in order, then always the last one, counting its calls."""
+
+    def __init__(self, *agent_ids: str):
+        super().__init__({})
+        self.agent_ids = agent_ids
+        self.calls = 0
+
+    def ask(self, messages, tools=None, tools_function=None, temperature=0.7, response_format=None, timeout=None):
+        agent_id = self.agent_ids[min(self.calls, len(self.agent_ids) - 1)]
+        self.calls += 1
+        return SimpleNamespace(parsed=AgentChoiceResponse(agent_id=agent_id, reason="llm")), None
+
+    def ask_stream(self, messages, tools=None, tools_function=None, temperature=0.7, cancellation=None, timeout=None):
+        raise NotImplementedError()
+
+
+def reply_agent(id: str, target: str = None) -> Agent:
+    """An agent replying with a fixed text, handing off to the given agent when it has the tool."""
+    return Agent(id=id, description=f"The {id} agent", system_message="Help", llm=ReplyLLM(f"Reply from {id}", target))
+
+
+def team_choices(conversation: Conversation) -> list[tuple]:
+    """The (agent ID, reason) of the team choices logged in the conversation."""
+    return [(event.payload[0], event.payload[1]) for event in conversation.log if event.kind == "team/choice"]
@@ -0,0 +1,111 @@
+import time
+import unittest
+import os, logging, sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from typing import Annotated
+
+from vanilla_aiagents.agent import Agent, UPDATE_VARIABLE_TOOL, _update_conversation_variable
+from vanilla_aiagents.conversation import Conversation
+from vanilla_aiagents.function_utils import get_function_schema
+from vanilla_aiagents.llm import ErrorTestingLLM
+
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+
+def _agent(system_message: str = "You are helpful. Context: __context__") -> Agent:
+    agent = Agent(id="agent", description="Agent", system_message=system_message, llm=ErrorTestingLLM({}))
+
+    @agent.register_tool(description="Get the weather of a city")
+    def get_weather(city: Annotated[str, "The city"]) -> Annotated[str, "The weather"]:
+        return "sunny"
+
+    return agent
+
+
+class TestAgentTemplate(unittest.TestCase):
+
+    def setUp(self):
+        logging.basicConfig(level=logging.INFO)
+
+    def test_compiled_once(self):
+        agent = _agent()
+        conversation = Conversation(messages=[{"role": "user", "content": "Hi"}], variables={})
+
+        template = agent.compile()
+        tools, _ = agent._prepare_llm_tools(conversation)
+        agent._prepare_llm_input(conversation)
+
+        self.assertIs(agent.compile(), template, "Expected the template to be reused")
+        self.assertIs(tools, template.tools)
+        self.assertEqual([tool["function"]["name"] for tool in tools], ["get_weather", "update_conversation_variable"])
+
+        @agent.register_tool(description="Get the time")
+        def get_time() -> str:
+            return "noon"
+
+        self.assertIsNot(agent.compile(), template, "Expected registering a tool to invalidate the template")
+        self.assertEqual(len(agent.compile().tools), 3)
+
+        template = agent.compile()
+        agent.system_message = "Be brief."
+        self.assertIsNot(agent.compile(), template, "Expected changing the system message to invalidate the template")
+        self.assertEqual(agent._prepare_llm_input(conversation)[0]["content"], "Be brief.")
+
+    def test_context(self):
+        agent = _agent("Context: __context__. Again: __context__")
+        conversation = Conversation(messages=[], variables={"name": "John"})
+
+        content = agent._prepare_llm_input(conversation)[0]["content"]
+
+        self.assertEqual(content, 'Context: {"name": "John"}. Again: {"name": "John"}')
+
+    def test_bound_tools(self):
+        agent = _agent()
+        first = Conversation(messages=[], variables={})
+        second = Conversation(messages=[], variables={})
+
+        _, first_functions = agent._prepare_llm_tools(first)
+        _, second_functions = agent._prepare_llm_tools(second)
+        first_functions["update_conversation_variable"](variableName="name", variableValue="John")
+
+        self.assertEqual(first.variables, {"name": "John"})
+        self.assertEqual(second.variables, {})
+        self.assertEqual(second_functions["get_weather"](city="Rome"), "sunny")
+        self.assertNotIn("update_conversation_variable", agent.compile().tools_function)
+
+    def test_overhead(self):
+        agent = _agent()
+        conversation = Conversation(messages=[{"role": "user", "content": "Hi"}], variables={"name": "John"})
+        calls = 2000
+
+        start = time.perf_counter()
+        for _ in range(calls):
+            agent._prepare_llm_input(conversation)
+            agent._prepare_llm_tools(conversation)
+        compiled = (time.perf_counter() - start) / calls
+
+        # What every call used to pay, on top of the rest, before the template was compiled once
+        start = time.perf_counter()
+        for _ in range(calls):
+            get_function_schema(
+                _update_conversation_variable,
+                name="update_conversation_variable",
+                description="update a conversation or context variable",
+            )
+        schema = (time.perf_counter() - start) / calls
+
+        logging.info(
+            "Per-call orchestration overhead: %.1f us (schema generation alone: %.1f us)",
+            compiled * 1e6,
+            schema * 1e6,
+        )
+        self.assertEqual(agent.compile().tools[-1], UPDATE_VARIABLE_TOOL)
+        self.assertLess(compiled, schema, "Expected preparing a call to be cheaper than generating a schema")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,135 @@
+import json
+import tempfile
+import threading
+import time
+import unittest
+import os, logging, sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from vanilla_aiagents.askable import Askable
+from vanilla_aiagents.conversation import Conversation
+
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+
+class UppercaseAskable(Askable):
+    """Answers with the uppercased user message, taking longer for shorter messages."""
+
+    def __init__(self, fail_on: str = None):
+        super().__init__("upper", "Uppercases the user message")
+        self.fail_on = fail_on
+        self.calls = []
+        self.running = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def ask(self, conversation: Conversation, stream=False) -> str:
+        text = conversation.messages[-1]["content"]
+        with self._lock:
+            self.calls.append(text)
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+        try:
+            time.sleep(0.05 / len(text))
+            if text == self.fail_on:
+                raise ValueError("unsupported input")
+            if conversation.cancellation.cancelled:
+                return "cancelled"
+            conversation.metrics.add({"total_tokens": 3, "prompt_tokens": 2, "completion_tokens": 1})
+            conversation.append_messages({"role": "assistant", "name": self.id, "content": text.upper()})
+            return "done"
+        finally:
+            with self._lock:
+                self.running -= 1
+
+
+def _conversations(texts: list[str]):
+    for text in texts:
+        yield Conversation(messages=[{"role": "user", "content": text}])
+
+
+class TestBatch(unittest.TestCase):
+
+    def setUp(self):
+        logging.basicConfig(level=logging.INFO)
+        self.texts = ["a", "bb", "ccc", "dddd", "eeeee", "ffffff"] * 5
+        self.directory = tempfile.TemporaryDirectory()
+        self.checkpoint = os.path.join(self.directory.name, "checkpoint.jsonl")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_ordered(self):
+        askable = UppercaseAskable()
+        run = askable.ask_many(_conversations(self.texts), concurrency=4, ordered=True)
+
+        items = run.run()
+
+        self.assertEqual([item.index for item in items], list(range(len(self.texts))))
+        self.assertEqual([item.conversation.messages[-1]["content"] for item in items], [text.upper() for text in self.texts])
+        self.assertEqual(askable.peak, 4)
+        report = run.report()
+        self.assertEqual(report.completed, len(self.texts))
+        self.assertEqual(report.results, {"done": len(self.texts)})
+        self.assertEqual(report.total_tokens, 3 * len(self.texts))
+        self.assertGreater(report.throughput, 0)
+
+    def test_completion_order(self):
+        askable = UppercaseAskable(fail_on="ccc")
+        items = list(askable.ask_many(_conversations(self.texts[:6]), concurrency=6))
+
+        # Longer messages complete first
+        self.assertEqual(items[0].conversation.messages[-1]["content"], "FFFFFF")
+        self.assertEqual(sorted(item.index for item in items), list(range(6)))
+        failed = [item for item in items if item.result == "error"]
+        self.assertEqual([(item.key, item.error) for item in failed], [("2", "unsupported input")])
+
+    def test_resume(self):
+        askable = UppercaseAskable(fail_on="ccc")
+        run = askable.ask_many(_conversations(self.texts), concurrency=2, checkpoint=self.checkpoint)
+        for item in run:
+            if item.result == "done" and len(askable.calls) >= 10:
+                # Simulate an interruption
+                break
+
+        with open(self.checkpoint) as reader:
+            checkpointed = {json.loads(line)["key"] for line in reader}
+        self.assertGreater(len(checkpointed), 0)
+        self.assertNotIn("2", checkpointed, "Expected failed conversations not to be checkpointed")
+        # Simulate a crash while writing
+        with open(self.checkpoint, "a") as writer:
+            writer.write('{"index": 3')
+
+        askable = UppercaseAskable()
+        run = askable.ask_many(_conversations(self.texts), concurrency=2, ordered=True, checkpoint=self.checkpoint)
+        items = run.run()
+
+        self.assertEqual([item.conversation.messages[-1]["content"] for item in items], [text.upper() for text in self.texts])
+        self.assertEqual(len(askable.calls), len(self.texts) - len(checkpointed))
+        self.assertEqual({item.key for item in items if item.resumed}, checkpointed)
+        self.assertEqual(run.report().resumed, len(checkpointed))
+
+        # Everything is checkpointed now
+        askable = UppercaseAskable()
+        self.assertEqual(len(askable.ask_many(_conversations(self.texts), checkpoint=self.checkpoint).run()), len(self.texts))
+        self.assertEqual(askable.calls, [])
+
+    def test_cancel(self):
+        askable = UppercaseAskable()
+        run = askable.ask_many(_conversations(self.texts * 10), concurrency=2, ordered=True)
+
+        items = []
+        for item in run:
+            items.append(item)
+            if len(items) == 5:
+                run.cancel()
+
+        self.assertLess(len(items), 10)
+        self.assertLess(len(askable.calls), 10, "Expected no conversation to start after the cancellation")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,196 @@
+import json
+import tempfile
+import threading
+import unittest
+import os, logging, sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from typing import Annotated
+
+from openai.types.chat import ChatCompletionMessage
+
+from vanilla_aiagents.agent import Agent
+from vanilla_aiagents.askable import Askable
+from vanilla_aiagents.batch import BatchLLM, LocalBatchSubmitter
+from vanilla_aiagents.conversation import Conversation
+from vanilla_aiagents.llm import LLM, DeferredResponse
+from vanilla_aiagents.workflow import Workflow
+from tests.helpers import scripted_llm, tool_call_message
+
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+USAGE = {"total_tokens": 10, "prompt_tokens": 8, "completion_tokens": 2}
+
+
+class CityLLM(LLM):
+    """Asks for the weather tool, then answers with its result, without calling any model."""
+
+    def __init__(self):
+        super().__init__({})
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def complete(self, messages, tools=None, temperature=0.7, timeout=None):
+        with self._lock:
+            self.requests += 1
+        last = messages[-1]
+        if last["role"] == "tool":
+            return ChatCompletionMessage(role="assistant", content=f"The weather is {last['content']}"), USAGE
+        if last["content"].startswith("Remember "):
+            tool_call = {
+                "id": "call_1",
+                "type": "function",
+                "function": {
+                    "name": "update_conversation_variable",
+                    "arguments": json.dumps({"variableName": "city", "variableValue": last["content"][9:]}),
+                },
+            }
+            return ChatCompletionMessage(role="assistant", content=None, tool_calls=[tool_call]), USAGE
+        if any(tool["function"]["name"] == "get_weather" for tool in tools or []):
+            tool_call = {
+                "id": "call_1",
+                "type": "function",
+                "function": {"name": "get_weather", "arguments": json.dumps({"city": last["content"]})},
+            }
+            return ChatCompletionMessage(role="assistant", content=None, tool_calls=[tool_call]), USAGE
+        return ChatCompletionMessage(role="assistant", content=last["content"].upper()), USAGE
+
+    def ask(self, messages, tools=None, tools_function=None, temperature=0.7, response_format=None, timeout=None):
+        raise NotImplementedError()
+
+    def ask_stream(self, messages, tools=None, tools_function=None, temperature=0.7, cancellation=None, timeout=None):
+        raise NotImplementedError()
+
+
+class DeferringAskable(Askable):
+    """Askable always deferring, without queueing any request."""
+
+    def ask(self, conversation, stream=False):
+        return "deferred"
+
+
+def line_id(llm: BatchLLM) -> str:
+    return next(iter(llm._pending))
+
+
+class TestBatchLLM(unittest.TestCase):
+
+    def setUp(self):
+        logging.basicConfig(level=logging.INFO)
+        self.directory = tempfile.TemporaryDirectory()
+        self.remote = CityLLM()
+        self.llm = BatchLLM({"azure_deployment": "gpt-4o"}, submitter=LocalBatchSubmitter(self.remote), directory=self.directory.name)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def _agent(self, with_tools: bool, system_message: str = "Answer") -> Agent:
+        agent = Agent(id="agent", description="Agent", system_message=system_message, llm=self.llm)
+        self.weather_calls = []
+        if with_tools:
+
+            @agent.register_tool(description="Get the weather of a city")
+            def get_weather(city: Annotated[str, "The city"]) -> str:
+                self.weather_calls.append(city)
+                return f"sunny in {city}"
+
+        return agent
+
+    def test_deferred(self):
+        agent = self._agent(with_tools=False)
+        workflow = Workflow(agent)
+
+        result = workflow.run("hello")
+
+        self.assertEqual(result, "deferred")
+        self.assertEqual(len(workflow.conversation.messages), 2, "Expected the conversation to be left untouched")
+        self.assertEqual(self.llm.pending, 1)
+        self.assertIn(("info", "agent/deferred", "agent", line_id(self.llm)), workflow.conversation.log)
+
+        job_id = self.llm.submit()
+        input_file = next(name for name in os.listdir(self.directory.name) if not name.endswith(".output.jsonl"))
+        with open(os.path.join(self.directory.name, input_file)) as reader:
+            line = json.loads(reader.readline())
+        self.assertEqual(line["method"], "POST")
+        self.assertEqual(line["url"], "/v1/chat/completions")
+        self.assertEqual(line["body"]["model"], "gpt-4o")
+        self.assertTrue(line["custom_id"].startswith("request-"))
+
+        self.assertTrue(self.llm.wait(job_id, poll_interval=0.01, timeout=5))
+        self.assertEqual(agent.ask(workflow.conversation), "done")
+        self.assertEqual(workflow.conversation.messages[-1]["content"], "HELLO")
+        self.assertEqual(workflow.conversation.metrics.total_tokens, 10)
+
+    def test_run(self):
+        agent = self._agent(with_tools=True)
+        cities = ["Rome", "Paris", "Rome", "Oslo"]
+        conversations = [Conversation(messages=[{"role": "user", "content": city}]) for city in cities]
+
+        items = self.llm.run(agent, conversations, concurrency=2, poll_interval=0.01)
+
+        self.assertEqual([item.result for item in items], ["done"] * 4)
+        self.assertEqual(
+            [item.conversation.messages[-1]["content"] for item in items],
+            [f"The weather is sunny in {city}" for city in cities],
+        )
+        # A round for the tool calls, a round for the answers, the duplicated conversation is sent once
+        self.assertEqual(len(self.llm.jobs), 2)
+        self.assertEqual(self.remote.requests, 3 * 2)
+        self.assertEqual(items[0].conversation.metrics.total_tokens, 20)
+        self.assertEqual(sorted(self.weather_calls), sorted(cities), "Expected each tool call to run once per conversation")
+        self.assertEqual((self.llm._responses, self.llm._deferred, self.llm._waiting), ({}, {}, {}), "Expected consumed responses to be dropped")
+
+    def test_azure_submitter(self):
+        def respond(messages, tools):
+            last = messages[-1]
+            if last["role"] == "tool":
+                return {"role": "assistant", "content": f"The weather is {last['content']}"}
+            return tool_call_message("get_weather", json.dumps({"city": last["content"]}))
+
+        remote = scripted_llm(respond)
+        self.llm.submitter = LocalBatchSubmitter(remote)
+        agent = self._agent(with_tools=True)
+
+        items = self.llm.run(agent, [Conversation(messages=[{"role": "user", "content": "Rome"}])], poll_interval=0.01)
+
+        self.assertEqual(items[0].result, "done")
+        self.assertEqual(items[0].conversation.messages[-1]["content"], "The weather is sunny in Rome")
+        self.assertEqual(self.weather_calls, ["Rome"], "Expected the tool call to run on the BatchLLM side")
+        self.assertEqual(len(remote.client.requests), 2, "Expected a single completion per batch request")
+
+    def test_variable_update(self):
+        agent = self._agent(with_tools=False, system_message="Answer with the context: __context__")
+        conversation = Conversation(messages=[{"role": "user", "content": "Remember Rome"}])
+
+        items = self.llm.run(agent, [conversation], poll_interval=0.01)
+
+        self.assertEqual(items[0].result, "done")
+        self.assertEqual(conversation.variables["city"], "Rome")
+        # The system message now renders the variable, but the deferred request is resumed
+        self.assertEqual(len(self.llm.jobs), 2)
+
+    def test_max_rounds(self):
+        agent = self._agent(with_tools=True)
+
+        items = self.llm.run(agent, [Conversation(messages=[{"role": "user", "content": "Rome"}])], max_rounds=2, poll_interval=0.01)
+
+        self.assertEqual(items[0].result, "deferred")
+        self.assertEqual(len(items[0].conversation.messages), 1)
+
+        # The request left queued by the previous run is submitted, then nothing is queued and the run stops
+        items = self.llm.run(DeferringAskable("deferring", "Deferring"), [Conversation()], max_rounds=5, poll_interval=0.01)
+        self.assertEqual(items[0].result, "deferred")
+        self.assertEqual(len(self.llm.jobs), 2)
+
+    def test_structured_output(self):
+        with self.assertRaises(NotImplementedError):
+            self.llm.ask([{"role": "user", "content": "hello"}], response_format=dict)
+        with self.assertRaises(DeferredResponse):
+            self.llm.ask([{"role": "user", "content": "hello"}])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,170 @@
+import tempfile
+import unittest
+import os, logging, sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from vanilla_aiagents.blobs import (
+    BlobDigestMismatchError,
+    FileSystemBlobStore,
+    InMemoryBlobStore,
+    InvalidBlobDigestError,
+    TieredBlobStore,
+    collect_digests,
+    compute_digest,
+    decode_blobs,
+    encode_blobs,
+)
+from vanilla_aiagents.conversation import Conversation
+from vanilla_aiagents.workflow import Workflow, WorkflowInput
+from vanilla_aiagents.agent import Agent
+from vanilla_aiagents.llm import LLM
+from vanilla_aiagents.remote.remote import RESTHost, RemoteAskable, RESTConnection
+
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+
+class RecordingLLM(LLM):
+    """LLM recording the messages it receives and answering with a fixed text."""
+
+    def __init__(self):
+        super().__init__({})
+        self.received = []
+
+    def ask(self, messages, tools=None, tools_function=None, temperature=0.7, response_format=None):
+        self.received.append(messages)
+        return (
+            type("Message", (), {"model_dump": lambda self: {"role": "assistant", "content": "A SIM error."}})(),
+            {"total_tokens": 0, "prompt_tokens": 0, "completion_tokens": 0},
+        )
+
+    def ask_stream(self, messages, tools=None, tools_function=None, temperature=0.7):
+        raise NotImplementedError()
+
+
+class TestBlobs(unittest.TestCase):
+
+    def setUp(self):
+        logging.basicConfig(level=logging.INFO)
+        logging.getLogger("vanilla_aiagents.blobs").setLevel(logging.DEBUG)
+
+        self.image_path = os.path.join(os.path.dirname(__file__), "iphone_sim_error.jpg")
+        with open(self.image_path, "rb") as f:
+            self.image = f.read()
+
+    def test_stores(self):
+        memory = InMemoryBlobStore(max_bytes=10)
+        first = memory.put(b"0123456789")
+        second = memory.put(b"abcdefghij")
+        self.assertIsNone(memory.get(first), "Expected least recently used blob to be evicted")
+        self.assertEqual(memory.get(second), b"abcdefghij")
+
+        with tempfile.TemporaryDirectory() as directory:
+            store = TieredBlobStore(InMemoryBlobStore(), FileSystemBlobStore(directory))
+            digest = store.put(self.image)
+            self.assertEqual(digest, compute_digest(self.image))
+            self.assertEqual(FileSystemBlobStore(directory).get(digest), self.image)
+            self.assertEqual(store.missing([digest, "0" * 64]), ["0" * 64])
+
+            files = FileSystemBlobStore(directory)
+            with files.open(digest) as data:
+                self.assertEqual(data[:], self.image)
+            self.assertTrue(data.closed, "Expected the memory map to be closed after the block")
+            with files.open("0" * 64) as data:
+                self.assertIsNone(data)
+
+    def test_transport(self):
+        store = InMemoryBlobStore()
+        digest = store.put(self.image)
+        blobs = encode_blobs(store, [digest, "0" * 64])
+        self.assertEqual(list(blobs), [digest])
+
+        received = InMemoryBlobStore()
+        decode_blobs(received, blobs)
+        self.assertEqual(received.get(digest), self.image)
+        with self.assertRaises(BlobDigestMismatchError):
+            decode_blobs(received, {"0" * 64: blobs[digest]})
+
+        rejected = InMemoryBlobStore()
+        with self.assertRaises(BlobDigestMismatchError):
+            decode_blobs(rejected, {"0" * 64: blobs[digest]})
+        self.assertEqual(rejected.size, 0, "Expected mismatched blobs not to be stored")
+
+    def test_invalid_digests(self):
+        with tempfile.TemporaryDirectory() as directory:
+            store = FileSystemBlobStore(directory)
+            for digest in ["/etc/passwd", "../../x", "A" * 64, "0" * 63]:
+                with self.assertRaises(InvalidBlobDigestError):
+                    store.get(digest)
+                with self.assertRaises(InvalidBlobDigestError):
+                    store.missing([digest])
+
+    def test_remote_invalid_digests(self):
+        from fastapi.testclient import TestClient
+
+        host = RESTHost(askables=[], host="127.0.0.1", port=5011)
+        client = TestClient(host.app)
+
+        for operation in ["missing", "get"]:
+            response = client.post(f"/agent/blobs/{operation}", json={"digests": ["../../etc/passwd"]})
+            self.assertEqual(response.status_code, 400)
+        response = client.post("/agent/blobs/put", json={"blobs": {"/etc/passwd": "AAAA"}})
+        self.assertEqual(response.status_code, 400)
+        response = client.post("/agent/blobs/missing", json={"digests": ["0" * 64]})
+        self.assertEqual(response.json(), {"missing": ["0" * 64]})
+
+    def test_workflow_references(self):
+        llm = RecordingLLM()
+        agent = Agent(id="agent", llm=llm, description="Agent", system_message="Describe the image")
+        workflow = Workflow(
+            askable=agent,
+            conversation=Conversation(messages=[], variables={}, blob_store=InMemoryBlobStore()),
+        )
+
+        data = WorkflowInput(text="What is wrong?", images=[])
+        data.add_image_file(self.image_path)
+        workflow.run(data)
+
+        url = workflow.conversation.messages[1]["content"][1]["image_url"]["url"]
+        self.assertTrue(url.startswith("blob:image/jpeg;sha256,"), "Expected image to be stored as a reference")
+        self.assertEqual(collect_digests(workflow.conversation.messages), [compute_digest(self.image)])
+
+        sent_url = llm.received[0][1]["content"][1]["image_url"]["url"]
+        self.assertTrue(sent_url.startswith("data:image/jpeg;base64,"), "Expected LLM to receive the inline image")
+
+        fork = workflow.conversation.fork()
+        self.assertIs(fork.blob_store, workflow.conversation.blob_store)
+        self.assertLess(len(str(workflow.conversation.to_dict())), 1000)
+
+    def test_remote_blobs(self):
+        llm = RecordingLLM()
+        agent = Agent(id="agent", llm=llm, description="Agent", system_message="Describe the image")
+        host = RESTHost(askables=[agent], host="127.0.0.1", port=5010)
+        host.start()
+
+        try:
+            remote = RemoteAskable(id="agent", connection=RESTConnection(url="http://localhost:5010"))
+            workflow = Workflow(
+                askable=remote,
+                conversation=Conversation(messages=[], variables={}, blob_store=InMemoryBlobStore()),
+            )
+
+            data = WorkflowInput(text="What is wrong?", images=[])
+            data.add_image_file(self.image_path)
+            workflow.run(data)
+            workflow.run("And how do I fix it?")
+        finally:
+            host.stop()
+
+        digest = compute_digest(self.image)
+        self.assertTrue(host.blob_store.has(digest), "Expected blob to be uploaded to the host")
+        self.assertEqual(len(llm.received), 2)
+        for messages in llm.received:
+            self.assertTrue(messages[1]["content"][1]["image_url"]["url"].startswith("data:image/jpeg;base64,"))
+        self.assertEqual(workflow.conversation.messages[-1]["content"], "A SIM error.")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,224 @@
+import itertools
+import json
+import threading
+import time
+import unittest
+import os, logging, sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from openai.types.chat import ChatCompletionChunk
+
+from vanilla_aiagents.agent import Agent
+from vanilla_aiagents.conversation import Conversation
+from vanilla_aiagents.llm import AzureOpenAILLM
+from vanilla_aiagents.remote.remote import RESTHost
+from vanilla_aiagents.sequence import Sequence
+from vanilla_aiagents.workflow import Workflow
+
+import requests
+
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+
+def _chunk(delta: dict) -> ChatCompletionChunk:
+    return ChatCompletionChunk(
+        id="chunk",
+        object="chat.completion.chunk",
+        created=0,
+        model="fake",
+        choices=[{"index": 0, "delta": delta, "finish_reason": None}],
+    )
+
+
+class FakeStream:
+    """Completion stream yielding the given deltas, one every interval, until closed."""
+
+    def __init__(self, deltas, interval: float):
+        self.deltas = iter(deltas)
+        self.interval = interval
+        self.sent = 0
+        self.closed = threading.Event()
+
+    def __iter__(self):
+        for delta in self.deltas:
+            if self.closed.wait(self.interval):
+                raise ConnectionError("Stream closed")
+            self.sent += 1
+            yield delta if isinstance(delta, ChatCompletionChunk) else _chunk(delta)
+
+    def close(self):
+        self.closed.set()
+
+
+class FakeClient:
+    """Stand-in for the AzureOpenAI client, serving the given streams in order."""
+
+    def __init__(self, streams):
+        self.streams = list(streams)
+        self.created = []
+        self.chat = self
+        self.completions = self
+
+    def create(self, **kwargs):
+        stream = self.streams[len(self.created)]
+        self.created.append(stream)
+        return stream
+
+
+def _fake_llm(streams) -> AzureOpenAILLM:
+    llm = AzureOpenAILLM(
+        {
+            "azure_deployment": "fake",
+            "azure_endpoint": "http://localhost:1",
+            "api_key": "fake",
+            "api_version": "2024-08-01-preview",
+        }
+    )
+    llm.client = FakeClient(streams)
+    return llm
+
+
+def _endless_text():
+    return FakeStream(({"role": "assistant", "content": "token "} for _ in itertools.count()), 0.01)
+
+
+def _wait_for(predicate, timeout: float = 5) -> bool:
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+class TestCancellation(unittest.TestCase):
+
+    def setUp(self):
+        logging.basicConfig(level=logging.INFO)
+
+    def test_consumer_stops(self):
+        stream = _endless_text()
+        agent = Agent(id="agent", description="Agent", system_message="Talk", llm=_fake_llm([stream]))
+        workflow = Workflow(askable=agent, conversation=Conversation(messages=[], variables={}))
+
+        deltas = 0
+        for mark, _ in workflow.run_stream("Hello"):
+            if mark == "delta":
+                deltas += 1
+                if deltas == 3:
+                    break
+
+        self.assertTrue(stream.closed.wait(5), "Expected the completion stream to be closed")
+        self.assertLess(stream.sent, 10)
+        # The agent winds down in the background
+        self.assertTrue(_wait_for(lambda: workflow.conversation.log.last(kind="agent/cancelled")))
+        event = workflow.conversation.log.last(kind="agent/cancelled")
+        self.assertEqual(event.payload, ("cancelled",))
+        self.assertEqual(len(workflow.conversation.messages), 2, "Expected partial response to be discarded")
+
+    def test_stalled_stream(self):
+        # A single slow chunk: closing the stream must interrupt the pending read
+        stream = FakeStream([{"role": "assistant", "content": "late"}], 30)
+        agent = Agent(id="agent", description="Agent", system_message="Talk", llm=_fake_llm([stream]))
+        workflow = Workflow(askable=agent, conversation=Conversation(messages=[], variables={}))
+
+        threading.Timer(0.2, workflow.cancel).start()
+        start = time.monotonic()
+        result = workflow.run_stream("Hello", timeout=10)
+        updates = list(result)
+
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertEqual(updates[-1], ["result", "cancelled"])
+
+    def test_pending_tool_calls_skipped(self):
+        calls = []
+        tool_calls = FakeStream(
+            [
+                {
+                    "role": "assistant",
+                    "tool_calls": [
+                        {"index": 0, "id": "call_0", "type": "function", "function": {"name": "lookup", "arguments": '{"key": "a"}'}}
+                    ],
+                },
+                {
+                    "tool_calls": [
+                        {"index": 1, "id": "call_1", "type": "function", "function": {"name": "lookup", "arguments": '{"key": "b"}'}}
+                    ],
+                },
+            ],
+            0,
+        )
+        llm = _fake_llm([tool_calls, _endless_text()])
+        first = Agent(id="first", description="First", system_message="Look up", llm=llm)
+        second = Agent(id="second", description="Second", system_message="Talk", llm=llm)
+        sequence = Sequence(llm=llm, description="Sequence", id="sequence", steps=[first, second])
+        workflow = Workflow(askable=sequence, conversation=Conversation(messages=[], variables={}))
+
+        @first.register_tool(description="Look up a key")
+        def lookup(key: str) -> str:
+            calls.append(key)
+            # The client goes away while the first tool is running
+            workflow.cancel("client-disconnected")
+            return "value"
+
+        updates = list(workflow.run_stream("Hello"))
+
+        self.assertEqual(calls, ["a"], "Expected the pending tool call to be skipped")
+        self.assertEqual(len(llm.client.created), 1, "Expected no further completion to be started")
+        self.assertEqual(updates[-1], ["result", "cancelled"])
+        self.assertEqual(workflow.conversation.log.last(kind="sequence/cancelled").source, "sequence")
+
+    def test_partial_usage(self):
+        usage = ChatCompletionChunk(
+            id="chunk",
+            object="chat.completion.chunk",
+            created=0,
+            model="fake",
+            choices=[],
+            usage={"completion_tokens": 3, "prompt_tokens": 7, "total_tokens": 10},
+        )
+        tool_call = {"index": 0, "id": "call_0", "type": "function", "function": {"name": "lookup", "arguments": "{}"}}
+        llm = _fake_llm([FakeStream([{"role": "assistant", "tool_calls": [tool_call]}, usage], 0), _endless_text()])
+        agent = Agent(id="agent", description="Agent", system_message="Look up", llm=llm)
+        workflow = Workflow(askable=agent, conversation=Conversation(messages=[], variables={}))
+
+        @agent.register_tool(description="Look up")
+        def lookup() -> str:
+            workflow.cancel("client-disconnected")
+            return "value"
+
+        updates = list(workflow.run_stream("Hello"))
+
+        self.assertEqual(updates[-1], ["result", "cancelled"])
+        self.assertIn(["usage", {"completion_tokens": 3, "prompt_tokens": 7, "total_tokens": 10}], updates)
+        self.assertEqual(workflow.conversation.metrics.total_tokens, 10, "Expected the tokens of the cancelled generation to be counted")
+        self.assertEqual(workflow.conversation.metrics.prompt_tokens, 7)
+
+    def test_rest_disconnect(self):
+        stream = _endless_text()
+        agent = Agent(id="agent", description="Agent", system_message="Talk", llm=_fake_llm([stream]))
+        host = RESTHost(askables=[agent], host="127.0.0.1", port=5017, disconnect_grace=0.2)
+        host.start()
+
+        try:
+            payload = {"messages": [{"role": "user", "content": "Hello"}], "variables": {}}
+            response = requests.post("http://localhost:5017/agent/ask?stream=true", json=payload, stream=True)
+            lines = response.iter_lines()
+            for line in lines:
+                if line and json.loads(line)[0] == "delta":
+                    break
+            response.close()
+
+            self.assertTrue(stream.closed.wait(5), "Expected the run to be cancelled after the grace period")
+            run = host.runs.get(response.headers["X-Run-Id"])
+            self.assertTrue(run.session.wait(5))
+            self.assertEqual(run.session.result, "cancelled")
+        finally:
+            host.stop()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,105 @@
+import json
+import unittest
+import os, logging, sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from vanilla_aiagents.agent import Agent
+from vanilla_aiagents.context import ContextPolicy
+from vanilla_aiagents.conversation import Conversation
+from vanilla_aiagents.llm import ErrorTestingLLM
+
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+
+def _system_message(agent: Agent, conversation: Conversation) -> str:
+    return agent._prepare_llm_input(conversation)[0]["content"]
+
+
+class TestContextPolicy(unittest.TestCase):
+
+    def setUp(self):
+        logging.basicConfig(level=logging.INFO)
+        self.conversation = Conversation(
+            messages=[],
+            variables={"CHANNEL": "voice", "DOCUMENT": "lorem ipsum " * 1000, "PLAN": ["a", "b"]},
+        )
+
+    def test_allowlist(self):
+        llm = ErrorTestingLLM({})
+        everything = Agent(id="all", description="All", system_message="CONTEXT: __context__", llm=llm)
+        selective = Agent(
+            id="selective",
+            description="Selective",
+            system_message="CONTEXT: __context__",
+            llm=llm,
+            context_policy=ContextPolicy(variables=["CHANNEL", "MISSING"]),
+        )
+
+        self.assertEqual(_system_message(selective, self.conversation), 'CONTEXT: {"CHANNEL": "voice"}')
+        self.assertGreater(len(_system_message(everything, self.conversation)), 10000)
+
+    def test_max_size(self):
+        truncating = ContextPolicy(max_size=20)
+        context = json.loads(truncating.render(self.conversation.variables))
+        self.assertEqual(context["CHANNEL"], "voice")
+        self.assertEqual(context["PLAN"], ["a", "b"])
+        self.assertEqual(context["DOCUMENT"], "lorem ipsum lorem ip...[truncated]")
+
+        summaries = []
+
+        def summarize(name, value):
+            summaries.append(name)
+            return f"A {len(value)} characters document"
+
+        summarizing = ContextPolicy(variables=["DOCUMENT", "CHANNEL"], max_size=20, summarizer=summarize)
+        for channel in ["voice", "chat", "email"]:
+            self.conversation.set_variable("CHANNEL", channel)
+            context = json.loads(summarizing.render(self.conversation.variables))
+            self.assertEqual(context, {"DOCUMENT": "A 12000 characters document", "CHANNEL": channel})
+        self.assertEqual(summaries, ["DOCUMENT"], "Expected the unchanged value to be summarized once")
+
+    def test_cached_by_version(self):
+        policy = ContextPolicy()
+        variables = self.conversation.variables
+
+        first = policy.render(variables)
+        self.assertIs(policy.render(variables), first, "Expected the fragment to be reused")
+
+        self.conversation.set_variable("CHANNEL", "chat")
+        self.assertIn('"CHANNEL": "chat"', policy.render(self.conversation.variables))
+
+        # Direct writes and replacements are tracked as well
+        self.conversation.variables["CHANNEL"] = "email"
+        self.assertIn('"CHANNEL": "email"', policy.render(self.conversation.variables))
+        self.conversation.variables = {"CHANNEL": "sms"}
+        self.assertEqual(policy.render(self.conversation.variables), '{"CHANNEL": "sms"}')
+
+        # Each conversation has its own versions
+        other = Conversation(variables={"CHANNEL": "voice"})
+        self.assertEqual(policy.render(other.variables), '{"CHANNEL": "voice"}')
+        self.assertEqual(policy.render(self.conversation.variables), '{"CHANNEL": "sms"}')
+
+
+    def test_nested_changes(self):
+        agent = Agent(id="all", description="All", system_message="CONTEXT: __context__", llm=ErrorTestingLLM({}))
+        conversation = Conversation(variables={"plan": {"steps": []}})
+        self.assertEqual(_system_message(agent, conversation), 'CONTEXT: {"plan": {"steps": []}}')
+
+        # Agents without a policy always see in place changes
+        conversation.variables["plan"]["steps"].append("x")
+        self.assertEqual(_system_message(agent, conversation), 'CONTEXT: {"plan": {"steps": ["x"]}}')
+
+        # Policies need the change written as a variable
+        agent.context_policy = ContextPolicy()
+        _system_message(agent, conversation)
+        plan = conversation.variables["plan"]
+        plan["steps"].append("y")
+        conversation.set_variable("plan", plan)
+        self.assertEqual(_system_message(agent, conversation), 'CONTEXT: {"plan": {"steps": ["x", "y"]}}')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,14 +1,19 @@
+import json
+import tempfile
+import threading
 import unittest
 import os, logging, sys
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from vanilla_aiagents.conversation import Conversation
+from vanilla_aiagents.conversation import AllMessagesStrategy, Conversation
+from vanilla_aiagents.log import JSONLLogSink
 from vanilla_aiagents.workflow import Workflow
 from vanilla_aiagents.agent import Agent
 from vanilla_aiagents.user import User
 from vanilla_aiagents.team import Team
 from vanilla_aiagents.llm import AzureOpenAILLM
+from vanilla_aiagents.remote.remote import RemoteAskable
 
 from dotenv import load_dotenv
 load_dotenv(override=True)
@@ -52,7 +57,126 @@ class TestConversation(unittest.TestCase):
         self.assertEqual(conversation.metrics.prompt_tokens, source["metrics"]["prompt_tokens"])
         self.assertEqual(conversation.metrics.completion_tokens, source["metrics"]["completion_tokens"])
         self.assertEqual(conversation.log, source["log"])        
-        
+
+    def test_log_ring_buffer(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "log.jsonl")
+            conversation = Conversation(messages=[], variables={}, log_capacity=3, log_sink=JSONLLogSink(path))
+
+            conversation.log.append(("info", "agent/stop", "agent1"))
+            conversation.log.append(("error", "agent/error", "agent2", ValueError("boom")))
+            conversation.log.append(("info", "team/choice", "team", "agent1", "reason"))
+            conversation.log.append(("info", "team/choice", "team", "agent2", "reason"))
+
+            self.assertEqual(len(conversation.log), 3, "Expected log to be bounded")
+            self.assertEqual(conversation.log.total, 4)
+            self.assertIsNone(conversation.log.last(kind="agent/stop"), "Expected evicted event not to be found")
+            self.assertEqual(conversation.log.last(kind="team/choice").payload, ("agent2", "reason"))
+            self.assertEqual(conversation.log.find(level="error")[0].payload, ("ValueError: boom",))
+            self.assertEqual(conversation.log.last(kind="team/choice", source="team").source, "team")
+
+            with open(path) as f:
+                spilled = [json.loads(line) for line in f]
+            self.assertEqual(len(spilled), 1, "Expected evicted event to be spilled to the sink")
+            self.assertEqual(spilled[0]["kind"], "agent/stop")
+
+    def test_log_concurrent_readers(self):
+        conversation = Conversation(messages=[], variables={}, log_capacity=100)
+        done = threading.Event()
+        errors = []
+
+        def write():
+            for i in range(20000):
+                conversation.log.append(("info", "agent/step", f"agent{i % 3}", i))
+            done.set()
+
+        def read():
+            try:
+                while not done.is_set():
+                    conversation.log.last(kind="agent/step", source="agent1")
+                    conversation.log.find(source="agent2")
+            except RuntimeError as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=write)] + [threading.Thread(target=read) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [], "Expected reads not to fail while the log is appended to")
+
+    def test_concurrent_writers(self):
+        conversation = Conversation(messages=[], variables={"shared": 0})
+        writers, writes = 16, 500
+        errors = []
+        start = threading.Barrier(writers + 1)
+
+        def write(writer):
+            start.wait()
+            for i in range(writes):
+                conversation.append_messages({"role": "assistant", "name": f"writer{writer}", "content": str(i)})
+                conversation.set_variable(f"writer{writer}", i)
+                conversation.merge_variables({f"merged{writer}": i, "shared": i})
+                conversation.metrics.add({"total_tokens": 3, "prompt_tokens": 2, "completion_tokens": 1})
+
+        def read():
+            start.wait()
+            try:
+                # Readers never see a conversation being mutated
+                for _ in range(200):
+                    conversation.to_dict()
+                    conversation.fork()
+                    AllMessagesStrategy().get_messages(conversation)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=write, args=(writer,)) for writer in range(writers)]
+        threads.append(threading.Thread(target=read))
+        switch_interval = sys.getswitchinterval()
+        # Switch threads as often as possible to maximize interleaving
+        sys.setswitchinterval(1e-6)
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            sys.setswitchinterval(switch_interval)
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(conversation.messages), writers * writes)
+        for writer in range(writers):
+            contents = [m["content"] for m in conversation.messages if m["name"] == f"writer{writer}"]
+            self.assertEqual(contents, [str(i) for i in range(writes)], "Expected each writer order to be preserved")
+            self.assertEqual(conversation.variables[f"writer{writer}"], writes - 1)
+            self.assertEqual(conversation.variables[f"merged{writer}"], writes - 1)
+        self.assertEqual(conversation.variables["shared"], writes - 1)
+        self.assertEqual(conversation.metrics.total_tokens, 3 * writers * writes)
+        self.assertEqual(conversation.metrics.prompt_tokens, 2 * writers * writes)
+        self.assertEqual(conversation.metrics.completion_tokens, writers * writes)
+
+    def test_remote_variables(self):
+        conversation = Conversation(messages=[{"role": "user", "content": "Hello"}], variables={"changed": 1, "kept": 1, "deleted": 1})
+
+        class VariablesConnection:
+            """Connection to a remote askable changing and deleting variables, while the local ones are written concurrently."""
+
+            def send(self, target_id, operation, payload):
+                if operation == "describe":
+                    return {"description": "Remote"}
+                conversation.set_variable("kept", 2)
+                conversation.set_variable("added", 2)
+                variables = {**payload["variables"], "changed": 3, "new": 3}
+                del variables["deleted"]
+                messages = payload["messages"] + [{"role": "assistant", "content": "Hi"}]
+                return {"result": "done", "conversation": {"messages": messages, "variables": variables, "metrics": {"total_tokens": 0, "prompt_tokens": 0, "completion_tokens": 0}}}
+
+        RemoteAskable(id="remote", connection=VariablesConnection()).ask(conversation)
+
+        self.assertEqual(conversation.variables, {"changed": 3, "kept": 2, "added": 2, "new": 3})
+        self.assertEqual(conversation.messages[-1]["content"], "Hi")
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,198 @@
+import time
+import unittest
+import os, logging, sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from openai.types.chat import ChatCompletion, ChatCompletionMessage
+
+from vanilla_aiagents.agent import Agent
+from vanilla_aiagents.askable import Askable
+from vanilla_aiagents.conversation import Conversation
+from vanilla_aiagents.llm import LLM, AzureOpenAILLM
+from vanilla_aiagents.remote.grpc import GRPCConnection, GRPCHost
+from vanilla_aiagents.remote.remote import RemoteAskable, RESTConnection, RESTHost
+from vanilla_aiagents.sequence import Sequence
+from vanilla_aiagents.workflow import Workflow
+
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+
+class SlowAskable(Askable):
+    """Askable taking a while to answer, recording the time budget it was given."""
+
+    def __init__(self, id, description, delay: float):
+        super().__init__(id, description)
+        self.delay = delay
+        self.budgets = []
+
+    def ask(self, conversation, stream=False):
+        self.budgets.append(conversation.time_remaining())
+        time.sleep(self.delay)
+        conversation.messages.append({"role": "assistant", "name": self.id, "content": "Done."})
+        return "done"
+
+
+class FakeClient:
+    """Stand-in for the AzureOpenAI client, recording the request timeouts."""
+
+    def __init__(self):
+        self.timeouts = []
+        self.chat = self
+        self.completions = self
+
+    def create(self, **kwargs):
+        self.timeouts.append(kwargs.get("timeout"))
+        return ChatCompletion(
+            id="completion",
+            object="chat.completion",
+            created=0,
+            model="fake",
+            choices=[
+                {
+                    "index": 0,
+                    "finish_reason": "stop",
+                    "message": {"role": "assistant", "content": "Hello!"},
+                }
+            ],
+            usage={"completion_tokens": 1, "prompt_tokens": 1, "total_tokens": 2},
+        )
+
+
+class LegacyLLM(LLM):
+    """LLM written before the timeout and cancellation arguments existed, failing after a delay when given an error."""
+
+    def __init__(self, error: Exception = None, delay: float = 0):
+        super().__init__({})
+        self.error = error
+        self.delay = delay
+
+    def ask(self, messages, tools=None, tools_function=None, temperature=0.7, response_format=None):
+        time.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return ChatCompletionMessage(role="assistant", content="Hello!"), None
+
+    def ask_stream(self, messages, tools=None, tools_function=None, temperature=0.7):
+        yield ["start", ""]
+        yield ["response", [{"role": "assistant", "content": "Hello!"}, None]]
+        yield ["end", ""]
+
+
+def _fake_llm() -> AzureOpenAILLM:
+    llm = AzureOpenAILLM(
+        {
+            "azure_deployment": "fake",
+            "azure_endpoint": "http://localhost:1",
+            "api_key": "fake",
+            "api_version": "2024-08-01-preview",
+        }
+    )
+    llm.client = FakeClient()
+    return llm
+
+
+class TestDeadline(unittest.TestCase):
+
+    def setUp(self):
+        logging.basicConfig(level=logging.INFO)
+
+    def test_sequence_cut(self):
+        steps = [SlowAskable(f"step{i}", "Slow", 0.1) for i in range(10)]
+        sequence = Sequence(llm=None, description="Sequence", id="sequence", steps=steps)
+        workflow = Workflow(askable=sequence, conversation=Conversation(messages=[], variables={}), timeout=0.25)
+
+        start = time.monotonic()
+        result = workflow.run("Hello")
+
+        self.assertEqual(result, "deadline-exceeded")
+        self.assertLess(time.monotonic() - start, 0.6)
+        self.assertEqual(sum(len(step.budgets) for step in steps), 3)
+        self.assertEqual(workflow.conversation.log.last(kind="sequence/deadline-exceeded").source, "sequence")
+
+        # Each run gets its own budget
+        steps[0].budgets.clear()
+        workflow.timeout = None
+        sequence.steps = steps[:1]
+        self.assertEqual(workflow.run("Hello"), None)
+        self.assertEqual(steps[0].budgets, [None])
+
+    def test_llm_timeout(self):
+        llm = _fake_llm()
+        agent = Agent(id="agent", description="Agent", system_message="Talk", llm=llm)
+        workflow = Workflow(askable=agent, conversation=Conversation(messages=[], variables={}), timeout=5)
+
+        self.assertEqual(workflow.run("Hello"), "done")
+        self.assertTrue(0 < llm.client.timeouts[0] <= 5)
+
+        workflow.timeout = 0
+        self.assertEqual(workflow.run("Hello"), "deadline-exceeded")
+        self.assertEqual(len(llm.client.timeouts), 1, "Expected no LLM call past the deadline")
+        self.assertEqual(workflow.conversation.log.last(kind="agent/deadline-exceeded").source, "agent")
+
+    def test_legacy_llm(self):
+        agent = Agent(id="agent", description="Agent", system_message="Talk", llm=LegacyLLM())
+        workflow = Workflow(askable=agent, conversation=Conversation(messages=[], variables={}), timeout=5)
+
+        self.assertEqual(workflow.run("Hello"), "done")
+        self.assertEqual(list(workflow.run_stream("Hello"))[-1], ["result", "done"])
+
+        # Only timeouts are reported as exceeding the deadline
+        for error, expected in [(ValueError("Invalid request"), "error"), (TimeoutError(), "deadline-exceeded")]:
+            agent.llm = LegacyLLM(error, delay=0.2)
+            workflow = Workflow(askable=agent, conversation=Conversation(messages=[], variables={}), timeout=0.1)
+            self.assertEqual(workflow.run("Hello"), expected)
+
+    def test_remote_budget(self):
+        askable = SlowAskable("slow", "Slow", 0)
+        rest_host = RESTHost(askables=[askable], host="127.0.0.1", port=5018)
+        grpc_host = GRPCHost(askables=[askable], host="127.0.0.1", port=5019)
+        rest_host.start()
+        grpc_host.start()
+
+        try:
+            for connection in [RESTConnection(url="http://localhost:5018"), GRPCConnection(url="localhost:5019")]:
+                remote = RemoteAskable(id="slow", connection=connection)
+                for stream in [False, True]:
+                    askable.budgets.clear()
+                    workflow = Workflow(askable=remote, conversation=Conversation(messages=[], variables={}), timeout=5)
+                    if stream:
+                        updates = list(workflow.run_stream("Hello"))
+                        self.assertEqual(updates[-1], ["result", "done"])
+                    else:
+                        self.assertEqual(workflow.run("Hello"), "done")
+                    # gRPC rounds the deadline up on the wire
+                    self.assertTrue(0 < askable.budgets[0] <= 5.1, f"Unexpected budget {askable.budgets}")
+
+                    # No deadline is forwarded when the run has none
+                    askable.budgets.clear()
+                    workflow = Workflow(askable=remote, conversation=Conversation(messages=[], variables={}))
+                    workflow.run("Hello")
+                    self.assertEqual(askable.budgets, [None])
+        finally:
+            rest_host.stop()
+            grpc_host.stop()
+
+    def test_remote_cut(self):
+        askable = SlowAskable("slow", "Slow", 1)
+        host = GRPCHost(askables=[askable], host="127.0.0.1", port=5020)
+        host.start()
+
+        try:
+            remote = RemoteAskable(id="slow", connection=GRPCConnection(url="localhost:5020"))
+            workflow = Workflow(askable=remote, conversation=Conversation(messages=[], variables={}), timeout=0.2)
+
+            start = time.monotonic()
+            result = workflow.run("Hello")
+        finally:
+            host.stop()
+
+        self.assertEqual(result, "deadline-exceeded")
+        self.assertLess(time.monotonic() - start, 0.9)
+        self.assertEqual(workflow.conversation.log.last(kind="remote/deadline-exceeded").source, "slow")
+
+
+if __name__ == "__main__":
+    unittest.main()
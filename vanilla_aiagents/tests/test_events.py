@@ -0,0 +1,137 @@
+import threading
+import time
+import unittest
+import os, logging, sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from vanilla_aiagents.conversation import Conversation
+from vanilla_aiagents.events import EventBus, StreamChannel
+
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+
+class TestEvents(unittest.TestCase):
+
+    def setUp(self):
+        logging.basicConfig(level=logging.INFO)
+
+    def test_fan_out(self):
+        conversation = Conversation(messages=[], variables={})
+        ui = conversation.subscribe()
+        audit = conversation.subscribe()
+
+        conversation.update(["start", "agent"])
+        conversation.update(["delta", {"content": "Hello"}])
+        conversation.update(["end", "agent"])
+        conversation.events.close()
+
+        expected = [["start", "agent"], ["delta", {"content": "Hello"}], ["end", "agent"]]
+        self.assertEqual(list(ui), expected)
+        self.assertEqual(list(audit), expected)
+        self.assertEqual(list(conversation.subscribe(replay=True)), expected)
+
+    def test_slow_subscriber(self):
+        bus = EventBus(capacity=100)
+        fast = bus.subscribe()
+        slow = bus.subscribe()
+        received = []
+
+        def consume():
+            for event in fast:
+                received.append(event)
+
+        thread = threading.Thread(target=consume)
+        thread.start()
+
+        start = time.time()
+        for i in range(10_000):
+            bus.publish(["delta", i])
+            if i % 50 == 49:
+                # Pace the producer on the fast subscriber only
+                while fast.cursor <= i:
+                    time.sleep(0.0001)
+        bus.close()
+        elapsed = time.time() - start
+        thread.join()
+
+        # The slow subscriber never read, yet the producer and the fast subscriber were not blocked
+        self.assertLess(elapsed, 5)
+        self.assertEqual(len(received), 10_000)
+        self.assertEqual(received[-1], ["delta", 9999])
+
+        remaining = list(slow)
+        self.assertEqual(len(remaining), 100, "Expected slow subscriber to read only the retained events")
+        self.assertEqual(slow.dropped, 9_900)
+        self.assertEqual(remaining[0], ["delta", 9900])
+
+    def test_channel_block(self):
+        channel = StreamChannel(maxsize=2, policy="block")
+        channel.put(["start", "agent"])
+        channel.put(["delta", {"content": "a"}])
+
+        producer = threading.Thread(target=lambda: channel.put(["delta", {"content": "b"}]))
+        producer.start()
+        time.sleep(0.1)
+        self.assertTrue(producer.is_alive(), "Expected producer to be blocked on a full channel")
+
+        self.assertEqual(channel.get(), ["start", "agent"])
+        producer.join(timeout=1)
+        self.assertFalse(producer.is_alive())
+        self.assertEqual(len(channel), 2)
+
+    def test_channel_coalesce(self):
+        conversation = Conversation(messages=[], variables={}, stream_maxsize=3, stream_policy="coalesce")
+        conversation.update(["start", "agent"])
+        for token in ["The ", "capital ", "is ", "Paris."]:
+            conversation.update(["delta", {"content": token, "role": None}])
+        conversation.update(["response", [{"content": "The capital is Paris."}, None]])
+        conversation.stream_channel.close()
+
+        events = []
+        while True:
+            try:
+                events.append(conversation.stream_channel.get(timeout=1))
+            except Exception:
+                break
+
+        self.assertEqual([mark for mark, _ in events], ["start", "delta", "delta", "response"])
+        self.assertEqual("".join(content["content"] for mark, content in events if mark == "delta"), "The capital is Paris.")
+        self.assertEqual(conversation.stream_channel.coalesced, 2)
+
+    def test_channel_coalesce_tool_calls(self):
+        channel = StreamChannel(maxsize=1, policy="coalesce")
+
+        def tool_call(index, arguments, id=None, name=None):
+            return ["delta", {"content": None, "tool_calls": [{"index": index, "id": id, "function": {"arguments": arguments, "name": name}}]}]
+
+        channel.put(tool_call(0, "", id="call_1", name="lookup"))
+        for fragment in ['{"city"', ': "Par', 'is"}']:
+            channel.put(tool_call(0, fragment))
+
+        self.assertEqual(channel.coalesced, 3)
+        self.assertEqual(channel.get_nowait(), tool_call(0, '{"city": "Paris"}', id="call_1", name="lookup"))
+        self.assertTrue(channel.empty())
+
+        channel.put(tool_call(0, "{}"))
+        producer = threading.Thread(target=lambda: channel.put(tool_call(1, "", id="call_2", name="lookup")))
+        producer.start()
+        time.sleep(0.1)
+        self.assertTrue(producer.is_alive(), "Expected the first delta of another tool call not to be merged")
+        channel.get()
+        producer.join(timeout=1)
+        self.assertEqual(channel.qsize(), 1)
+
+    def test_stream_queue(self):
+        conversation = Conversation(messages=[], variables={})
+
+        with self.assertWarns(DeprecationWarning):
+            queue = conversation.stream_queue
+        queue.put_nowait(["start", "agent"])
+        self.assertEqual(conversation.stream_channel.get_nowait(), ["start", "agent"])
+
+
+if __name__ == "__main__":
+    unittest.main()
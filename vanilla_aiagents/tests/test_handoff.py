@@ -0,0 +1,125 @@
+import unittest
+import os, logging, sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from vanilla_aiagents.agent import Agent, handoff_tool_name, handoff_tools
+from vanilla_aiagents.conversation import Conversation
+from vanilla_aiagents.llm import LLM
+from vanilla_aiagents.team import Team
+from vanilla_aiagents.workflow import Workflow
+from tests.helpers import OrchestratorLLM, reply_agent, team_choices
+
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+
+class TestHandoff(unittest.TestCase):
+
+    def setUp(self):
+        logging.basicConfig(level=logging.INFO)
+        self.triage = reply_agent("triage", target="billing")
+        self.billing = reply_agent("billing", target="support")
+        self.support = reply_agent("support")
+
+    def _team(self, orchestrator: LLM, allowed_transitions=None, turns: int = 4) -> Team:
+        return Team(
+            id="team",
+            description="Call center",
+            members=[self.triage, self.billing, self.support],
+            llm=orchestrator,
+            allowed_transitions=allowed_transitions,
+            stop_callback=lambda conversation: len(conversation.messages) > turns,
+            routers=[],
+            handoff=True,
+        )
+
+    def test_handoff(self):
+        orchestrator = OrchestratorLLM("triage")
+        team = self._team(orchestrator)
+        workflow = Workflow(team)
+
+        workflow.run("I was charged twice")
+
+        self.assertEqual([message.get("name") for message in workflow.conversation.messages[2:]], ["triage", "billing", "support"])
+        self.assertEqual(team_choices(workflow.conversation), [("triage", "llm"), ("billing", "handoff"), ("support", "handoff")])
+        self.assertEqual(orchestrator.calls, 1, "Expected only the first choice, with no handoff, to need the LLM")
+        self.assertEqual(self.triage.llm.calls + self.billing.llm.calls + self.support.llm.calls, 3)
+        self.assertIn(("info", "agent/handoff", "triage", "billing"), workflow.conversation.log)
+        self.assertEqual(
+            self.triage.llm.tools,
+            ["handoff_to_billing", "handoff_to_support", "update_conversation_variable"],
+        )
+
+    def test_handoff_ends_turn(self):
+        handoffs = handoff_tools(self.triage.id, [self.billing])
+        for stream in [False, True]:
+            conversation = Conversation(messages=[{"role": "user", "content": "I was charged twice"}])
+            calls = self.triage.llm.calls
+            with self.triage.handing_off(handoffs):
+                self.assertEqual(self.triage.ask(conversation, stream=stream), "done")
+
+            self.assertEqual(self.triage.llm.calls - calls, 1, "Expected no completion after the handoff")
+            self.assertEqual(conversation.messages[-1]["name"], "triage")
+            self.assertEqual(conversation.messages[-1]["content"], "Conversation handed off to billing")
+            self.assertNotIn("tool_calls", {k for k, v in conversation.messages[-1].items() if v})
+            self.assertIn(("info", "agent/handoff", "triage", "billing"), conversation.log)
+
+    def test_no_handoff(self):
+        orchestrator = OrchestratorLLM("support")
+        team = self._team(orchestrator, turns=3)
+        workflow = Workflow(team)
+
+        workflow.run("Hello")
+
+        self.assertEqual(team_choices(workflow.conversation), [("support", "llm"), ("support", "llm")])
+        self.assertEqual(orchestrator.calls, 2)
+
+    def test_allowed_transitions(self):
+        team = self._team(OrchestratorLLM("triage"), allowed_transitions={self.triage: [self.support]})
+
+        self.assertEqual(list(team.handoffs["triage"]), ["handoff_to_support"])
+        self.assertEqual(
+            list(team.handoffs["support"]),
+            ["handoff_to_triage", "handoff_to_billing"],
+            "Expected agents without transitions to hand off to all the other members",
+        )
+
+    def test_members_unchanged(self):
+        self._team(OrchestratorLLM("triage"))
+        other = Team(
+            id="other",
+            description="Billing only",
+            members=[self.billing, self.support],
+            llm=OrchestratorLLM("billing"),
+            allowed_transitions={self.billing: [self.billing]},
+            stop_callback=lambda conversation: len(conversation.messages) > 2,
+            routers=[],
+            handoff=True,
+        )
+
+        self.assertEqual(self.billing.handoffs, {}, "Expected the team not to change its members")
+        self.assertEqual([tool["function"]["name"] for tool in self.billing.compile().tools], ["update_conversation_variable"])
+
+        Workflow(other).run("Hello")
+        self.assertEqual(self.billing.llm.tools, ["update_conversation_variable"], "Expected each team to offer its own handoffs")
+
+        conversation = Conversation(messages=[{"role": "user", "content": "Hello"}])
+        self.billing.ask(conversation)
+        self.assertEqual(self.billing.llm.tools, ["update_conversation_variable"], "Expected no handoff outside of a team")
+
+    def test_sanitized_names(self):
+        agent = reply_agent("order lookup")
+        handoffs = handoff_tools(agent.id, [self.billing, Agent(id="order lookup", description="Itself", system_message="", llm=agent.llm)])
+
+        self.assertEqual(handoff_tool_name("order lookup"), "handoff_to_order_lookup")
+        self.assertEqual(list(handoffs), ["handoff_to_billing"], "Expected no handoff to the agent itself")
+        with agent.handing_off(handoffs):
+            tools, _ = agent._prepare_llm_tools(Conversation())
+        self.assertIn("billing", tools[0]["function"]["description"])
+        self.assertEqual(agent.handoffs, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
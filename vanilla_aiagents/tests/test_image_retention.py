@@ -0,0 +1,111 @@
+import json
+import unittest
+import os, logging, sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from vanilla_aiagents.blobs import InMemoryBlobStore, externalize_message
+from vanilla_aiagents.conversation import (
+    AllMessagesStrategy,
+    Conversation,
+    ImageRetentionStrategy,
+    LastNMessagesStrategy,
+    PipelineConversationReadingStrategy,
+)
+from vanilla_aiagents.workflow import WorkflowInput
+
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+
+class TestImageRetention(unittest.TestCase):
+
+    def setUp(self):
+        logging.basicConfig(level=logging.INFO)
+
+        data = WorkflowInput(text="What is wrong with my phone?", images=[])
+        data.add_image_file(os.path.join(os.path.dirname(__file__), "iphone_sim_error.jpg"))
+
+        self.conversation = Conversation(
+            messages=[
+                {"role": "system", "content": ""},
+                data.to_message(),
+                {"role": "assistant", "name": "agent", "content": "Your SIM card is not detected."},
+                {"role": "user", "name": "user", "content": "How do I fix it?"},
+                {"role": "assistant", "name": "agent", "content": "Try reinserting the SIM card."},
+            ],
+            variables={},
+        )
+
+    def test_keeps_recent_images(self):
+        strategy = ImageRetentionStrategy(max_turns=2)
+        result = strategy.get_messages(self.conversation)
+
+        self.assertEqual(result, AllMessagesStrategy().get_messages(self.conversation))
+        self.assertEqual(strategy.metrics.images_replaced, 0)
+
+    def test_replaces_old_images(self):
+        strategy = ImageRetentionStrategy(max_turns=1)
+        result = strategy.get_messages(self.conversation)
+
+        self.assertEqual(len(result), 4)
+        self.assertEqual(result[0]["content"][1], {"type": "text", "text": "[image omitted]"})
+        self.assertEqual(
+            self.conversation.messages[1]["content"][1]["type"],
+            "image_url",
+            "Expected original message not to be modified",
+        )
+
+        original_bytes = len(json.dumps(AllMessagesStrategy().get_messages(self.conversation)))
+        retained_bytes = len(json.dumps(result))
+        logging.info(
+            "Payload bytes: %d -> %d, estimated prompt tokens saved: %d",
+            original_bytes,
+            retained_bytes,
+            strategy.metrics.tokens_saved,
+        )
+        self.assertEqual(strategy.metrics.images_replaced, 1)
+        # Savings are measured on the URL size, JSON framing is not accounted for
+        self.assertAlmostEqual(strategy.metrics.bytes_saved, original_bytes - retained_bytes, delta=100)
+        self.assertGreater(strategy.metrics.tokens_saved, 0)
+
+    def test_caption_cache(self):
+        calls = []
+
+        def captioner(url):
+            calls.append(url)
+            return "iPhone showing a 'No SIM' error"
+
+        strategy = PipelineConversationReadingStrategy(
+            [ImageRetentionStrategy(max_turns=1, captioner=captioner), LastNMessagesStrategy(n=4)]
+        )
+        strategy.get_messages(self.conversation)
+        result = strategy.get_messages(self.conversation)
+
+        self.assertEqual(len(calls), 1, "Expected the image to be captioned only once")
+        self.assertEqual(result[0]["content"][1]["text"], "[image: iPhone showing a 'No SIM' error]")
+        self.assertEqual(strategy.strategies[0].metrics.images_replaced, 1, "Expected the image to be counted only once")
+
+    def test_blob_references(self):
+        store = InMemoryBlobStore()
+        conversation = Conversation(messages=[externalize_message(message, store) for message in self.conversation.messages], blob_store=store)
+        strategy = ImageRetentionStrategy(max_turns=1)
+
+        strategy.get_messages(conversation)
+
+        self.assertTrue(conversation.messages[1]["content"][1]["image_url"]["url"].startswith("blob:"))
+        original_url = self.conversation.messages[1]["content"][1]["image_url"]["url"]
+        self.assertEqual(strategy.metrics.bytes_saved, len(original_url) - len("[image omitted]"), "Expected the savings of the resolved image")
+
+    def test_max_images(self):
+        strategy = ImageRetentionStrategy(max_turns=0, max_images=2)
+        for i in range(3):
+            strategy.get_messages(Conversation(messages=[{"role": "user", "content": [{"type": "image_url", "image_url": {"url": f"https://example.com/{i}.jpg"}}]}]))
+
+        self.assertEqual(len(strategy._replaced), 2)
+        self.assertEqual(strategy.metrics.images_replaced, 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,140 @@
+import random
+import time
+import unittest
+import os, logging, sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from vanilla_aiagents.conversation import Conversation
+from vanilla_aiagents.log import ConversationLog
+from vanilla_aiagents.routing import TransitionGraphRouter
+from vanilla_aiagents.routing import LearnedRouter, routing_examples
+from vanilla_aiagents.team import Team
+from vanilla_aiagents.workflow import Workflow
+from tests.helpers import OrchestratorLLM, reply_agent, team_choices
+
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+
+TOPICS = {
+    "billing": ["refund", "invoice", "charged", "payment", "bill"],
+    "support": ["wifi", "router", "internet", "connection", "outage"],
+    "sales": ["upgrade", "plan", "offer", "buy", "subscription"],
+}
+FILLERS = ["hello", "please", "my", "the", "is", "help", "today", "again", "thanks"]
+
+
+def _request(rng: random.Random, topic: str) -> str:
+    words = rng.sample(TOPICS[topic], 2) + rng.sample(FILLERS, 4)
+    rng.shuffle(words)
+    return " ".join(words)
+
+
+def _logged_conversation(rng: random.Random) -> Conversation:
+    """A conversation of two routed turns, as logged by a team."""
+    conversation = Conversation(messages=[{"role": "system", "content": ""}])
+    for _ in range(2):
+        topic = rng.choice(list(TOPICS))
+        conversation.append_messages({"role": "user", "name": "user", "content": _request(rng, topic)})
+        conversation.log.append(("info", "team/choice", "team", topic, "llm"))
+        conversation.append_messages({"role": "assistant", "name": topic, "content": f"Reply from {topic}"})
+    # An invalid choice, and a choice of another team, are not learned
+    conversation.log.append(("error", "team/choice", "team", "unknown"))
+    conversation.log.append(("info", "team/choice", "other", "billing", "llm"))
+    return conversation
+
+
+class TestLearnedRouter(unittest.TestCase):
+
+    def setUp(self):
+        logging.basicConfig(level=logging.INFO)
+        rng = random.Random(0)
+        self.conversations = [_logged_conversation(rng) for _ in range(150)]
+
+    def test_routing_examples(self):
+        examples = routing_examples(self.conversations[0], team_id="team")
+
+        self.assertEqual(len(examples), 2)
+        messages, agent_id = examples[1]
+        self.assertEqual(len(messages), 4)
+        self.assertEqual(messages[-1]["role"], "user")
+        self.assertEqual(agent_id, self.conversations[0].messages[4]["name"])
+
+        evicted = Conversation(messages=self.conversations[0].messages)
+        evicted.log = ConversationLog(self.conversations[0].log, capacity=3)
+        self.assertEqual(routing_examples(evicted), [], "Expected decisions not to be paired once log events are evicted")
+
+        routed = Conversation(messages=[{"role": "system", "content": ""}])
+        for agent_id, reason in [("billing", "router:learned"), ("support", "llm")]:
+            routed.append_messages({"role": "user", "name": "user", "content": "Help"})
+            routed.log.append(("info", "team/choice", "team", agent_id, reason))
+            routed.append_messages({"role": "assistant", "name": agent_id, "content": f"Reply from {agent_id}"})
+        examples = routing_examples(routed, team_id="team")
+        self.assertEqual([agent_id for _, agent_id in examples], ["support"], "Expected the router's own decisions not to be learned")
+        self.assertEqual(len(examples[0][0]), 4)
+
+    def test_fit(self):
+        router = LearnedRouter(threshold=0.6)
+
+        report = router.fit(self.conversations, team_id="team")
+
+        logging.info("Learned router report: %s", report)
+        self.assertEqual(report.examples, 300)
+        self.assertEqual(router.classes, ["billing", "sales", "support"])
+        self.assertGreater(report.accuracy, 0.95)
+        self.assertGreater(report.coverage, 0.5)
+        self.assertGreater(report.confident_accuracy, 0.95)
+
+        conversation = Conversation(messages=[{"role": "user", "name": "user", "content": "I want a refund for my last invoice"}])
+        self.assertEqual(router.predict(conversation)[0], "billing")
+        agent_id, probability = router.predict(conversation, ["sales", "support"])
+        self.assertIn(agent_id, ["sales", "support"])
+        self.assertLess(probability, router.threshold, "Expected the probability not to be renormalized over the candidates")
+        self.assertIsNone(router.route(conversation, ["sales", "support"]))
+        self.assertEqual(router.predict(conversation, ["triage"]), (None, 0.0))
+
+        calls = 1000
+        start = time.perf_counter()
+        for _ in range(calls):
+            router.route(conversation, ["billing", "sales", "support"])
+        elapsed = (time.perf_counter() - start) / calls
+        logging.info("Learned routing decision: %.1f us", elapsed * 1e6)
+        self.assertLess(elapsed, 1e-3)
+
+    def test_fallback(self):
+        router = LearnedRouter(threshold=0.6)
+        router.fit(self.conversations, team_id="team")
+        orchestrator = OrchestratorLLM("support")
+        team = Team(
+            id="team",
+            description="Call center",
+            members=[reply_agent(topic) for topic in TOPICS],
+            llm=orchestrator,
+            stop_callback=lambda conversation: len(conversation.messages) > 2,
+            routers=[TransitionGraphRouter(), router],
+        )
+
+        workflow = Workflow(team)
+        workflow.run("I was charged twice, please refund the payment")
+        self.assertEqual(team_choices(workflow.conversation), [("billing", "router:learned")])
+
+        workflow = Workflow(team)
+        workflow.run("Something completely unrelated")
+        self.assertEqual(team_choices(workflow.conversation), [("support", "llm")])
+
+        report = router.report()
+        self.assertEqual((report.routed, report.fallbacks, report.fallback_rate), (1, 1, 0.5))
+        self.assertEqual(orchestrator.calls, 1)
+
+    def test_not_fitted(self):
+        router = LearnedRouter()
+
+        self.assertIsNone(router.route(Conversation(messages=[{"role": "user", "content": "refund"}]), ["billing"]))
+        with self.assertRaises(ValueError):
+            router.fit([Conversation()])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+import json
+import pickle
+import tracemalloc
+import unittest
+import os, logging, sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from vanilla_aiagents.conversation import Conversation, LastNMessagesStrategy
+from vanilla_aiagents.messages import Message, MessageList, as_dicts
+
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+
+def _session_payload(session: int) -> str:
+    # Serialized payload, so that decoded strings are not shared across messages, as in real sessions
+    return json.dumps(
+        [
+            {"role": "system", "content": ""},
+            *[
+                message
+                for turn in range(5)
+                for message in (
+                    {"role": "user", "name": "user", "content": f"Question {turn} of session {session}"},
+                    {"role": "assistant", "name": "agent", "content": f"Answer {turn} of session {session}"},
+                )
+            ],
+        ]
+    )
+
+
+def _measure(compact: bool, sessions: int) -> int:
+    payloads = [_session_payload(i) for i in range(sessions)]
+    tracemalloc.start()
+    conversations = [
+        Conversation(messages=json.loads(payload), variables={}, log=[], compact=compact)
+        for payload in payloads
+    ]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del conversations
+    return size
+
+
+class TestMessages(unittest.TestCase):
+
+    def setUp(self):
+        logging.basicConfig(level=logging.INFO)
+
+    def test_message(self):
+        source = {"role": "assistant", "name": "agent", "content": "Hi!", "tool_calls": None}
+        message = Message.from_dict(source)
+
+        self.assertEqual(message["role"], "assistant")
+        self.assertEqual(message.get("tool_calls"), None)
+        self.assertEqual(message, {"role": "assistant", "name": "agent", "content": "Hi!"})
+        self.assertEqual(pickle.loads(pickle.dumps(message)), message)
+        with self.assertRaises(AttributeError):
+            message.content = "changed"
+
+    def test_compact_conversation(self):
+        conversation = Conversation(messages=[{"role": "system", "content": ""}], variables={}, compact=True)
+        conversation.messages.append({"role": "user", "name": "user", "content": [{"type": "text", "text": "Hello"}]})
+        conversation.messages += [{"role": "assistant", "name": "agent", "content": "Hi!"}]
+        conversation.messages[-1] = {"role": "assistant", "name": "agent", "content": "Hello!"}
+
+        self.assertIsInstance(conversation.messages, MessageList)
+        self.assertTrue(all(isinstance(m, Message) for m in conversation.messages))
+        self.assertIsInstance(conversation.fork().messages, MessageList)
+
+        messages = conversation.resolve_messages(LastNMessagesStrategy(n=2).get_messages(conversation))
+        self.assertEqual(
+            messages,
+            [
+                {"role": "user", "name": "user", "content": [{"type": "text", "text": "Hello"}]},
+                {"role": "assistant", "name": "agent", "content": "Hello!"},
+            ],
+        )
+        self.assertTrue(all(type(m) is dict for m in messages))
+        json.dumps(conversation.to_dict())
+
+    def test_memory_benchmark(self):
+        sessions = 10_000
+        dict_size = _measure(compact=False, sessions=sessions)
+        compact_size = _measure(compact=True, sessions=sessions)
+
+        logging.info(
+            "Memory for %d idle sessions: dict messages %.1f MB, compact messages %.1f MB",
+            sessions,
+            dict_size / 1e6,
+            compact_size / 1e6,
+        )
+        self.assertLess(compact_size, dict_size)
+
+
+if __name__ == "__main__":
+    unittest.main()
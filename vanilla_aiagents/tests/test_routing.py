@@ -0,0 +1,123 @@
+import re
+import unittest
+import os, logging, sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from vanilla_aiagents.conversation import Conversation
+from vanilla_aiagents.llm import LLM
+from vanilla_aiagents.routing import RuleRouter, TransitionGraphRouter, UserInputRouter
+from vanilla_aiagents.team import Team
+from vanilla_aiagents.workflow import Workflow
+from tests.helpers import OrchestratorLLM, reply_agent, team_choices
+
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+
+class TestRouting(unittest.TestCase):
+
+    def setUp(self):
+        logging.basicConfig(level=logging.INFO)
+        self.triage = reply_agent("triage")
+        self.billing = reply_agent("billing")
+        self.support = reply_agent("support")
+
+    def _team(self, orchestrator: LLM, routers=None, allowed_transitions=None, turns: int = 4) -> Team:
+        return Team(
+            id="team",
+            description="Call center",
+            members=[self.triage, self.billing, self.support],
+            llm=orchestrator,
+            allowed_transitions=allowed_transitions,
+            stop_callback=lambda conversation: len(conversation.messages) > turns,
+            routers=routers,
+        )
+
+    def test_transition_graph(self):
+        orchestrator = OrchestratorLLM("triage")
+        team = self._team(
+            orchestrator,
+            allowed_transitions={self.triage: [self.billing], self.billing: [self.support], self.support: [self.triage]},
+        )
+        workflow = Workflow(team)
+
+        workflow.run("I was charged twice")
+
+        self.assertEqual([message.get("name") for message in workflow.conversation.messages[2:]], ["triage", "billing", "support"])
+        self.assertEqual(orchestrator.calls, 1, "Expected only the first choice, with no current agent, to need the LLM")
+        self.assertEqual(
+            team_choices(workflow.conversation),
+            [("triage", "llm"), ("billing", "router:transition-graph"), ("support", "router:transition-graph")],
+        )
+
+    def test_allowed_transitions(self):
+        team = self._team(OrchestratorLLM("triage"), allowed_transitions={self.triage: [self.billing, self.support]})
+
+        first, second = Conversation(), Conversation()
+
+        self.assertEqual(team.candidates(first), ["triage", "billing", "support"])
+        first.log.append(("info", "team/choice", "team", "triage", "llm"))
+        self.assertEqual(team.candidates(first), ["billing", "support"])
+        self.assertEqual(team.candidates(second), ["triage", "billing", "support"], "Expected conversations not to share the current agent")
+        first.log.append(("info", "team/choice", "other", "billing", "llm"))
+        first.log.append(("error", "team/choice", "team", "billing"))
+        self.assertEqual(team.candidates(first), ["billing", "support"], "Expected only the valid choices of the team to count")
+        first.log.append(("info", "team/choice", "team", "billing", "llm"))
+        self.assertEqual(team.candidates(first), ["triage", "billing", "support"], "Expected agents without transitions to allow all")
+
+    def test_invalid_choice(self):
+        orchestrator = OrchestratorLLM("triage", "triage", "billing")
+        team = self._team(orchestrator, routers=[], allowed_transitions={self.triage: [self.billing, self.support]}, turns=3)
+        workflow = Workflow(team)
+
+        workflow.run("Hello")
+
+        self.assertEqual(orchestrator.calls, 3, "Expected the not allowed choice to be asked again")
+        self.assertEqual(
+            [(event.level, event.payload[0]) for event in workflow.conversation.log if event.kind == "team/choice"],
+            [("info", "triage"), ("info", "triage"), ("error", "triage"), ("info", "billing")],
+        )
+
+    def test_chain(self):
+        orchestrator = OrchestratorLLM("support")
+        team = self._team(
+            orchestrator,
+            routers=[
+                RuleRouter([(r"\b(refund|charged)\b", "billing"), (re.compile("WIFI"), "support")]),
+                UserInputRouter([self.triage]),
+                TransitionGraphRouter(),
+            ],
+            turns=2,
+        )
+
+        for text, expected, reason in [
+            ("I was charged twice", "billing", "router:rules"),
+            ("My wifi is down", "triage", "router:user-input"),
+            ("My WIFI is down", "support", "router:rules"),
+        ]:
+            workflow = Workflow(team)
+            workflow.run(text)
+            self.assertEqual(team_choices(workflow.conversation), [(expected, reason)])
+
+        self.assertEqual(orchestrator.calls, 0)
+
+        # Not a user message, no rule matches: the LLM decides
+        conversation = Conversation(messages=[{"role": "system", "content": ""}, {"role": "assistant", "name": "triage", "content": "Hello"}])
+        team.ask(conversation)
+        self.assertEqual(team_choices(conversation), [("support", "llm")])
+        self.assertEqual(orchestrator.calls, 1)
+
+    def test_predicate_rule(self):
+        router = RuleRouter([(lambda conversation: "ORDER_ID" not in conversation.variables, "support")], name="missing-order")
+        conversation = Conversation(messages=[{"role": "user", "content": "Where is my order?"}])
+
+        self.assertEqual(router.route(conversation, ["billing", "support"]), "support")
+        self.assertIsNone(router.route(conversation, ["billing"]), "Expected rules for not allowed agents to be skipped")
+        conversation.set_variable("ORDER_ID", "42")
+        self.assertIsNone(router.route(conversation, ["billing", "support"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
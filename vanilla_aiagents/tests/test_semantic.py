@@ -0,0 +1,127 @@
+import unittest
+import os, logging, sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from vanilla_aiagents.conversation import (
+    AllMessagesStrategy,
+    Conversation,
+    PipelineConversationReadingStrategy,
+)
+from vanilla_aiagents.semantic import (
+    Embedder,
+    HashingEmbedder,
+    SemanticRelevanceStrategy,
+    VectorIndex,
+)
+
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+
+class CountingEmbedder(Embedder):
+    """HashingEmbedder recording the embedded texts."""
+
+    def __init__(self):
+        self.embedder = HashingEmbedder()
+        self.texts = []
+
+    def embed(self, texts):
+        self.texts.extend(texts)
+        return self.embedder.embed(texts)
+
+
+class TestSemantic(unittest.TestCase):
+
+    def setUp(self):
+        logging.basicConfig(level=logging.INFO)
+        logging.getLogger("vanilla_aiagents.semantic").setLevel(logging.DEBUG)
+
+        self.conversation = Conversation(
+            messages=[
+                {"role": "system", "content": ""},
+                {"role": "user", "name": "user", "content": "My router model is X200 and the wifi keeps dropping"},
+                {"role": "assistant", "name": "agent", "content": "Sorry to hear that, let me check the X200 router firmware."},
+                {"role": "user", "name": "user", "content": "Also, can you update my billing address?"},
+                {"role": "assistant", "name": "agent", "content": "Sure, your billing address has been updated."},
+                {"role": "user", "name": "user", "content": "What is the weather like today?"},
+                {"role": "assistant", "name": "agent", "content": "I cannot check the weather, sorry."},
+                {"role": "user", "name": "user", "content": "Thanks, anything else?"},
+                {"role": "assistant", "name": "agent", "content": "No, that's all."},
+                {"role": "user", "name": "user", "content": "The wifi on my X200 router is dropping again"},
+            ],
+            variables={},
+        )
+
+    def test_hashing_embedder(self):
+        embedder = HashingEmbedder(dim=64)
+        vectors = embedder.embed(["hello world", "hello world", "something else"])
+
+        self.assertEqual(vectors.shape, (3, 64))
+        self.assertTrue((vectors[0] == vectors[1]).all(), "Expected deterministic embeddings")
+
+    def test_vector_index(self):
+        embedder = HashingEmbedder(dim=128)
+        index = VectorIndex(initial_capacity=1)
+        index.add(embedder.embed(["router firmware", "billing address"]))
+        index.add(embedder.embed(["weather forecast"]))
+
+        self.assertEqual(len(index), 3)
+        hits = index.search(embedder.embed(["billing address change"])[0], k=1)
+        self.assertEqual(hits[0][0], 1, "Expected the billing message to be the best match")
+
+    def test_semantic_relevance(self):
+        strategy = SemanticRelevanceStrategy(k=2, n=1)
+        result = strategy.get_messages(self.conversation)
+
+        self.assertEqual(len(result), 3, "Expected top 2 plus the last message")
+        self.assertEqual(result[-1], self.conversation.messages[-1], "Expected last message to be included")
+        self.assertIn("X200", result[0]["content"], "Expected the relevant router message first")
+        self.assertNotIn("weather", " ".join(m["content"] for m in result))
+
+    def test_incremental_index(self):
+        strategy = SemanticRelevanceStrategy(k=2, n=1)
+        strategy.get_messages(self.conversation)
+        index = strategy._indexes[self.conversation].index
+        self.assertEqual(len(index), 9)
+
+        self.conversation.messages.append(
+            {"role": "assistant", "name": "agent", "content": "Let me reset the X200."}
+        )
+        strategy.get_messages(self.conversation)
+        self.assertEqual(len(index), 10, "Expected only the new message to be embedded")
+
+    def test_rewritten_history(self):
+        embedder = CountingEmbedder()
+        strategy = SemanticRelevanceStrategy(k=1, n=1, embedder=embedder)
+        strategy.get_messages(self.conversation)
+        index = strategy._indexes[self.conversation].index
+        self.assertEqual(len(index), 9)
+
+        # Rewrite a message in the middle, leaving the last one untouched
+        messages = list(self.conversation.messages)
+        messages[3] = {"role": "user", "name": "user", "content": "My X200 router keeps dropping wifi"}
+        self.conversation.messages = messages
+        texts = len(embedder.texts)
+        result = strategy.get_messages(self.conversation)
+
+        self.assertEqual(len(index), 9)
+        self.assertEqual(result[0], messages[3], "Expected the rewritten message to be embedded again")
+        self.assertEqual(embedder.texts[texts:], [messages[3]["content"]], "Expected only the rewritten message to be embedded")
+
+    def test_derived_conversations(self):
+        embedder = CountingEmbedder()
+        strategy = SemanticRelevanceStrategy(k=2, n=1, embedder=embedder)
+        strategy.get_messages(self.conversation)
+        texts = len(embedder.texts)
+
+        fork = self.conversation.fork()
+        pipeline = PipelineConversationReadingStrategy([AllMessagesStrategy(), strategy])
+        self.assertEqual(strategy.get_messages(fork), strategy.get_messages(self.conversation))
+        self.assertEqual(pipeline.get_messages(self.conversation), strategy.get_messages(self.conversation))
+        self.assertEqual(len(embedder.texts), texts, "Expected derived conversations to reuse the cached embeddings")
+
+
+if __name__ == "__main__":
+    unittest.main()
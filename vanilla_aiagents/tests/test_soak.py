@@ -0,0 +1,117 @@
+import gc
+import threading
+import tracemalloc
+import unittest
+import os, logging, sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from openai.types.chat import ChatCompletionMessage
+
+from vanilla_aiagents.agent import Agent
+from vanilla_aiagents.conversation import Conversation
+from vanilla_aiagents.llm import LLM
+from vanilla_aiagents.workflow import Workflow, WorkflowInput
+
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+
+class EchoLLM(LLM):
+    """LLM echoing the last user message, using as many tokens as its length."""
+
+    def __init__(self):
+        super().__init__({})
+
+    def ask(self, messages, tools=None, tools_function=None, temperature=0.7, response_format=None, timeout=None):
+        content = messages[-1]["content"]
+        usage = len(content)
+        return ChatCompletionMessage(role="assistant", content=content), {
+            "total_tokens": 2 * usage,
+            "prompt_tokens": usage,
+            "completion_tokens": usage,
+        }
+
+    def ask_stream(self, messages, tools=None, tools_function=None, temperature=0.7, cancellation=None, timeout=None):
+        raise NotImplementedError()
+
+
+def _run_workflows(agent: Agent, count: int) -> list[Workflow]:
+    """Run the given number of workflows simultaneously, each with a default conversation."""
+    workflows = [Workflow(askable=agent, conversation=Conversation()) for _ in range(count)]
+    start = threading.Barrier(count)
+    results = [None] * count
+
+    def run(index):
+        start.wait()
+        results[index] = workflows[index].run(f"Message from user {index}")
+
+    threads = [threading.Thread(target=run, args=(index,)) for index in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == ["done"] * count, results
+    return workflows
+
+
+class TestSoak(unittest.TestCase):
+
+    def setUp(self):
+        logging.basicConfig(level=logging.INFO)
+
+    def test_default_state(self):
+        first, second = Conversation(), Conversation()
+        first.messages.append({"role": "user", "content": "Hello"})
+        first.variables["name"] = "John"
+        first.metrics.add({"total_tokens": 2, "prompt_tokens": 1, "completion_tokens": 1})
+        first.log.append(("info", "agent/stop", "agent"))
+
+        self.assertEqual(second.messages, [])
+        self.assertEqual(second.variables, {})
+        self.assertEqual(second.metrics.total_tokens, 0)
+        self.assertEqual(len(second.log), 0)
+
+        images = ["data:image/jpeg;base64,AAAA"]
+        first_input, second_input = WorkflowInput("Hello", images=images), WorkflowInput("Hello")
+        first_input.add_image_bytes(b"image")
+        self.assertEqual(len(images), 1, "Expected the caller list not to be modified")
+        self.assertEqual(second_input.images, [])
+
+    def test_concurrent_workflows(self):
+        agent = Agent(id="echo", description="Echo", system_message="Repeat", llm=EchoLLM())
+
+        workflows = _run_workflows(agent, 300)
+
+        for index, workflow in enumerate(workflows):
+            text = f"Message from user {index}"
+            conversation = workflow.conversation
+            self.assertEqual([m["content"] for m in conversation.messages], ["", text, text])
+            self.assertEqual(conversation.variables, {})
+            self.assertEqual(conversation.metrics.total_tokens, 2 * len(text))
+            self.assertEqual(conversation.metrics.prompt_tokens, len(text))
+
+    def test_memory_growth(self):
+        agent = Agent(id="echo", description="Echo", system_message="Repeat", llm=EchoLLM())
+        # Warm up caches and lazily created objects first
+        _run_workflows(agent, 100)
+
+        tracemalloc.start()
+        try:
+            gc.collect()
+            baseline = tracemalloc.get_traced_memory()[0]
+            for _ in range(5):
+                _run_workflows(agent, 100)
+            gc.collect()
+            growth = tracemalloc.get_traced_memory()[0] - baseline
+        finally:
+            tracemalloc.stop()
+
+        # Completed sessions must not leave state behind
+        self.assertLess(growth, 256 * 1024, f"Memory grew by {growth} bytes")
+
+
+if __name__ == "__main__":
+    unittest.main()
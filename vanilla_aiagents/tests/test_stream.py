@@ -0,0 +1,411 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import json
+import threading
+import time
+import unittest
+import os, logging, sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from vanilla_aiagents.askable import Askable
+from vanilla_aiagents.conversation import Conversation
+from vanilla_aiagents.events import EventBusClosed, EventGap
+from vanilla_aiagents.remote import remote_pb2
+from vanilla_aiagents.remote.grpc import GRPCConnection, GRPCHost
+from vanilla_aiagents.remote.remote import RemoteAskable, RESTConnection, RESTHost
+from vanilla_aiagents.stream import StreamFilter, StreamRegistry, StreamRun, StreamSession
+from vanilla_aiagents.workflow import Workflow
+from tests.helpers import scripted_llm, tool_call_message
+
+import grpc
+import requests
+
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+
+class SilentAskable(Askable):
+    """Askable answering without emitting any start/end mark."""
+
+    def ask(self, conversation, stream=False):
+        conversation.messages.append({"role": "assistant", "content": "Done."})
+        conversation.update(["delta", {"content": "Done."}])
+        return "done"
+
+
+class ChattyAskable(Askable):
+    """Askable emitting text deltas, tool call deltas and function results."""
+
+    def ask(self, conversation, stream=False):
+        conversation.update(["start", self.id])
+        conversation.update(["delta", {"role": "assistant", "content": None, "tool_calls": [{"index": 0}], "refusal": None}])
+        conversation.update(["function_result", {"name": "lookup", "result": "42"}])
+        for token in ["The ", "answer ", "is 42."]:
+            conversation.update(["delta", {"role": "assistant", "content": token, "tool_calls": None, "refusal": None}])
+        conversation.update(["end", self.id])
+        conversation.messages.append({"role": "assistant", "name": self.id, "content": "The answer is 42."})
+        return "done"
+
+
+class FailingAskable(Askable):
+    """Askable raising an error midway."""
+
+    def ask(self, conversation, stream=False):
+        conversation.update(["start", self.id])
+        raise ValueError("Boom")
+
+
+class HangingAskable(Askable):
+    """Askable waiting until released."""
+
+    def __init__(self, id, description):
+        super().__init__(id, description)
+        self.release = threading.Event()
+
+    def ask(self, conversation, stream=False):
+        self.calls = getattr(self, "calls", 0) + 1
+        conversation.update(["start", self.id])
+        self.release.wait(5)
+        conversation.update(["delta", {"content": "Late."}])
+        return "done"
+
+
+class CountingAskable(Askable):
+    """Askable emitting a number of text deltas between start and end marks."""
+
+    def __init__(self, id, description, count):
+        super().__init__(id, description)
+        self.count = count
+
+    def ask(self, conversation, stream=False):
+        conversation.update(["start", self.id])
+        for index in range(self.count):
+            conversation.update(["delta", {"content": f"{index} "}])
+        conversation.update(["end", self.id])
+        return "done"
+
+
+class TestStream(unittest.TestCase):
+
+    def setUp(self):
+        logging.basicConfig(level=logging.INFO)
+
+    def test_ends_without_marks(self):
+        askable = SilentAskable("silent", "Silent")
+        workflow = Workflow(askable=askable, conversation=Conversation(messages=[], variables={}))
+
+        updates = list(workflow.run_stream("Hello"))
+
+        self.assertEqual(updates[-1], ["result", "done"])
+        self.assertIn(["delta", {"content": "Done."}], updates)
+
+    def test_error(self):
+        session = StreamSession(FailingAskable("failing", "Failing"), Conversation(messages=[], variables={}))
+
+        updates = list(session)
+
+        self.assertEqual(updates[0], ["start", "failing"])
+        self.assertEqual(updates[-1], ["error", "Boom"])
+        self.assertEqual(session.result, "error")
+
+    def test_timeout(self):
+        askable = HangingAskable("hanging", "Hanging")
+        session = StreamSession(askable, Conversation(messages=[], variables={}), timeout=0.2)
+
+        updates = list(session)
+        askable.release.set()
+
+        self.assertEqual(updates[-1][0], "error")
+        self.assertEqual(session.result, "timeout")
+        self.assertTrue(session.wait(5), "Expected askable to complete after release")
+        self.assertEqual(session.result, "timeout")
+
+    def test_cancel(self):
+        askable = HangingAskable("hanging", "Hanging")
+        conversation = Conversation(messages=[], variables={}, stream_maxsize=1)
+        session = StreamSession(askable, conversation)
+
+        for mark, _ in session:
+            self.assertEqual(mark, "start")
+            session.cancel()
+        askable.release.set()
+
+        # The producer is not blocked by the full channel once cancelled
+        self.assertTrue(session.wait(5), "Expected askable to complete after cancellation")
+        self.assertTrue(session.cancelled)
+
+    def test_consecutive_runs(self):
+        askable = SilentAskable("silent", "Silent")
+        workflow = Workflow(askable=askable, conversation=Conversation(messages=[], variables={}))
+
+        for _ in range(3):
+            updates = list(workflow.run_stream("Hello"))
+            self.assertEqual(updates[-1], ["result", "done"])
+
+    def test_async_stream(self):
+        askable = HangingAskable("hanging", "Hanging")
+        workflow = Workflow(askable=askable, conversation=Conversation(messages=[], variables={}))
+
+        async def run():
+            ticks = 0
+
+            async def tick():
+                nonlocal ticks
+                # The loop keeps running while the askable is waiting
+                while ticks < 5:
+                    ticks += 1
+                    await asyncio.sleep(0.01)
+                askable.release.set()
+
+            ticker = asyncio.create_task(tick())
+            updates = [update async for update in workflow.arun_stream("Hello")]
+            await ticker
+            return updates, ticks
+
+        updates, ticks = asyncio.run(run())
+
+        self.assertEqual(ticks, 5)
+        self.assertEqual(updates[0], ["start", "hanging"])
+        self.assertEqual(updates[-1], ["result", "done"])
+
+    def test_async_timeout(self):
+        askable = HangingAskable("hanging", "Hanging")
+        session = StreamSession(askable, Conversation(messages=[], variables={}), timeout=0.2)
+
+        async def run():
+            updates = [update async for update in session]
+            # Release the askable thread
+            askable.release.set()
+            return updates
+
+        updates = asyncio.run(run())
+
+        self.assertEqual(updates[-1][0], "error")
+        self.assertEqual(session.result, "timeout")
+
+    def test_async_executor(self):
+        threads = []
+
+        class ThreadAskable(Askable):
+            def ask(self, conversation, stream=False):
+                threads.append(threading.current_thread().name)
+                return "done"
+
+        async def run(session):
+            return [update async for update in session]
+
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix="custom") as executor:
+            asyncio.run(run(StreamSession(ThreadAskable("thread", "Thread"), Conversation(), executor=executor)))
+        asyncio.run(run(StreamSession(ThreadAskable("thread", "Thread"), Conversation())))
+
+        self.assertTrue(threads[0].startswith("custom"))
+        self.assertTrue(threads[1].startswith("stream"), "Expected the shared stream pool, not the loop default executor")
+
+    def test_deltas_unchanged(self):
+        replies = iter([tool_call_message("lookup"), {"role": "assistant", "content": "Found"}])
+        llm = scripted_llm(lambda messages, tools: next(replies))
+        tools = [{"type": "function", "function": {"name": "lookup", "parameters": {"type": "object", "properties": {}}}}]
+
+        updates = list(llm.ask_stream([{"role": "user", "content": "Look up"}], tools=tools, tools_function={"lookup": lambda: "value"}))
+
+        deltas = [content for mark, content in updates if mark == "delta"]
+        self.assertEqual([delta["role"] for delta in deltas], ["assistant", "assistant"], "Expected the deltas sent to the consumers to be left unchanged")
+        self.assertEqual(deltas[0]["tool_calls"][0]["function"]["name"], "lookup")
+        self.assertEqual(updates[-2][1][0]["content"], "Found")
+
+    def test_filter(self):
+        workflow = Workflow(askable=ChattyAskable("chatty", "Chatty"), conversation=Conversation(messages=[], variables={}))
+
+        text_only = StreamFilter(marks=["delta"], delta_fields=["content"])
+        updates = list(workflow.run_stream("Hello", stream_filter=text_only))
+        self.assertEqual(
+            updates,
+            [
+                ["delta", {"content": "The "}],
+                ["delta", {"content": "answer "}],
+                ["delta", {"content": "is 42."}],
+                ["result", "done"],
+            ],
+        )
+
+        updates = list(workflow.run_stream("Hello", stream_filter=StreamFilter(marks=["function_result"])))
+        self.assertEqual([mark for mark, _ in updates], ["function_result", "result"])
+
+    def test_remote_filter(self):
+        askable = ChattyAskable("chatty", "Chatty")
+        rest_host = RESTHost(askables=[askable], host="127.0.0.1", port=5013)
+        grpc_host = GRPCHost(askables=[askable], host="127.0.0.1", port=5014)
+        rest_host.start()
+        grpc_host.start()
+
+        try:
+            for connection in [RESTConnection(url="http://localhost:5013"), GRPCConnection(url="localhost:5014")]:
+                remote = RemoteAskable(
+                    id="chatty",
+                    connection=connection,
+                    stream_filter=StreamFilter(marks=["delta"], delta_fields=["content"]),
+                )
+                workflow = Workflow(askable=remote, conversation=Conversation(messages=[], variables={}))
+
+                updates = list(workflow.run_stream("Hello"))
+
+                deltas = [content for mark, content in updates if mark == "delta"]
+                self.assertEqual(deltas, [{"content": "The "}, {"content": "answer "}, {"content": "is 42."}])
+                self.assertEqual(updates[-1], ["result", "done"])
+                self.assertEqual(workflow.conversation.messages[-1]["content"], "The answer is 42.")
+        finally:
+            rest_host.stop()
+            grpc_host.stop()
+
+    def test_replay_registry(self):
+        run = StreamRun(StreamSession(SilentAskable("silent", "Silent"), Conversation(messages=[], variables={}))).start()
+        registry = StreamRegistry(ttl=0.1)
+        registry.add(run)
+
+        updates = list(_ids(run.subscribe()))
+        self.assertEqual(updates, [(0, ["delta", {"content": "Done."}]), (1, ["result", "done"])])
+        self.assertEqual(list(_ids(run.subscribe(last_id=0))), updates[1:])
+
+        self.assertIs(registry.get(run.run_id), run)
+        time.sleep(0.2)
+        self.assertIsNone(registry.get(run.run_id), "Expected run to expire after its TTL")
+
+    def test_run_backpressure(self):
+        for policy in ["block", "coalesce"]:
+            conversation = Conversation(messages=[], variables={}, stream_maxsize=4, stream_policy=policy)
+            run = StreamRun(StreamSession(CountingAskable("counting", "Counting", 50), conversation), capacity=8)
+            subscription = run.subscribe()
+            run.start()
+
+            updates = []
+            while True:
+                try:
+                    updates.append(run.read(subscription))
+                except EventBusClosed:
+                    break
+                # A slow consumer
+                time.sleep(0.002)
+
+            self.assertEqual([id for id, _ in updates], list(range(len(updates))))
+            self.assertEqual(subscription.dropped, 0)
+            marks = [update[0] for _, update in updates]
+            self.assertEqual((marks[0], marks[-2], marks[-1]), ("start", "end", "result"))
+            text = "".join(update[1]["content"] for _, update in updates if update[0] == "delta")
+            self.assertEqual(text, "".join(f"{index} " for index in range(50)))
+            channel = run.session.channel
+            if policy == "block":
+                self.assertEqual(len(updates), 53)
+                self.assertGreater(channel.blocked_seconds, 0)
+                # The first updates were evicted from the replay buffer
+                with self.assertRaises(EventGap):
+                    run.subscribe(last_id=0)
+            else:
+                self.assertLess(len(updates), 53)
+                self.assertGreater(channel.coalesced, 0)
+
+    def test_registry_sweep(self):
+        registry = StreamRegistry(ttl=0.05, max_duration=0.1, sweep_interval=0.02)
+        finished = StreamRun(StreamSession(SilentAskable("silent", "Silent"), Conversation(messages=[], variables={})))
+        finished.subscribe()
+        finished.start()
+        askable = HangingAskable("hanging", "Hanging")
+        hanging = StreamRun(StreamSession(askable, Conversation(messages=[], variables={})), disconnect_grace=None).start()
+        registry.add(finished)
+        registry.add(hanging)
+
+        try:
+            time.sleep(0.5)
+            self.assertEqual(len(registry), 0, "Expected runs to be evicted without any further registry access")
+            self.assertTrue(hanging.session.cancelled, "Expected runs lasting too long to be cancelled")
+        finally:
+            askable.release.set()
+            registry.close()
+
+    def test_rest_resume(self):
+        askable = HangingAskable("hanging", "Hanging")
+        host = RESTHost(askables=[askable, SilentAskable("silent", "Silent")], host="127.0.0.1", port=5015)
+        host.start()
+
+        try:
+            payload = {"messages": [{"role": "user", "content": "Hello"}], "variables": {}}
+            response = requests.post("http://localhost:5015/hanging/ask?stream=true", json=payload, stream=True)
+            run_id = response.headers["X-Run-Id"]
+            first = json.loads(next(response.iter_lines()))
+            # Disconnect mid-stream, then let the run complete
+            response.close()
+            askable.release.set()
+
+            other = requests.post("http://localhost:5015/silent/resume", json={"run_id": run_id, "last_id": first[2]})
+            response = requests.post(
+                "http://localhost:5015/hanging/resume", json={"run_id": run_id, "last_id": first[2]}, stream=True
+            )
+            rest = [json.loads(line) for line in response.iter_lines() if line]
+
+            missing = requests.post("http://localhost:5015/hanging/resume", json={"run_id": "unknown"})
+        finally:
+            host.stop()
+
+        self.assertEqual(first, ["start", "hanging", 0])
+        self.assertEqual([update[2] for update in rest], [1, 2])
+        self.assertEqual(rest[0][:2], ["delta", {"content": "Late."}])
+        self.assertEqual(rest[-1][0], "result")
+        self.assertEqual(rest[-1][1]["result"], "done")
+        self.assertEqual(askable.calls, 1)
+        self.assertEqual(missing.status_code, 404)
+        self.assertEqual(other.status_code, 404, "Expected runs not to be resumed through another askable")
+
+    def test_grpc_resume(self):
+        askable = HangingAskable("hanging", "Hanging")
+        host = GRPCHost(askables=[askable, SilentAskable("silent", "Silent")], host="127.0.0.1", port=5016)
+        host.start()
+
+        try:
+            connection = GRPCConnection(url="localhost:5016")
+            responses = connection.stub.AskStream(
+                remote_pb2.ConversationRequest(
+                    agent_id="hanging", messages=[remote_pb2.Message(role="user", content="Hello", name="user")]
+                )
+            )
+            first = next(responses)
+            # Disconnect mid-stream, then let the run complete
+            responses.cancel()
+            askable.release.set()
+
+            rest = list(
+                connection.stub.ResumeStream(
+                    remote_pb2.ResumeRequest(agent_id="hanging", run_id=first.run_id, last_id=first.id)
+                )
+            )
+
+            replayed = list(connection.stub.ResumeStream(remote_pb2.ResumeRequest(agent_id="hanging", run_id=first.run_id)))
+
+            with self.assertRaises(grpc.RpcError) as missing:
+                list(connection.stub.ResumeStream(remote_pb2.ResumeRequest(agent_id="hanging", run_id="unknown")))
+            with self.assertRaises(grpc.RpcError) as other:
+                list(connection.stub.ResumeStream(remote_pb2.ResumeRequest(agent_id="silent", run_id=first.run_id)))
+        finally:
+            host.stop()
+
+        self.assertEqual((first.mark, first.id), ("start", 0))
+        self.assertEqual([(response.mark, response.id) for response in rest], [("delta", 1), ("result", 2)])
+        self.assertEqual(json.loads(rest[-1].content)["result"], "done")
+        self.assertEqual(askable.calls, 1)
+        self.assertEqual(missing.exception.code(), grpc.StatusCode.NOT_FOUND)
+        self.assertEqual(other.exception.code(), grpc.StatusCode.NOT_FOUND, "Expected runs not to be resumed through another askable")
+        self.assertEqual([response.id for response in replayed], [0, 1, 2], "Expected an unset last ID to resume from the first update")
+
+
+def _ids(subscription):
+    """Read all the (id, update) pairs of a run subscription."""
+    updates = []
+    while True:
+        try:
+            updates.append(subscription.get(timeout=5))
+        except EventBusClosed:
+            return updates
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,136 @@
+import gc
+import time
+import unittest
+import os, logging, sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from typing import Annotated
+
+from vanilla_aiagents.agent import Agent
+from vanilla_aiagents.conversation import Conversation
+from vanilla_aiagents.llm import ErrorTestingLLM
+from vanilla_aiagents.tools import ToolResultCache, canonical_arguments
+
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+
+class TestToolCache(unittest.TestCase):
+
+    def setUp(self):
+        logging.basicConfig(level=logging.INFO)
+        self.calls = []
+
+    def _agent(self, cache: ToolResultCache) -> Agent:
+        agent = Agent(id="agent", description="Agent", system_message="Help", llm=ErrorTestingLLM({}), tool_cache=cache)
+
+        @agent.register_tool(description="Look up a customer")
+        def lookup_customer(customer_id: Annotated[str, "The customer ID"], full: Annotated[bool, "Whether to include the history"] = False) -> str:
+            self.calls.append(("lookup_customer", customer_id))
+            return f"customer {customer_id}"
+
+        @agent.register_tool(description="Open a ticket", side_effects=True)
+        def open_ticket(customer_id: Annotated[str, "The customer ID"]) -> str:
+            self.calls.append(("open_ticket", customer_id))
+            return "opened"
+
+        return agent
+
+    def test_conversation_scope(self):
+        cache = ToolResultCache()
+        agent = self._agent(cache)
+        first = Conversation()
+        second = Conversation()
+
+        _, functions = agent._prepare_llm_tools(first)
+        self.assertEqual(functions["lookup_customer"](customer_id="42", full=True), "customer 42")
+        self.assertEqual(functions["lookup_customer"](full=True, customer_id="42"), "customer 42")
+        functions["lookup_customer"](customer_id="7")
+        _, functions = agent._prepare_llm_tools(second)
+        functions["lookup_customer"](customer_id="42", full=True)
+
+        self.assertEqual(self.calls, [("lookup_customer", "42"), ("lookup_customer", "7"), ("lookup_customer", "42")])
+        self.assertEqual((cache.hits, cache.misses), (1, 3))
+
+        # Entries are released with their conversation
+        del first, second, functions
+        gc.collect()
+        self.assertEqual(len(cache._conversations), 0)
+
+    def test_global_scope(self):
+        cache = ToolResultCache(scope="global", max_size=2)
+        agent = self._agent(cache)
+
+        for customer_id in ["1", "2", "1", "3", "2"]:
+            _, functions = agent._prepare_llm_tools(Conversation())
+            functions["lookup_customer"](customer_id=customer_id)
+
+        # "2" was evicted as the least recently used when "3" was added
+        self.assertEqual([customer_id for _, customer_id in self.calls], ["1", "2", "3", "2"])
+        self.assertEqual((cache.hits, cache.misses), (1, 4))
+
+        # Another agent registering another function under the same name does not share its results
+        other = Agent(id="other", description="Other", system_message="Help", llm=ErrorTestingLLM({}), tool_cache=cache)
+
+        @other.register_tool(name="lookup_customer", description="Look up a customer in the archive")
+        def lookup_archived_customer(customer_id: Annotated[str, "The customer ID"]) -> str:
+            return f"archived customer {customer_id}"
+
+        _, functions = other._prepare_llm_tools(Conversation())
+        self.assertEqual(functions["lookup_customer"](customer_id="2"), "archived customer 2")
+
+    def test_ttl(self):
+        cache = ToolResultCache(ttl=0.05)
+        _, functions = self._agent(cache)._prepare_llm_tools(Conversation())
+
+        functions["lookup_customer"](customer_id="42")
+        functions["lookup_customer"](customer_id="42")
+        time.sleep(0.1)
+        functions["lookup_customer"](customer_id="42")
+
+        self.assertEqual(len(self.calls), 2)
+
+    def test_side_effects(self):
+        cache = ToolResultCache()
+        agent = self._agent(cache)
+
+        @agent.register_tool(description="Close a ticket", cache=cache, side_effects=True)
+        def close_ticket(ticket_id: Annotated[str, "The ticket ID"]) -> str:
+            self.calls.append(("close_ticket", ticket_id))
+            return "closed"
+
+        _, functions = agent._prepare_llm_tools(Conversation())
+        for _ in range(2):
+            functions["open_ticket"](customer_id="42")
+            functions["close_ticket"](ticket_id="1")
+
+        self.assertEqual(len(self.calls), 4)
+        self.assertEqual((cache.hits, cache.misses), (0, 0))
+        self.assertEqual(set(agent.tool_caches), {"lookup_customer"})
+
+    def test_errors_not_cached(self):
+        cache = ToolResultCache()
+        attempts = []
+
+        def flaky(customer_id):
+            attempts.append(customer_id)
+            if len(attempts) == 1:
+                raise ConnectionError("unavailable")
+            return "ok"
+
+        with self.assertRaises(ConnectionError):
+            cache.call("flaky", flaky, {"customer_id": "42"})
+        self.assertEqual(cache.call("flaky", flaky, {"customer_id": "42"}), "ok")
+        self.assertEqual(cache.call("flaky", flaky, {"customer_id": "42"}), "ok")
+        self.assertEqual(len(attempts), 2)
+
+    def test_canonical_arguments(self):
+        self.assertEqual(canonical_arguments({"b": 1, "a": {"d": 2, "c": 3}}), canonical_arguments({"a": {"c": 3, "d": 2}, "b": 1}))
+        with self.assertRaises(ValueError):
+            ToolResultCache(scope="session")
+
+
+if __name__ == "__main__":
+    unittest.main()
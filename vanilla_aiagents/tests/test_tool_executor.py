@@ -0,0 +1,204 @@
+import json
+import threading
+import time
+import unittest
+import os, logging, sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from typing import Annotated
+
+from vanilla_aiagents.agent import Agent
+from vanilla_aiagents.cancellation import Deadline
+from vanilla_aiagents.conversation import Conversation
+from vanilla_aiagents.llm import ErrorTestingLLM
+from vanilla_aiagents.tools import ToolExecutor, ToolPolicy, ToolResultCache
+
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+
+class TestToolExecutor(unittest.TestCase):
+
+    def setUp(self):
+        logging.basicConfig(level=logging.INFO)
+        self.executor = ToolExecutor(policy=ToolPolicy(timeout=2))
+
+    def tearDown(self):
+        self.executor.shutdown(wait=False)
+
+    def _agent(self, **kwargs) -> Agent:
+        return Agent(id="agent", description="Agent", system_message="Help", llm=ErrorTestingLLM({}), tool_executor=self.executor, **kwargs)
+
+    def test_timeout(self):
+        agent = self._agent()
+        release = threading.Event()
+
+        @agent.register_tool(description="Search the orders", policy=ToolPolicy(timeout=0.1))
+        def search_orders(query: Annotated[str, "The search terms"]) -> str:
+            release.wait(5)
+            return "found"
+
+        conversation = Conversation()
+        _, functions = agent._prepare_llm_tools(conversation)
+
+        start = time.monotonic()
+        result = json.loads(functions["search_orders"](query="shoes"))
+        release.set()
+
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(result["error"], "timeout")
+        self.assertEqual(result["tool"], "search_orders")
+        self.assertEqual((conversation.metrics.tool_calls, conversation.metrics.tool_timeouts), (1, 1))
+        self.assertIn(("error", "tool/timeout", "search_orders", 0.1), conversation.log)
+
+    def test_deadline(self):
+        agent = self._agent()
+
+        @agent.register_tool(description="Search the orders")
+        def search_orders(query: Annotated[str, "The search terms"]) -> str:
+            time.sleep(1)
+            return "found"
+
+        conversation = Conversation()
+        conversation.deadline = Deadline(0.1)
+        _, functions = agent._prepare_llm_tools(conversation)
+
+        start = time.monotonic()
+        self.assertEqual(json.loads(functions["search_orders"](query="shoes"))["error"], "timeout")
+        self.assertLess(time.monotonic() - start, 0.5, "Expected the conversation deadline to apply")
+
+    def test_bulkhead(self):
+        agent = self._agent()
+        lock = threading.Lock()
+        running = []
+        peak = []
+
+        @agent.register_tool(description="Query the CRM", policy=ToolPolicy(timeout=5, max_concurrency=2))
+        def query_crm(customer_id: Annotated[str, "The customer ID"]) -> str:
+            with lock:
+                running.append(customer_id)
+                peak.append(len(running))
+            time.sleep(0.05)
+            with lock:
+                running.remove(customer_id)
+            return "ok"
+
+        conversation = Conversation()
+        _, functions = agent._prepare_llm_tools(conversation)
+        threads = [threading.Thread(target=functions["query_crm"], kwargs={"customer_id": str(i)}) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(max(peak), 2)
+        self.assertEqual(conversation.metrics.tool_calls, 8)
+        self.assertGreater(conversation.metrics.tool_seconds, 8 * 0.05)
+
+    def test_bulkhead_per_policy(self):
+        narrow = self.executor._semaphore("query_crm", ToolPolicy(max_concurrency=1))
+        wide = self.executor._semaphore("query_crm", ToolPolicy(max_concurrency=3))
+
+        self.assertIsNot(narrow, wide)
+        self.assertIs(narrow, self.executor._semaphore("query_crm", ToolPolicy(max_concurrency=1)))
+        self.assertTrue(narrow.acquire(blocking=False))
+        self.assertFalse(narrow.acquire(blocking=False))
+        for _ in range(3):
+            self.assertTrue(wide.acquire(blocking=False))
+
+    def test_retries(self):
+        agent = self._agent()
+        attempts = []
+
+        @agent.register_tool(description="Get the exchange rate", policy=ToolPolicy(retries=2, backoff=0.01, retry_on=(ConnectionError,)))
+        def get_rate(currency: Annotated[str, "The currency"]) -> str:
+            attempts.append(currency)
+            if len(attempts) < 3:
+                raise ConnectionError("unavailable")
+            return "1.1"
+
+        @agent.register_tool(description="Get the balance", policy=ToolPolicy(retries=2, retry_on=(ConnectionError,)))
+        def get_balance(account: Annotated[str, "The account"]) -> str:
+            attempts.append(account)
+            raise ValueError("unknown account")
+
+        conversation = Conversation()
+        _, functions = agent._prepare_llm_tools(conversation)
+
+        self.assertEqual(functions["get_rate"](currency="EUR"), "1.1")
+        with self.assertRaises(ValueError):
+            functions["get_balance"](account="1")
+        self.assertEqual(len(attempts), 4, "Expected only the listed errors to be retried")
+        self.assertEqual((conversation.metrics.tool_calls, conversation.metrics.tool_errors), (2, 1))
+
+    def test_retries_within_budget(self):
+        attempts = []
+
+        def lookup():
+            attempts.append(time.monotonic())
+            raise ValueError("not found")
+
+        start = time.monotonic()
+        with self.assertRaises(ValueError):
+            self.executor.call("lookup", lookup, {}, policy=ToolPolicy(timeout=0.3, retries=2, backoff=0.5))
+
+        self.assertEqual(len(attempts), 1, "Expected no retry past the time budget")
+        self.assertLess(time.monotonic() - start, 0.3)
+
+    def test_with_cache(self):
+        cache = ToolResultCache()
+        agent = self._agent(tool_cache=cache)
+
+        @agent.register_tool(description="Look up a customer")
+        def lookup_customer(customer_id: Annotated[str, "The customer ID"]) -> str:
+            return f"customer {customer_id}"
+
+        conversation = Conversation()
+        _, functions = agent._prepare_llm_tools(conversation)
+        for _ in range(3):
+            self.assertEqual(functions["lookup_customer"](customer_id="42"), "customer 42")
+
+        self.assertEqual((cache.hits, cache.misses), (2, 1))
+        self.assertEqual(conversation.metrics.tool_calls, 1, "Expected cache hits not to reach the executor")
+
+    def test_timeout_not_cached(self):
+        cache = ToolResultCache()
+        agent = self._agent(tool_cache=cache)
+        release = threading.Event()
+
+        @agent.register_tool(description="Look up a customer", policy=ToolPolicy(timeout=0.1))
+        def lookup_customer(customer_id: Annotated[str, "The customer ID"]) -> str:
+            if not release.is_set():
+                release.wait(1)
+            return f"customer {customer_id}"
+
+        _, functions = agent._prepare_llm_tools(Conversation())
+        self.assertEqual(json.loads(functions["lookup_customer"](customer_id="42"))["error"], "timeout")
+        release.set()
+        self.assertEqual(functions["lookup_customer"](customer_id="42"), "customer 42")
+        self.assertEqual((cache.hits, cache.misses), (0, 2))
+
+    def test_default_executor(self):
+        agent = Agent(id="agent", description="Agent", system_message="Help", llm=ErrorTestingLLM({}))
+
+        @agent.register_tool(description="Get the time")
+        def get_time() -> str:
+            return "noon"
+
+        _, functions = agent._prepare_llm_tools(Conversation())
+        self.assertIs(functions["get_time"], agent.tools_function["get_time"], "Expected tools without policy to run inline")
+
+        @agent.register_tool(description="Get the date", policy=ToolPolicy(timeout=1))
+        def get_date() -> str:
+            return "today"
+
+        conversation = Conversation()
+        _, functions = agent._prepare_llm_tools(conversation)
+        self.assertEqual(functions["get_date"](), "today")
+        self.assertEqual(conversation.metrics.tool_calls, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
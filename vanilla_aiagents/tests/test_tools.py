@@ -0,0 +1,104 @@
+import unittest
+import os, logging, sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from typing import Annotated
+
+from vanilla_aiagents.agent import Agent
+from vanilla_aiagents.conversation import Conversation
+from vanilla_aiagents.llm import ErrorTestingLLM
+from vanilla_aiagents.semantic import EmbeddingToolSelector
+from vanilla_aiagents.tools import BM25ToolSelector, ToolSelector, tokenize
+
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+
+def _register_catalog(agent: Agent):
+    """Register a large catalog of tools, with a few meaningful ones among many fillers."""
+    for i in range(100):
+
+        @agent.register_tool(name=f"internal_operation_{i}", description=f"Runs internal maintenance operation number {i}")
+        def filler(code: Annotated[str, "The operation code"]) -> str:
+            return "ok"
+
+    @agent.register_tool(description="Get the current weather forecast for a city")
+    def get_weather(city: Annotated[str, "The city name"]) -> str:
+        return "sunny"
+
+    @agent.register_tool(description="Book a flight ticket between two airports")
+    def book_flight(origin: Annotated[str, "The departure airport"], destination: Annotated[str, "The arrival airport"]) -> str:
+        return "booked"
+
+    @agent.register_tool(description="Search the product documentation")
+    def search_docs(query: Annotated[str, "The search terms"]) -> str:
+        return "docs"
+
+
+def _names(tools: list[dict]) -> list[str]:
+    return [tool["function"]["name"] for tool in tools]
+
+
+class TestTools(unittest.TestCase):
+
+    def setUp(self):
+        logging.basicConfig(level=logging.INFO)
+
+    def test_tokenize(self):
+        self.assertEqual(tokenize("getWeather book_flight HTTP2 Server"), ["get", "weather", "book", "flight", "http2", "server"])
+
+    def _check_selector(self, selector: ToolSelector):
+        agent = Agent(id="agent", description="Agent", system_message="Help", llm=ErrorTestingLLM({}), tool_selector=selector)
+        _register_catalog(agent)
+        conversation = Conversation(messages=[{"role": "user", "content": "What is the weather like in Rome today?"}])
+
+        tools, functions = agent._prepare_llm_tools(conversation)
+
+        names = _names(tools)
+        self.assertIn("get_weather", names)
+        self.assertIn("search_docs", names, "Expected the pinned tool to be always selected")
+        self.assertEqual(names[-1], "update_conversation_variable")
+        self.assertLessEqual(len(tools), 3 + 1 + 1)
+        self.assertEqual(len(functions), 103 + 1, "Expected all the functions to remain callable")
+
+        # Tools registered later are indexed incrementally
+        @agent.register_tool(description="Convert an amount between currencies using exchange rates")
+        def convert_currency(amount: Annotated[float, "The amount"], currency: Annotated[str, "The target currency"]) -> str:
+            return "42"
+
+        conversation.append_messages({"role": "user", "content": "How much is 10 USD in EUR? Use the exchange rates"})
+        names = _names(agent._prepare_llm_tools(conversation)[0])
+        self.assertIn("convert_currency", names)
+        self.assertIn("search_docs", names)
+
+    def test_bm25(self):
+        self._check_selector(BM25ToolSelector(top_k=3, pinned=["search_docs"]))
+
+    def test_embedding(self):
+        self._check_selector(EmbeddingToolSelector(top_k=3, pinned=["search_docs"]))
+
+    def test_registration_order(self):
+        selector = BM25ToolSelector(top_k=2)
+        agent = Agent(id="agent", description="Agent", system_message="Help", llm=ErrorTestingLLM({}), tool_selector=selector)
+        _register_catalog(agent)
+
+        ranked = selector.rank("book a flight to check the weather", 2)
+        selected = selector.select(agent.tools, "book a flight to check the weather")
+
+        self.assertEqual({name for name, _ in ranked}, {"get_weather", "book_flight"})
+        self.assertEqual(_names(selected), ["get_weather", "book_flight"])
+        self.assertEqual(selector.select(agent.tools, "nothing relevant here"), [])
+
+    def test_without_selector(self):
+        agent = Agent(id="agent", description="Agent", system_message="Help", llm=ErrorTestingLLM({}))
+        _register_catalog(agent)
+
+        tools, _ = agent._prepare_llm_tools(Conversation(messages=[{"role": "user", "content": "Weather?"}]))
+
+        self.assertEqual(len(tools), 103 + 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -17,19 +17,29 @@ This project framework provides the following features:
 
 - Multi-agent chat
 - Agent routing (including option to look for available tools to decide)
+  - Deterministic fast-path routing (`routing` module), with rule, user-input and transition-graph routers chosen before falling back to the LLM orchestrator
+  - Learned local router (`LearnedRouter` in the `routing` module, needs the `semantic` extra), a TF-IDF and softmax classifier trained on the logged routing decisions, reporting its accuracy and fallback rate
+  - Handoff routing (`Team(handoff=True)`), where members pick the next agent with auto-injected `handoff_to_<agent>` tools and the LLM orchestrator is only asked when no handoff is made
 - Agent state management
 - Custom stop conditions
 - Interactive or unattended user input
 - Chat resumability
 - Function calling on agents
+  - Tool retrieval (`tools` module), sending only the pinned and most relevant tools of large catalogs, ranked with BM25 or embeddings
+  - Tool result caching (`ToolResultCache`), reusing the results of repeated calls with the same arguments per conversation or globally, with a TTL and a maximum size
+  - Managed tool execution (`ToolExecutor`), with per-tool timeouts returning a structured result to the model, concurrency limits, retries and latency metrics
 - Constrained agent routing
 - Sub-workflows
 - Simple RAG via function calls
 - Image input support
+  - Optional content-addressed blob store (`blobs` module), keeping images out of conversation messages and syncing them to remote hosts only when missing
 - Ability to run pre and post steps via Sequence
 - Conversation context "hidden" variables, which are not displayed to the user but agents can read and write to access additional information
+  - Per-agent context policy (`context` module), injecting only the variables an agent reads, with oversized values truncated or summarized
 - Usage metrics tracking per conversation, plus internal log for debuggability
 - Multiple strategies for agent to filter conversation messages (All, last N, top K and Last N, summarize, etc..)
+  - Semantic relevance strategy (`semantic` module), selecting the messages most relevant to the latest user turn via an in-memory vector index
+  - Image retention strategy, replacing images older than N user turns with a placeholder or cached caption
 - LLMLingua (`extras` module) support to compress system prompts via strategies
 - LLM support for Structured Output
 - Remoting support ((`remote` module)), allowing agents to be run on a remote server and accessed elsewhere
@@ -37,6 +47,8 @@ This project framework provides the following features:
   - Default implementation to run hosts with agent discovery and registration
 - Generated Code execution locally and via ACA Dynamic Sessions
 - Streaming support, even over REST or gRPC agents
+- Batch mode (`batch` module) via `Askable.ask_many`, running many independent conversations with bounded concurrency, checkpoint resume and an aggregate throughput and usage report
+  - Batch-file LLM mode (`BatchLLM`), queuing agent requests into JSONL files in the OpenAI batch format for a pluggable submitter, and resuming the deferred conversations once the results arrive
 
 ## Future work
 
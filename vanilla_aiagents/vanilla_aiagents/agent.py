@@ -1,5 +1,8 @@
+from contextlib import contextmanager
 import logging
-from typing import Annotated, Callable, Optional
+import re
+import threading
+from typing import Annotated, Callable, NamedTuple, Optional
 import json
 
 from .conversation import (
@@ -11,12 +14,95 @@ from .conversation import (
 )
 
 from .askable import Askable
+from .cancellation import is_timeout, supported_kwargs
+from .context import ContextPolicy
 from .function_utils import get_function_schema, wrap_function, F
-from .llm import LLM
+from .llm import LLM, DeferredResponse, ends_turn
+from .messages import message_text
+from .tools import ToolExecutor, ToolPolicy, ToolResultCache, ToolSelector
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# Placeholder of the system message replaced with the conversation variables
+CONTEXT_PLACEHOLDER = "__context__"
+
+
+def _update_conversation_variable(
+    variableName: Annotated[str, "The variable name to update"],
+    variableValue: Annotated[str, "The new value of the variable"],
+) -> Annotated[str, "Confirmation that the variable was updated"]:
+    # Signature only, the actual function is bound to the conversation at call time
+    pass
+
+
+# The schema does not depend on the conversation, so it is generated once
+UPDATE_VARIABLE_TOOL = get_function_schema(
+    _update_conversation_variable,
+    name="update_conversation_variable",
+    description="update a conversation or context variable",
+)
+
+
+# Prefix of the tools handing the conversation off to another agent of a team
+HANDOFF_PREFIX = "handoff_to_"
+
+
+def _handoff() -> Annotated[str, "Confirmation of the handoff"]:
+    # Signature only, the actual function is bound to the conversation at call time
+    pass
+
+
+def handoff_tool_name(agent_id: str) -> str:
+    """Get the name of the tool handing the conversation off to the given agent."""
+    return HANDOFF_PREFIX + re.sub(r"[^a-zA-Z0-9_-]", "_", agent_id)
+
+
+def handoff_tools(agent_id: str, targets: list[Askable]) -> dict[str, tuple[dict, str]]:
+    """Build a `handoff_to_<agent>` tool for each of the given askables, but the agent itself.
+
+    Args:
+        agent_id (str): The ID of the agent handing the conversation off.
+        targets (list[Askable]): The askables the agent can hand the conversation off to.
+
+    Returns:
+        dict[str, tuple[dict, str]]: The handoff tool name -> (schema, target agent ID).
+    """
+    return {
+        handoff_tool_name(target.id): (
+            get_function_schema(
+                _handoff,
+                name=handoff_tool_name(target.id),
+                description=f"Hand the conversation off to {target.id}: {target.description}",
+            ),
+            target.id,
+        )
+        for target in targets
+        if target.id != agent_id
+    }
+
+
+class AgentTemplate(NamedTuple):
+    """The parts of an agent LLM request that do not depend on the conversation, compiled once.
+
+    Args:
+        tools (list[dict]): The tool manifest sent to the LLM, including the built-in tools.
+        tools_function (dict[str, Callable]): The wrapped functions of the registered tools.
+        system_parts (tuple[str]): The system message split around the context placeholder.
+    """
+
+    tools: list[dict]
+    tools_function: dict[str, Callable]
+    system_parts: tuple[str, ...]
+
+    @property
+    def uses_context(self) -> bool:
+        return len(self.system_parts) > 1
+
+    def render_system_message(self, context: str) -> str:
+        """Render the system message, with the given serialized context in place of the placeholder."""
+        return context.join(self.system_parts)
+
 
 class Agent(Askable):
     """An agent that can be asked to solve the user inquiry by using a language model.
@@ -28,6 +114,10 @@ class Agent(Askable):
         llm (LLM): The language model to use for the decision-making process.
         reading_strategy (ConversationReadingStrategy): The reading strategy to use to select the messages to pass to the LLM.
         update_strategy (ConversationUpdateStrategy): The update strategy to use to update the conversation with the response.
+        context_policy (ContextPolicy): The policy selecting the conversation variables injected in place of __context__.
+        tool_selector (ToolSelector): The selector of the tools sent to the LLM for the current turn, for agents with many tools.
+        tool_cache (ToolResultCache): The default cache of the tool results, for the tools without side effects.
+        tool_executor (ToolExecutor): The executor running the tools with timeouts, concurrency limits and retries.
     """
 
     def __init__(
@@ -38,6 +128,10 @@ class Agent(Askable):
         llm: LLM,
         reading_strategy: ConversationReadingStrategy = AllMessagesStrategy(),
         update_strategy: ConversationUpdateStrategy = AppendMessagesUpdateStrategy(),
+        context_policy: ContextPolicy = None,
+        tool_selector: ToolSelector = None,
+        tool_cache: ToolResultCache = None,
+        tool_executor: ToolExecutor = None,
     ):
         """Initialize the Agent object.
 
@@ -48,19 +142,98 @@ class Agent(Askable):
             llm (LLM): The language model to use for the decision-making process.
             reading_strategy (ConversationReadingStrategy): The reading strategy to use to select the messages to pass to the LLM.
             update_strategy (ConversationUpdateStrategy): The update strategy to use to update the conversation with the response.
+            context_policy (ContextPolicy): The policy selecting the conversation variables injected in place of __context__ in the system message, e.g. an allowlist or a maximum value size. Optional, all variables when not provided.
+            tool_selector (ToolSelector): The selector of the tools sent to the LLM, indexing the tools as they are registered and sending only the pinned and most relevant ones to the latest user message. Optional, all tools are sent when not provided.
+            tool_cache (ToolResultCache): The cache of the results of the tools registered afterwards, unless they have side effects or their own cache. Optional, results are not cached when not provided.
+            tool_executor (ToolExecutor): The executor running the tools according to their policies. Optional, tools run inline when not provided, unless they have a policy.
         """
         super().__init__(id, description)
         self.tools = []
         self.tools_function = {}
         self.llm = llm
+        self._template = None
         self.system_message = system_message
         self.reading_strategy = reading_strategy
         self.update_strategy = update_strategy
+        self.context_policy = context_policy
+        self.tool_selector = tool_selector
+        self.tool_cache = tool_cache
+        self.tool_caches = {}
+        self.tool_executor = tool_executor
+        self.tool_policies = {}
+        # Scoped per thread, so teams sharing the agent offer each their own handoffs
+        self._local = threading.local()
 
         logger.debug(
             f"Agent initialized with ID: {self.id}, Description: {self.description}"
         )
 
+    @property
+    def system_message(self) -> str:
+        return self._system_message
+
+    @system_message.setter
+    def system_message(self, value: str):
+        self._system_message = value
+        self._template = None
+
+    def compile(self) -> AgentTemplate:
+        """Compile the parts of the LLM requests that do not depend on the conversation.
+
+        The template is built on first use and reused by every `ask`, until a tool is
+        registered or the system message changes. Call `invalidate` after changing
+        `tools` or `tools_function` directly.
+
+        Returns:
+            AgentTemplate: The compiled template.
+        """
+        template = self._template
+        if template is None:
+            tools = self.tools + [UPDATE_VARIABLE_TOOL]
+            template = AgentTemplate(
+                tools=tools,
+                tools_function=dict(self.tools_function),
+                system_parts=tuple(self.system_message.split(CONTEXT_PLACEHOLDER)),
+            )
+            self._template = template
+            logger.debug(f"[Agent ID: {self.id}] Compiled request template")
+        return template
+
+    def invalidate(self):
+        """Discard the compiled template, so it is compiled again on next use."""
+        self._template = None
+
+    @property
+    def handoffs(self) -> dict[str, tuple[dict, str]]:
+        """The handoff tools offered by the current `handing_off` block, by name."""
+        return getattr(self._local, "handoffs", {})
+
+    @contextmanager
+    def handing_off(self, handoffs: dict[str, tuple[dict, str]]):
+        """Offer the given handoff tools to the LLM, for the asks made within the block.
+
+        Calling a handoff tool ends the agent turn, with no further LLM call, and logs an
+        "agent/handoff" event, which a Team in handoff mode reads to ask the target next,
+        with no orchestrator LLM call. The agent
+        itself is left unchanged, so it can be a member of several teams.
+
+        Args:
+            handoffs (dict[str, tuple[dict, str]]): The handoff tools, as built by `handoff_tools`.
+
+        Example:
+            with agent.handing_off(handoff_tools(agent.id, [billing, support])):
+                agent.ask(conversation)
+        """
+        previous = self.handoffs
+        self._local.handoffs = handoffs
+        try:
+            yield
+        finally:
+            self._local.handoffs = previous
+
+    def _handoff_tools(self) -> list[dict]:
+        return [schema for schema, _ in self.handoffs.values()]
+
     def ask(self, conversation: Conversation, stream=False):
         """Ask the agent to solve the user inquiry by using the language model.
 
@@ -73,6 +246,10 @@ class Agent(Askable):
         logger.debug(
             f"[Agent ID: {self.id}] Received messages: %s", conversation.messages
         )
+        if conversation.cancellation.cancelled:
+            return self._cancelled(conversation)
+        if conversation.deadline_exceeded:
+            return self._deadline_exceeded(conversation)
 
         local_messages = self._prepare_llm_input(conversation)
         local_tools, local_tools_function = self._prepare_llm_tools(
@@ -85,6 +262,9 @@ class Agent(Askable):
                     messages=local_messages,
                     tools=local_tools,
                     tools_function=local_tools_function,
+                    **supported_kwargs(
+                        self.llm.ask, timeout=conversation.time_remaining()
+                    ),
                 )
                 logger.debug(
                     f"[Agent ID: {self.id}] API response received: %s", response
@@ -95,6 +275,11 @@ class Agent(Askable):
                     messages=local_messages,
                     tools=local_tools,
                     tools_function=local_tools_function,
+                    **supported_kwargs(
+                        self.llm.ask_stream,
+                        cancellation=conversation.cancellation,
+                        timeout=conversation.time_remaining(),
+                    ),
                 )
                 # logger.debug(f"[Agent ID: {self.id}] Stream started")
                 response_message = None
@@ -105,58 +290,149 @@ class Agent(Askable):
                         content = self.id
                     if mark == "response" and content is not None:
                         response_message, usage = content
+                    if mark == "usage":
+                        # Interrupted generation, the tokens used so far are still counted
+                        usage = content
 
                     conversation.update([mark, content])
 
             if usage is not None:
                 # Update conversation metrics with response usage
-                conversation.metrics.total_tokens += usage["total_tokens"]
-                conversation.metrics.prompt_tokens += usage["prompt_tokens"]
-                conversation.metrics.completion_tokens += usage["completion_tokens"]
+                conversation.metrics.add(usage)
+        except DeferredResponse as e:
+            # The conversation is left untouched, to be asked again once the response is available
+            logger.debug(f"[Agent ID: {self.id}] Response deferred: %s", e.request_id)
+            conversation.log.append(("info", "agent/deferred", self.id, e.request_id))
+            return "deferred"
         except Exception as e:
+            if conversation.deadline_exceeded and is_timeout(e):
+                # The LLM call timed out
+                return self._deadline_exceeded(conversation)
             logger.error(f"[Agent ID: {self.id}] Error during LLM call: %s", e)
-            conversation.log.append(("error", "agent/error", self.id, e))
+            conversation.log.append(("error", "agent/error", self.id, str(e)))
             return "error"
 
+        if response_message is None and conversation.cancellation.cancelled:
+            # The partial response is discarded
+            return self._cancelled(conversation)
+        if response_message is None and conversation.deadline_exceeded:
+            return self._deadline_exceeded(conversation)
+
         response_message["name"] = self.id
         self.update_strategy.update(conversation, response_message)
         logger.debug(f"[Agent ID: {self.id}] Response message: %s", response_message)
 
         return "done"
 
-    def _prepare_llm_tools(self, conversation: Conversation):
+    def _cancelled(self, conversation: Conversation) -> str:
+        logger.debug(
+            f"[Agent ID: {self.id}] Cancelled: %s", conversation.cancellation.reason
+        )
+        conversation.log.append(
+            ("info", "agent/cancelled", self.id, conversation.cancellation.reason)
+        )
+        return "cancelled"
 
-        # Closure function to update a conversation variable
-        def update_conversation_variable(
-            variableName: Annotated[str, "The variable name to update"],
-            variableValue: Annotated[str, "The new value of the variable"],
-        ) -> Annotated[str, "Confirmation that the variable was updated"]:
-            conversation.variables[variableName] = variableValue
-            return f"Variable {variableName} updated to {variableValue}"
+    def _deadline_exceeded(self, conversation: Conversation) -> str:
+        logger.debug(f"[Agent ID: {self.id}] Deadline exceeded")
+        conversation.log.append(("info", "agent/deadline-exceeded", self.id))
+        return "deadline-exceeded"
 
-        s = get_function_schema(
-            update_conversation_variable,
-            name="update_conversation_variable",
-            description="update a conversation or context variable",
-        )
-        local_tools = self.tools + [s]
+    def _prepare_llm_tools(self, conversation: Conversation):
+        template = self.compile()
+        # Only the conversation-bound functions are created per call
         local_tools_function = {
-            **self.tools_function,
-            "update_conversation_variable": wrap_function(update_conversation_variable),
+            **template.tools_function,
+            **self._bind_tools(conversation),
         }
+        local_tools = template.tools
+        if self.tool_selector is not None:
+            local_tools = self._select_tools(conversation)
+        if self.handoffs:
+            local_tools = self._handoff_tools() + local_tools
         return local_tools, local_tools_function
 
+    def _select_tools(self, conversation: Conversation) -> list[dict]:
+        query = next(
+            (
+                message_text(message)
+                for message in reversed(conversation.messages)
+                if message["role"] == "user"
+            ),
+            "",
+        )
+        selected = self.tool_selector.select(self.tools, query)
+        logger.debug(
+            f"[Agent ID: {self.id}] Selected %d tools out of %d",
+            len(selected),
+            len(self.tools),
+        )
+        # The built-in tools are always available
+        return selected + [UPDATE_VARIABLE_TOOL]
+
+    def _bind_tools(self, conversation: Conversation) -> dict[str, Callable]:
+        """Bind the built-in, handoff and cached tools to the conversation.
+
+        Subclasses adding conversation-bound tools must also add their schemas in `compile`.
+        """
+
+        def update_conversation_variable(variableName: str, variableValue: str) -> str:
+            conversation.set_variable(variableName, variableValue)
+            return f"Variable {variableName} updated to {variableValue}"
+
+        bound = {"update_conversation_variable": update_conversation_variable}
+        for name, (_, target_id) in self.handoffs.items():
+            bound[name] = self._bind_handoff(conversation, target_id)
+        executor = self.tool_executor
+        if executor is None and self.tool_policies:
+            executor = ToolExecutor.default()
+        if not self.tool_caches and executor is None:
+            return bound
+
+        for name, function in self.tools_function.items():
+            if executor is not None:
+                function = executor.bind(
+                    name, function, conversation, self.tool_policies.get(name)
+                )
+            cache = self.tool_caches.get(name)
+            if cache is not None:
+                # Cache hits neither wait for a concurrency slot nor count as tool calls
+                function = cache.bind(name, function, conversation)
+            bound[name] = function
+        return bound
+
+    def _bind_handoff(self, conversation: Conversation, target_id: str) -> Callable:
+        # The agent handed off to answers next, so the agent turn ends with the handoff
+        @ends_turn
+        def handoff() -> str:
+            logger.debug(f"[Agent ID: {self.id}] Handing off to %s", target_id)
+            conversation.log.append(("info", "agent/handoff", self.id, target_id))
+            return f"Conversation handed off to {target_id}"
+
+        return handoff
+
     def _prepare_llm_input(self, conversation):
+        template = self.compile()
+        # Skip serializing the variables when the system message has no placeholder
+        if not template.uses_context:
+            context = ""
+        elif self.context_policy is None:
+            # Not cached, as nested values can be changed in place without a new version
+            context = json.dumps(dict(conversation.variables))
+        else:
+            context = self.context_policy.render(conversation.variables)
         local_messages = []
         local_messages.append(
             {
                 "role": "system",
-                "content": self.system_message.replace(
-                    "__context__", json.dumps(conversation.variables)
-                ),
+                "content": template.render_system_message(context),
             }
         )
-        local_messages.extend(self.reading_strategy.get_messages(conversation))
+        local_messages.extend(
+            conversation.resolve_messages(
+                self.reading_strategy.get_messages(conversation)
+            )
+        )
         logger.debug(
             f"[Agent ID: {self.id}] Local messages prepared for API call (last 3): %s",
             local_messages[-3:],
@@ -168,6 +444,9 @@ class Agent(Askable):
         *,
         name: Optional[str] = None,
         description: Optional[str] = None,
+        cache: Optional[ToolResultCache] = None,
+        side_effects: bool = False,
+        policy: Optional[ToolPolicy] = None,
     ) -> Callable[[F], F]:
         """Decorate registering function to be used by an agent as a tool.
 
@@ -177,6 +456,9 @@ class Agent(Askable):
         Args:
             name (str): The name of the tool. If not provided, the function name will be used.
             description (str): The description of the tool. If not provided, the function description will be used.
+            cache (ToolResultCache): The cache of the tool results. If not provided, the agent tool cache will be used.
+            side_effects (bool): Whether the tool has side effects, e.g. it writes data. Its results are never cached.
+            policy (ToolPolicy): The timeout, concurrency limit and retries of the tool. If not provided, the agent tool executor policy will be used.
         """
         def _decorator(func: F) -> F:
             """Decorate registering function to be used by an agent.
@@ -219,6 +501,20 @@ class Agent(Askable):
                 self.tools_function = {}
             self.tools.append(f)
             self.tools_function[func._name] = wrap_function(func)
+            tool_cache = cache or self.tool_cache
+            if tool_cache is not None and not side_effects:
+                self.tool_caches[func._name] = tool_cache
+            else:
+                # Every call of a side-effecting tool must reach it
+                self.tool_caches.pop(func._name, None)
+            if policy is not None:
+                self.tool_policies[func._name] = policy
+            else:
+                self.tool_policies.pop(func._name, None)
+            if self.tool_selector is not None:
+                # Indexed once, incrementally
+                self.tool_selector.add([f])
+            self.invalidate()
             logger.debug(
                 f"[Agent ID: {self.id}] Tool registered successfully: %s", func._name
             )
@@ -1,5 +1,6 @@
 # A common Python interface for both Agent and Team
 from abc import ABC, abstractmethod
+from typing import Callable, Iterable, Optional
 
 from .conversation import Conversation
 
@@ -21,6 +22,43 @@ class Askable(ABC):
         self._id = id
         self._description = description
 
+    def ask_many(
+        self,
+        conversations: Iterable[Conversation],
+        concurrency: int = 8,
+        ordered: bool = False,
+        checkpoint: Optional[str] = None,
+        key: Optional[Callable[[Conversation, int], str]] = None,
+        timeout: Optional[float] = None,
+    ):
+        """Ask many independent conversations, with bounded concurrency.
+
+        The conversations run when the returned BatchRun is iterated, or when calling its `run` method.
+
+        Args:
+            conversations (Iterable[Conversation]): The conversations to run, consumed lazily.
+            concurrency (int): The maximum number of conversations running at the same time.
+            ordered (bool): Whether to yield the outcomes in input order, rather than as they complete.
+            checkpoint (str): The path of a JSONL checkpoint file, to resume an interrupted batch. Optional.
+            key (Callable[[Conversation, int], str]): A function returning the checkpoint key of a conversation, given the conversation and its index. Optional, the index when not provided.
+            timeout (float): The time budget of each conversation, in seconds. Optional.
+
+        Returns:
+            BatchRun: The batch run, yielding a BatchItem per conversation.
+        """
+        # Imported here, as the batch module depends on the askables
+        from .batch import BatchRun
+
+        return BatchRun(
+            self,
+            conversations,
+            concurrency=concurrency,
+            ordered=ordered,
+            checkpoint=checkpoint,
+            key=key,
+            timeout=timeout,
+        )
+
     # an id property with a default implementation
     @property
     def id(self):
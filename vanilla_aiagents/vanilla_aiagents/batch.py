@@ -0,0 +1,734 @@
+from abc import ABC, abstractmethod
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Callable, Iterable, NamedTuple, Optional
+
+from openai import NOT_GIVEN
+from openai.types.chat import ChatCompletionMessage
+
+from .askable import Askable
+from .cancellation import CancellationToken, Deadline
+from .conversation import Conversation
+from .llm import LLM, DeferredResponse, LLMConstraints, is_turn_ending
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Results of runs worth retrying, never checkpointed so they run again on resume
+RETRYABLE_RESULTS = frozenset(["error", "cancelled", "deadline-exceeded", "deferred"])
+
+
+class BatchItem(NamedTuple):
+    """The outcome of one conversation of a batch.
+
+    Args:
+        index (int): The position of the conversation in the batch input.
+        key (str): The key identifying the conversation in the checkpoint.
+        result (str): The result code of the askable, "error" if it raised.
+        conversation (Conversation): The conversation, restored from the checkpoint for resumed items.
+        usage (dict): The tokens used by the run, with "total_tokens", "prompt_tokens" and "completion_tokens" keys.
+        seconds (float): The duration of the run.
+        error (str): The error raised by the askable, if any.
+        resumed (bool): Whether the item was completed by a previous run and restored from the checkpoint.
+    """
+
+    index: int
+    key: str
+    result: str
+    conversation: Conversation
+    usage: dict
+    seconds: float
+    error: Optional[str] = None
+    resumed: bool = False
+
+    def to_dict(self) -> dict:
+        """Convert the item to a raw dictionary, as stored in the checkpoint."""
+        return {
+            "index": self.index,
+            "key": self.key,
+            "result": self.result,
+            "conversation": self.conversation.to_dict(),
+            "usage": self.usage,
+            "seconds": self.seconds,
+            "error": self.error,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "BatchItem":
+        """Create a resumed item from a raw dictionary."""
+        return cls(
+            index=data["index"],
+            key=data["key"],
+            result=data["result"],
+            conversation=Conversation.from_dict(data["conversation"]),
+            usage=data["usage"],
+            seconds=data["seconds"],
+            error=data.get("error"),
+            resumed=True,
+        )
+
+
+class BatchReport(NamedTuple):
+    """Aggregate statistics of a batch run, excluding the items resumed from the checkpoint.
+
+    Args:
+        completed (int): The number of conversations run.
+        resumed (int): The number of conversations restored from the checkpoint.
+        results (dict[str, int]): The number of conversations run by result code.
+        seconds (float): The elapsed time of the batch run.
+        throughput (float): The number of conversations run per second.
+        total_tokens (int): The tokens used by the conversations run.
+        prompt_tokens (int): The prompt tokens used by the conversations run.
+        completion_tokens (int): The completion tokens used by the conversations run.
+    """
+
+    completed: int
+    resumed: int
+    results: dict
+    seconds: float
+    throughput: float
+    total_tokens: int
+    prompt_tokens: int
+    completion_tokens: int
+
+
+class BatchRun:
+    """A run of an askable over many independent conversations, with bounded concurrency.
+
+    The conversations are consumed lazily and run on a thread pool, while the
+    outcomes are yielded as `BatchItem`s, in completion order or in input order.
+    With a checkpoint file, each completed conversation is appended to it as a JSON
+    line; running the batch again with the same file skips (and yields back) the
+    conversations already completed, so an interrupted batch resumes where it
+    stopped. Failed, cancelled and timed out conversations are not checkpointed.
+
+    Example:
+        run = agent.ask_many(conversations, concurrency=16, checkpoint="enrichment.jsonl")
+        for item in run:
+            print(item.key, item.result, item.conversation.messages[-1]["content"])
+        print(run.report())
+    """
+
+    def __init__(
+        self,
+        askable,
+        conversations: Iterable[Conversation],
+        concurrency: int = 8,
+        ordered: bool = False,
+        checkpoint: Optional[str] = None,
+        key: Optional[Callable[[Conversation, int], str]] = None,
+        timeout: Optional[float] = None,
+    ):
+        """Initialize the BatchRun.
+
+        Args:
+            askable (Askable): The askable to ask each conversation.
+            conversations (Iterable[Conversation]): The conversations to run, consumed lazily.
+            concurrency (int): The maximum number of conversations running at the same time.
+            ordered (bool): Whether to yield the outcomes in input order, rather than as they complete.
+            checkpoint (str): The path of the JSONL checkpoint file, created if missing. Optional, no checkpoint when not provided.
+            key (Callable[[Conversation, int], str]): A function returning the checkpoint key of a conversation, given the conversation and its index. Optional, the index when not provided, which requires the input order to be stable across runs.
+            timeout (float): The time budget of each conversation, in seconds. Optional, unbounded when not provided.
+        """
+        if concurrency < 1:
+            raise ValueError("Concurrency must be at least 1")
+        self.askable = askable
+        self.conversations = conversations
+        self.concurrency = concurrency
+        self.ordered = ordered
+        self.checkpoint = checkpoint
+        self.key = key or (lambda conversation, index: str(index))
+        self.timeout = timeout
+        # Shared by all the conversations, so the whole batch can be cancelled
+        self.cancellation = CancellationToken()
+        self._results = Counter()
+        self._usage = Counter()
+        self._resumed = 0
+        self._started_at = None
+        self._finished_at = None
+        self._started = False
+        self._lock = threading.Lock()
+
+    def __iter__(self):
+        if self._started:
+            raise RuntimeError("A batch run can only be iterated once")
+        self._started = True
+        self._started_at = time.monotonic()
+        completed = self._load_checkpoint()
+        inputs = enumerate(self.conversations)
+        exhausted = False
+        pending = {}
+        # Outcomes waiting for earlier ones, in ordered mode
+        buffered = {}
+        next_index = 0
+        # Bounds the outcomes held in memory while an earlier conversation is still running
+        window = self.concurrency * 4
+
+        pool = ThreadPoolExecutor(
+            max_workers=self.concurrency, thread_name_prefix="batch"
+        )
+        writer = self._open_checkpoint()
+        try:
+            while True:
+                ready = []
+                while (
+                    not exhausted
+                    and not self.cancellation.cancelled
+                    and len(pending) < self.concurrency
+                    and len(pending) + len(buffered) < window
+                ):
+                    try:
+                        index, conversation = next(inputs)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    key = self.key(conversation, index)
+                    if key in completed:
+                        self._resumed += 1
+                        ready.append(completed.pop(key)._replace(index=index))
+                    else:
+                        future = pool.submit(self._run_one, index, key, conversation)
+                        pending[future] = index
+
+                if not ready and pending:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        del pending[future]
+                        item = future.result()
+                        self._record(item, writer)
+                        ready.append(item)
+
+                if not self.ordered:
+                    yield from ready
+                else:
+                    buffered.update((item.index, item) for item in ready)
+                    while next_index in buffered:
+                        yield buffered.pop(next_index)
+                        next_index += 1
+                    if self.cancellation.cancelled and not pending:
+                        # Inputs skipped by the cancellation leave gaps
+                        for index in sorted(buffered):
+                            yield buffered.pop(index)
+
+                if not pending and not ready and (exhausted or self.cancellation.cancelled):
+                    break
+        finally:
+            if pending:
+                # The consumer went away, stop the conversations still running
+                self.cancellation.cancel("batch-abandoned")
+            pool.shutdown(wait=True)
+            if writer is not None:
+                writer.close()
+            self._finished_at = time.monotonic()
+
+    def run(self) -> list[BatchItem]:
+        """Run the whole batch, returning all the outcomes."""
+        return list(self)
+
+    def cancel(self, reason: str = "cancelled"):
+        """Cancel the batch: no further conversation starts, and the running ones stop as soon as possible.
+
+        Args:
+            reason (str): The reason of the cancellation.
+        """
+        self.cancellation.cancel(reason)
+
+    def report(self) -> BatchReport:
+        """Get the aggregate statistics of the run so far."""
+        with self._lock:
+            results = dict(self._results)
+            usage = dict(self._usage)
+        if self._started_at is None:
+            seconds = 0.0
+        else:
+            seconds = (self._finished_at or time.monotonic()) - self._started_at
+        completed = sum(results.values())
+        return BatchReport(
+            completed=completed,
+            resumed=self._resumed,
+            results=results,
+            seconds=seconds,
+            throughput=completed / seconds if seconds > 0 else 0.0,
+            total_tokens=usage.get("total_tokens", 0),
+            prompt_tokens=usage.get("prompt_tokens", 0),
+            completion_tokens=usage.get("completion_tokens", 0),
+        )
+
+    def _run_one(self, index: int, key: str, conversation: Conversation) -> BatchItem:
+        conversation.cancellation = self.cancellation
+        conversation.deadline = (
+            Deadline(self.timeout) if self.timeout is not None else None
+        )
+        before = conversation.metrics.model_dump()
+        start = time.monotonic()
+        error = None
+        try:
+            result = self.askable.ask(conversation)
+        except Exception as e:
+            logger.error("Error running batch item %s: %s", key, e)
+            result = "error"
+            error = str(e)
+        seconds = time.monotonic() - start
+        after = conversation.metrics.model_dump()
+        usage = {
+            name: after[name] - before[name]
+            for name in ("total_tokens", "prompt_tokens", "completion_tokens")
+        }
+        return BatchItem(index, key, result, conversation, usage, seconds, error)
+
+    def _record(self, item: BatchItem, writer):
+        with self._lock:
+            self._results[item.result] += 1
+            self._usage.update(item.usage)
+        if writer is not None and item.result not in RETRYABLE_RESULTS:
+            # One line per item, flushed so a crash loses at most the items in flight
+            writer.write(json.dumps(item.to_dict()) + "\n")
+            writer.flush()
+
+    def _open_checkpoint(self):
+        if not self.checkpoint:
+            return None
+        writer = open(self.checkpoint, "a+", encoding="utf-8")
+        if writer.tell() > 0:
+            writer.seek(writer.tell() - 1)
+            if writer.read(1) != "\n":
+                # Terminate a line truncated by a crash, so the next item gets its own line
+                writer.write("\n")
+        return writer
+
+    def _load_checkpoint(self) -> dict[str, BatchItem]:
+        completed = {}
+        if not self.checkpoint or not os.path.exists(self.checkpoint):
+            return completed
+        with open(self.checkpoint, encoding="utf-8") as reader:
+            for line in reader:
+                try:
+                    item = BatchItem.from_dict(json.loads(line))
+                except (ValueError, KeyError):
+                    # A line truncated by a crash, its conversation runs again
+                    logger.warning("Skipping invalid checkpoint line: %s", line[:100])
+                    continue
+                completed[item.key] = item
+        logger.debug("Loaded %d completed items from %s", len(completed), self.checkpoint)
+        return completed
+
+
+class BatchSubmitter(ABC):
+    """Base class for the services running JSONL batch files in the OpenAI batch format."""
+
+    @abstractmethod
+    def submit(self, input_file: str) -> str:
+        """Submit a batch file.
+
+        Args:
+            input_file (str): The path of the JSONL file, with one chat completion request per line.
+
+        Returns:
+            str: The ID of the batch job.
+        """
+        pass
+
+    @abstractmethod
+    def results(self, job_id: str) -> Optional[list[dict]]:
+        """Get the output lines of a batch job, or None while it is still running."""
+        pass
+
+
+class LocalBatchSubmitter(BatchSubmitter):
+    """A stand-in for a batch service, processing the batch files with any LLM, in the background.
+
+    Each request is completed with a single `complete` of the LLM, without running the
+    tool loop, so tool calls are returned in the output for the BatchLLM to run.
+    """
+
+    def __init__(self, llm: LLM, concurrency: int = 4):
+        """Initialize the LocalBatchSubmitter.
+
+        Args:
+            llm (LLM): The LLM completing the requests.
+            concurrency (int): The maximum number of requests completed at the same time.
+        """
+        self.llm = llm
+        self.concurrency = concurrency
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, input_file: str) -> str:
+        job_id = os.path.splitext(input_file)[0] + ".output.jsonl"
+        with self._lock:
+            self._jobs[job_id] = None
+        threading.Thread(
+            target=self._process, args=(input_file, job_id), daemon=True
+        ).start()
+        return job_id
+
+    def results(self, job_id: str) -> Optional[list[dict]]:
+        with self._lock:
+            return self._jobs[job_id]
+
+    def _process(self, input_file: str, job_id: str):
+        with open(input_file, encoding="utf-8") as reader:
+            requests = [json.loads(line) for line in reader if line.strip()]
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            lines = list(pool.map(self._complete, requests))
+        with open(job_id, "w", encoding="utf-8") as writer:
+            writer.writelines(json.dumps(line) + "\n" for line in lines)
+        with self._lock:
+            self._jobs[job_id] = lines
+
+    def _complete(self, request: dict) -> dict:
+        body = request["body"]
+        try:
+            message, usage = self.llm.complete(
+                messages=body["messages"],
+                tools=body.get("tools"),
+                temperature=body.get("temperature", 0.7),
+            )
+        except Exception as e:
+            logger.error("Error completing batch request %s: %s", request["custom_id"], e)
+            return {
+                "custom_id": request["custom_id"],
+                "response": None,
+                "error": {"code": "local_error", "message": str(e)},
+            }
+        if not isinstance(message, dict):
+            message = message.model_dump()
+        finish_reason = "tool_calls" if message.get("tool_calls") else "stop"
+        return {
+            "custom_id": request["custom_id"],
+            "response": {
+                "status_code": 200,
+                "body": {
+                    "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+                    "usage": usage,
+                },
+            },
+            "error": None,
+        }
+
+
+class BatchLLM(LLM):
+    """LLM collecting the requests into batch files, for large non-interactive runs at batch pricing.
+
+    Asking an agent using this LLM does not call any model: the request is queued,
+    and the agent returns "deferred", leaving the conversation untouched. `submit`
+    writes the queued requests into a JSONL file in the OpenAI batch format and
+    hands it to the submitter. Once the results arrive, asking the agent again
+    with the same conversation finds its response, keyed by a hash of the request
+    body. Tool calls are run on the caller side, and each round trip is a request
+    of the next batch. `run` automates the rounds, resuming each conversation from
+    its last deferred request (see `resuming`), so every tool call runs once.
+
+    Only agents are supported, as the askables orchestrating them cannot be suspended.
+
+    Example:
+        llm = BatchLLM(config, submitter=LocalBatchSubmitter(AzureOpenAILLM(config)))
+        agent = Agent(..., llm=llm)
+        items = llm.run(agent, conversations)
+    """
+
+    def __init__(
+        self,
+        config: dict,
+        submitter: BatchSubmitter,
+        directory: Optional[str] = None,
+        constraints: Optional[LLMConstraints] = LLMConstraints(),
+    ):
+        """Initialize the BatchLLM.
+
+        Args:
+            config (dict): The configuration, with the "azure_deployment" used as model name in the requests.
+            submitter (BatchSubmitter): The service running the batch files.
+            directory (str): The directory of the batch files. Optional, a temporary directory when not provided.
+        """
+        super().__init__(config, constraints=constraints)
+        self.submitter = submitter
+        self.directory = directory or tempfile.mkdtemp(prefix="batch-")
+        self.jobs = []
+        self._pending = OrderedDict()
+        self._responses = {}
+        # Messages and usage of the deferred requests, to resume their tool loop
+        self._deferred = {}
+        # Number of asks waiting for each response, which is dropped once they all got it
+        self._waiting = Counter()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    @property
+    def pending(self) -> int:
+        """The number of requests queued for the next batch."""
+        with self._lock:
+            return len(self._pending)
+
+    def ask(
+        self,
+        messages: list,
+        tools: list = None,
+        tools_function: dict[str, callable] = None,
+        temperature: float = 0.7,
+        response_format=NOT_GIVEN,
+        timeout: Optional[float] = None,
+    ):
+        """Get the response of the request from the batch results, queueing it when missing.
+
+        Raises:
+            DeferredResponse: The response is not available yet, the request is queued for the next batch.
+        """
+        if response_format not in (None, NOT_GIVEN):
+            raise NotImplementedError("Structured output is not supported in batch mode")
+        temperature = self.constraints.temperature if self.constraints.temperature else temperature
+        messages = list(self._check_system_messages(messages))
+        messages, usage = self._resume(messages)
+
+        # Must iterate until there are no more tool calls, each round trip is a request of its own
+        while True:
+            try:
+                response = self._response(messages, tools, temperature)
+            except DeferredResponse as e:
+                with self._lock:
+                    self._deferred[e.request_id] = (list(messages), Counter(usage))
+                raise
+            usage.update(response.get("usage") or {})
+            message = response["choices"][0]["message"]
+            if not message.get("tool_calls"):
+                break
+            logger.debug("Tool calls detected: %s", message["tool_calls"])
+            messages.append(message)
+            end_result = None
+            for tool_call in message["tool_calls"]:
+                function_args = json.loads(tool_call["function"]["arguments"])
+                function = tools_function[tool_call["function"]["name"]]
+                function_result = function(**function_args)
+                if is_turn_ending(function):
+                    end_result = function_result
+                messages.append(
+                    {
+                        "tool_call_id": tool_call["id"],
+                        "role": "tool",
+                        "name": tool_call["function"]["name"],
+                        "content": function_result,
+                    }
+                )
+            if end_result is not None:
+                # E.g. a handoff, the next agent answers instead of queueing another request
+                message = {"role": "assistant", "content": message.get("content") or end_result}
+                break
+
+        return ChatCompletionMessage.model_validate(message), {
+            "completion_tokens": usage["completion_tokens"],
+            "prompt_tokens": usage["prompt_tokens"],
+            "total_tokens": usage["total_tokens"],
+        }
+
+    def ask_stream(
+        self,
+        messages: list,
+        tools: list = None,
+        tools_function: dict[str, callable] = None,
+        temperature: float = 0.7,
+        cancellation: Optional[CancellationToken] = None,
+        timeout: Optional[float] = None,
+    ):
+        """Same as `ask`, as batch responses cannot be streamed."""
+        yield ["start", ""]
+        message, usage = self.ask(
+            messages=messages,
+            tools=tools,
+            tools_function=tools_function,
+            temperature=temperature,
+        )
+        response_message = message.model_dump(exclude_none=True)
+        yield ["response", [response_message, usage]]
+        yield ["end", ""]
+        return [response_message, usage]
+
+    @contextmanager
+    def resuming(self, conversation: Conversation):
+        """Resume the tool loop of the last request deferred for the conversation, instead of replaying it.
+
+        Within the block, `ask` continues from the messages of that request when the
+        conversation did not change since, so the tools called in the previous rounds
+        do not run again, and variable updates do not change the request. Otherwise,
+        the tool loop is replayed from the first request.
+
+        Example:
+            with llm.resuming(conversation):
+                agent.ask(conversation)
+        """
+        event = conversation.log.last(kind="agent/deferred")
+        self._local.request_id = event.payload[0] if event is not None else None
+        try:
+            yield
+        finally:
+            self._local.request_id = None
+
+    def _resume(self, messages: list) -> tuple[list, Counter]:
+        request_id = getattr(self._local, "request_id", None)
+        with self._lock:
+            deferred = self._deferred.get(request_id)
+        if deferred is not None:
+            deferred_messages, usage = deferred
+            # Same history after the system message, which may have been rendered again since
+            if messages[1:] == deferred_messages[1 : len(messages)]:
+                logger.debug("Resuming the tool loop of request %s", request_id)
+                return list(deferred_messages), Counter(usage)
+        return messages, Counter()
+
+    def submit(self) -> Optional[str]:
+        """Write the queued requests into a batch file and submit it.
+
+        Returns:
+            str: The ID of the batch job, or None if no request was queued.
+        """
+        with self._lock:
+            lines, self._pending = list(self._pending.values()), OrderedDict()
+        if not lines:
+            return None
+        input_file = os.path.join(
+            self.directory, f"batch-{len(self.jobs)}-{int(time.time())}.jsonl"
+        )
+        with open(input_file, "w", encoding="utf-8") as writer:
+            writer.writelines(json.dumps(line) + "\n" for line in lines)
+        job_id = self.submitter.submit(input_file)
+        self.jobs.append(job_id)
+        logger.debug("Submitted batch %s with %d requests", job_id, len(lines))
+        return job_id
+
+    def poll(self, job_id: str) -> bool:
+        """Collect the results of a batch job, returning whether it completed."""
+        lines = self.submitter.results(job_id)
+        if lines is None:
+            return False
+        with self._lock:
+            for line in lines:
+                self._responses[line["custom_id"]] = line
+        return True
+
+    def wait(self, job_id: str, poll_interval: float = 30, timeout: Optional[float] = None) -> bool:
+        """Wait for a batch job to complete and collect its results, returning whether it completed in time."""
+        deadline = Deadline(timeout) if timeout is not None else None
+        while not self.poll(job_id):
+            if deadline is not None and deadline.expired:
+                return False
+            time.sleep(poll_interval)
+        return True
+
+    def run(
+        self,
+        askable,
+        conversations: Iterable[Conversation],
+        concurrency: int = 8,
+        max_rounds: int = 10,
+        poll_interval: float = 30,
+    ) -> list[BatchItem]:
+        """Run an agent over many conversations, in batch rounds, until none is deferred.
+
+        Args:
+            askable (Askable): The agent to ask, using this LLM.
+            conversations (Iterable[Conversation]): The conversations to run.
+            concurrency (int): The maximum number of conversations asked at the same time in each round.
+            max_rounds (int): The maximum number of batches, e.g. a tool call needs a round of its own.
+            poll_interval (float): The delay between checks of the batch completion, in seconds.
+
+        Returns:
+            list[BatchItem]: The outcomes, in input order. Conversations still waiting after the last round are "deferred".
+        """
+        waiting = list(enumerate(conversations))
+        outcomes = {}
+        for attempt in range(max_rounds):
+            run = BatchRun(
+                _ResumingAskable(self, askable),
+                [conversation for _, conversation in waiting],
+                concurrency=concurrency,
+                ordered=True,
+            )
+            deferred = []
+            for (index, conversation), item in zip(waiting, run):
+                outcomes[index] = item._replace(index=index, key=str(index))
+                if item.result == "deferred":
+                    deferred.append((index, conversation))
+            logger.info(
+                "Batch round %d: %d conversations run, %d deferred",
+                attempt,
+                len(waiting),
+                len(deferred),
+            )
+            if not deferred:
+                break
+            waiting = deferred
+            if attempt < max_rounds - 1:
+                job_id = self.submit()
+                if job_id is None:
+                    logger.warning(
+                        "Batch round %d: no request queued for the deferred conversations",
+                        attempt,
+                    )
+                    break
+                self.wait(job_id, poll_interval=poll_interval)
+        return [outcomes[index] for index in sorted(outcomes)]
+
+    def _response(self, messages: list, tools: list, temperature: float) -> dict:
+        body = {
+            "model": self.config["azure_deployment"],
+            "messages": messages,
+            "temperature": temperature,
+        }
+        if tools:
+            body["tools"] = tools
+            body["tool_choice"] = "auto"
+        custom_id = request_id(body)
+
+        with self._lock:
+            line = self._responses.get(custom_id)
+            if line is None:
+                self._waiting[custom_id] += 1
+                # Identical requests of different conversations are sent once
+                self._pending[custom_id] = {
+                    "custom_id": custom_id,
+                    "method": "POST",
+                    "url": "/v1/chat/completions",
+                    "body": {**body, "messages": list(messages)},
+                }
+            else:
+                self._consume(custom_id)
+
+        if line is None:
+            raise DeferredResponse(custom_id)
+        if line.get("error") or line["response"]["status_code"] != 200:
+            raise Exception(f"Batch request {custom_id} failed: {line.get('error')}")
+        return line["response"]["body"]
+
+    def _consume(self, custom_id: str):
+        # Drop the response and the deferred request once every ask waiting for them got the response
+        self._waiting[custom_id] -= 1
+        if self._waiting[custom_id] <= 0:
+            del self._waiting[custom_id]
+            self._responses.pop(custom_id, None)
+            self._deferred.pop(custom_id, None)
+
+
+class _ResumingAskable(Askable):
+    # Asks an askable within `BatchLLM.resuming`, in the batch worker thread
+
+    def __init__(self, llm: BatchLLM, askable: Askable):
+        super().__init__(askable.id, askable.description)
+        self.llm = llm
+        self.askable = askable
+
+    def ask(self, conversation: Conversation, stream=False):
+        with self.llm.resuming(conversation):
+            return self.askable.ask(conversation, stream=stream)
+
+
+def request_id(body: dict) -> str:
+    """Compute the custom ID of a batch request, as the hash of its canonical body."""
+    canonical = json.dumps(body, sort_keys=True, separators=(",", ":"), default=str)
+    return "request-" + hashlib.sha256(canonical.encode("utf-8")).hexdigest()
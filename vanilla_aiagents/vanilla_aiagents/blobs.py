@@ -0,0 +1,321 @@
+import base64
+from contextlib import contextmanager
+import hashlib
+import mmap
+import os
+import re
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Blob references mimic data URLs, e.g. "blob:image/jpeg;sha256,<hex digest>"
+_REF_PATTERN = re.compile(r"^blob:(?P<media_type>[^;,]*);sha256,(?P<digest>[0-9a-f]{64})$")
+_DATA_URL_PATTERN = re.compile(r"^data:(?P<media_type>[^;,]*);base64,")
+DIGEST_PATTERN = r"^[0-9a-f]{64}$"
+_DIGEST_PATTERN = re.compile(DIGEST_PATTERN)
+
+
+class BlobNotFoundError(KeyError):
+    """Raised when a referenced blob is not available in the store."""
+
+    pass
+
+
+class BlobDigestMismatchError(ValueError):
+    """Raised when a received blob does not match the digest it was sent with."""
+
+    pass
+
+
+class InvalidBlobDigestError(ValueError):
+    """Raised when a digest is not a SHA-256 hex digest, e.g. a path sent by a client."""
+
+    pass
+
+
+class BlobStore(ABC):
+    """Base class for content-addressed blob stores, keyed by SHA-256 hex digest."""
+
+    @abstractmethod
+    def get(self, digest: str) -> Optional[bytes]:
+        """Get the content of a blob, or None when the blob is not in the store."""
+        pass
+
+    @abstractmethod
+    def put(self, data: bytes) -> str:
+        """Store a blob and return its digest."""
+        pass
+
+    @contextmanager
+    def open(self, digest: str):
+        """Open the content of a blob for reading, yielding a bytes-like object or None.
+
+        The content is only valid within the block, which lets stores hand out memory
+        maps instead of copies.
+
+        Example:
+            with store.open(digest) as data:
+                encoded = base64.b64encode(data)
+        """
+        yield self.get(digest)
+
+    def has(self, digest: str) -> bool:
+        """Check whether the blob is in the store."""
+        return self.get(digest) is not None
+
+    def missing(self, digests: Iterable[str]) -> list[str]:
+        """Return the digests which are not in the store."""
+        return [digest for digest in digests if not self.has(digest)]
+
+
+def compute_digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def validate_digest(digest: str) -> str:
+    """Check that the digest is a SHA-256 hex digest, returning it.
+
+    Raises:
+        InvalidBlobDigestError: if the digest is not a lowercase 64 characters hex string.
+    """
+    if not isinstance(digest, str) or not _DIGEST_PATTERN.match(digest):
+        raise InvalidBlobDigestError(f"Invalid blob digest: {digest!r}")
+    return digest
+
+
+class InMemoryBlobStore(BlobStore):
+    """A blob store keeping blobs in memory, evicting the least recently used ones beyond a size limit."""
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024):
+        """Initialize the InMemoryBlobStore.
+
+        Args:
+            max_bytes (int): The maximum total size of the stored blobs.
+        """
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._blobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, digest: str) -> Optional[bytes]:
+        with self._lock:
+            data = self._blobs.get(digest)
+            if data is not None:
+                self._blobs.move_to_end(digest)
+            return data
+
+    def has(self, digest: str) -> bool:
+        with self._lock:
+            return digest in self._blobs
+
+    def put(self, data: bytes) -> str:
+        digest = compute_digest(data)
+        with self._lock:
+            if digest in self._blobs:
+                self._blobs.move_to_end(digest)
+                return digest
+            self._blobs[digest] = bytes(data)
+            self.size += len(data)
+            # Always keep the latest blob, even when larger than the limit
+            while self.size > self.max_bytes and len(self._blobs) > 1:
+                _, evicted = self._blobs.popitem(last=False)
+                self.size -= len(evicted)
+        return digest
+
+
+class FileSystemBlobStore(BlobStore):
+    """A blob store persisting blobs as files in a local directory.
+
+    Blobs opened with `open` are read through a memory map by default, so the content
+    is paged in by the OS instead of being copied on the Python heap. The map is closed
+    at the end of the block.
+    """
+
+    def __init__(self, directory: str, use_mmap: bool = True):
+        """Initialize the FileSystemBlobStore.
+
+        Args:
+            directory (str): The directory where to store the blobs. Created if missing.
+            use_mmap (bool): Whether `open` reads blobs through a memory map.
+        """
+        self.directory = directory
+        self.use_mmap = use_mmap
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, digest: str) -> str:
+        # Digests come from remote clients, never let them escape the directory
+        validate_digest(digest)
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def get(self, digest: str) -> Optional[bytes]:
+        path = self._path(digest)
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as f:
+            return f.read()
+
+    @contextmanager
+    def open(self, digest: str):
+        path = self._path(digest)
+        if not self.use_mmap or not os.path.exists(path) or os.path.getsize(path) == 0:
+            yield self.get(digest)
+            return
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            yield data
+
+    def has(self, digest: str) -> bool:
+        return os.path.exists(self._path(digest))
+
+    def put(self, data: bytes) -> str:
+        digest = compute_digest(data)
+        path = self._path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write to a temporary file first, so readers never see partial blobs
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        return digest
+
+
+class TieredBlobStore(BlobStore):
+    """A blob store combining a fast cache (e.g. in-memory) with a backing store (e.g. filesystem)."""
+
+    def __init__(self, cache: BlobStore, backing: BlobStore):
+        """Initialize the TieredBlobStore.
+
+        Args:
+            cache (BlobStore): The store to look up first.
+            backing (BlobStore): The store holding all the blobs.
+        """
+        self.cache = cache
+        self.backing = backing
+
+    def get(self, digest: str) -> Optional[bytes]:
+        data = self.cache.get(digest)
+        if data is None:
+            data = self.backing.get(digest)
+            if data is not None:
+                self.cache.put(data)
+        return data
+
+    def has(self, digest: str) -> bool:
+        return self.cache.has(digest) or self.backing.has(digest)
+
+    def put(self, data: bytes) -> str:
+        self.backing.put(data)
+        return self.cache.put(data)
+
+
+def make_ref(digest: str, media_type: str) -> str:
+    return f"blob:{media_type};sha256,{digest}"
+
+
+def parse_ref(url: str) -> Optional[tuple[str, str]]:
+    """Parse a blob reference, returning (media type, digest) or None if not a reference."""
+    match = _REF_PATTERN.match(url)
+    return (match["media_type"], match["digest"]) if match else None
+
+
+def _image_parts(message: dict):
+    content = message.get("content")
+    if not isinstance(content, list):
+        return []
+    return [
+        part
+        for part in content
+        if isinstance(part, dict) and part.get("type") == "image_url"
+    ]
+
+
+def _replace_urls(message: dict, replace) -> dict:
+    """Return the message with image URLs replaced, or the same message if nothing changed."""
+    if not _image_parts(message):
+        return message
+    changed = False
+    content = []
+    for part in message["content"]:
+        if isinstance(part, dict) and part.get("type") == "image_url":
+            url = part["image_url"]["url"]
+            new_url = replace(url)
+            if new_url is not url:
+                changed = True
+                part = {**part, "image_url": {**part["image_url"], "url": new_url}}
+        content.append(part)
+    return {**message, "content": content} if changed else message
+
+
+def externalize_message(message: dict, store: BlobStore) -> dict:
+    """Move the inline base64 images of a message into the store, replacing them with blob references."""
+
+    def replace(url: str) -> str:
+        match = _DATA_URL_PATTERN.match(url)
+        if match is None:
+            return url
+        digest = store.put(base64.b64decode(url[match.end() :]))
+        return make_ref(digest, match["media_type"])
+
+    return _replace_urls(message, replace)
+
+
+def resolve_messages(messages: list[dict], store: BlobStore) -> list[dict]:
+    """Replace the blob references of the messages with data URLs, as expected by the LLM.
+
+    Raises:
+        BlobNotFoundError: if a referenced blob is not in the store.
+    """
+
+    def replace(url: str) -> str:
+        ref = parse_ref(url)
+        if ref is None:
+            return url
+        media_type, digest = ref
+        with store.open(digest) as data:
+            if data is None:
+                raise BlobNotFoundError(digest)
+            return f"data:{media_type};base64,{base64.b64encode(data).decode('utf-8')}"
+
+    return [_replace_urls(message, replace) for message in messages]
+
+
+def collect_digests(messages: list[dict]) -> list[str]:
+    """Collect the digests of all the blobs referenced by the messages, in order and without duplicates."""
+    digests = {}
+    for message in messages:
+        for part in _image_parts(message):
+            ref = parse_ref(part["image_url"]["url"])
+            if ref is not None:
+                digests[ref[1]] = None
+    return list(digests)
+
+
+def encode_blobs(store: BlobStore, digests: Iterable[str]) -> dict[str, str]:
+    """Encode the given blobs as base64 strings, for transport."""
+    blobs = {}
+    for digest in digests:
+        with store.open(digest) as data:
+            if data is not None:
+                blobs[digest] = base64.b64encode(data).decode("utf-8")
+    return blobs
+
+
+def decode_blobs(store: BlobStore, blobs: dict[str, str]):
+    """Store blobs received as base64 strings, verifying their digest.
+
+    Raises:
+        BlobDigestMismatchError: if a blob does not match its digest, e.g. when corrupted in transit.
+    """
+    for digest, encoded in blobs.items():
+        data = base64.b64decode(encoded)
+        actual = compute_digest(data)
+        if actual != digest:
+            raise BlobDigestMismatchError(
+                f"Blob digest mismatch: expected {digest}, got {actual}"
+            )
+        store.put(data)
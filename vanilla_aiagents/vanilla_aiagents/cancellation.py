@@ -0,0 +1,161 @@
+import functools
+import inspect
+import threading
+import time
+from typing import Callable
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class CancellationToken:
+    """A cooperative cancellation signal, shared by all the askables of a run.
+
+    Askables check the token between steps and stop early when it is cancelled, while
+    long-running operations (e.g. a streaming LLM completion) can register a callback
+    to be interrupted as soon as the cancellation is requested.
+    """
+
+    def __init__(self):
+        """Initialize the CancellationToken."""
+        self.reason = None
+        self._event = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self, reason: str = "cancelled"):
+        """Request the cancellation, invoking the registered callbacks once.
+
+        Args:
+            reason (str): The reason of the cancellation, e.g. "client-disconnected".
+        """
+        with self._lock:
+            if self._event.is_set():
+                return
+            self.reason = reason
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+
+        logger.debug("Cancellation requested: %s", reason)
+        for callback in callbacks:
+            _invoke(callback)
+
+    def on_cancel(self, callback: Callable[[], None]) -> Callable[[], None]:
+        """Register a callback invoked when the cancellation is requested.
+
+        The callback is invoked immediately if the token is already cancelled.
+
+        Args:
+            callback (Callable): The function to invoke, with no arguments.
+
+        Returns:
+            Callable: A function unregistering the callback.
+        """
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return lambda: self._unregister(callback)
+
+        _invoke(callback)
+        return lambda: None
+
+    def _unregister(self, callback: Callable[[], None]):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def wait(self, timeout: float = None) -> bool:
+        """Wait for the cancellation to be requested, returning whether it was."""
+        return self._event.wait(timeout)
+
+
+class Deadline:
+    """The point in time by which a run must complete, shared by all its askables.
+
+    The deadline is measured on the monotonic clock, so it is forwarded to remote
+    hosts as a remaining time budget rather than as an absolute time.
+
+    Example:
+        deadline = Deadline(30)
+        llm.ask(messages, timeout=deadline.remaining())
+    """
+
+    def __init__(self, timeout: float):
+        """Initialize the Deadline.
+
+        Args:
+            timeout (float): The time budget of the run from now, in seconds.
+        """
+        self.expires_at = time.monotonic() + timeout
+
+    def remaining(self) -> float:
+        """Get the remaining time budget, in seconds. Never negative."""
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires_at
+
+
+# Names of the errors raised by the LLM and remote clients when a call times out
+_TIMEOUT_ERRORS = frozenset(["APITimeoutError", "Timeout", "TimeoutException"])
+
+
+def is_timeout(error: BaseException) -> bool:
+    """Whether an error reports a timed out call, e.g. an LLM request or a remote call cut by the run deadline."""
+    while error is not None:
+        if isinstance(error, TimeoutError) or any(
+            cls.__name__ in _TIMEOUT_ERRORS for cls in type(error).__mro__
+        ):
+            return True
+        # gRPC errors carry a status code instead
+        code = getattr(error, "code", None)
+        if callable(code):
+            try:
+                if getattr(code(), "name", None) == "DEADLINE_EXCEEDED":
+                    return True
+            except Exception:
+                pass
+        error = error.__cause__
+    return False
+
+
+def supported_kwargs(function: Callable, **kwargs) -> dict:
+    """Select the keyword arguments to pass to a function: the ones set, and accepted by its signature.
+
+    Lets callers forward the run budget (e.g. `timeout` or `cancellation`) to LLM or
+    connection subclasses written before these arguments existed.
+
+    Example:
+        llm.ask(messages=messages, **supported_kwargs(llm.ask, timeout=conversation.time_remaining()))
+    """
+    accepted, any_keyword = _parameters(getattr(function, "__func__", function))
+    return {
+        name: value
+        for name, value in kwargs.items()
+        if value is not None and (any_keyword or name in accepted)
+    }
+
+
+@functools.lru_cache(maxsize=256)
+def _parameters(function: Callable) -> tuple[frozenset, bool]:
+    try:
+        parameters = inspect.signature(function).parameters.values()
+    except (TypeError, ValueError):
+        return frozenset(), True
+    return (
+        frozenset(parameter.name for parameter in parameters),
+        any(parameter.kind is inspect.Parameter.VAR_KEYWORD for parameter in parameters),
+    )
+
+
+def _invoke(callback: Callable[[], None]):
+    try:
+        callback()
+    except Exception as e:
+        logger.error("Error in cancellation callback: %s", e)
@@ -0,0 +1,107 @@
+from collections import OrderedDict
+import json
+import threading
+from typing import Any, Callable, Optional
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class ContextPolicy:
+    """Selects the conversation variables an agent reads, and serializes them as its context.
+
+    The context replaces the `__context__` placeholder of the agent system message.
+    By default all the variables are included as they are. An allowlist restricts
+    them to the ones the agent actually reads, and oversized values are summarized
+    (or truncated) to bound the prompt tokens.
+
+    The serialized context is cached by variables version, so it is only computed
+    again when a variable is written. Summaries are cached by value.
+
+    NOTE changing a nested value in place (e.g. appending to a list variable) does not
+    change the version, so the cached context would be stale: with a policy, write
+    variables with `Conversation.set_variable` (or assign them) instead. Agents with
+    no policy serialize the variables on every request.
+
+    Example:
+        ContextPolicy(variables=["CHANNEL", "LANGUAGE"], max_size=500)
+    """
+
+    def __init__(
+        self,
+        variables: Optional[list[str]] = None,
+        max_size: Optional[int] = None,
+        summarizer: Optional[Callable[[str, str], str]] = None,
+        cache_size: int = 128,
+    ):
+        """Initialize the ContextPolicy.
+
+        Args:
+            variables (list[str]): The names of the variables to include. Optional, all variables when not provided.
+            max_size (int): The maximum size of a serialized value, in characters. Optional, values are never shortened when not provided.
+            summarizer (Callable[[str, str], str]): A function returning a summary given the variable name and its oversized serialized value. Optional, oversized values are truncated when not provided.
+            cache_size (int): The maximum number of serialized contexts and summaries cached.
+        """
+        self.variables = variables
+        self.max_size = max_size
+        self.summarizer = summarizer
+        self.cache_size = cache_size
+        self._fragments = OrderedDict()
+        self._summaries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def render(self, variables: dict) -> str:
+        """Serialize the selected variables as JSON, reusing the cached result when the variables did not change.
+
+        Args:
+            variables (dict): The conversation variables. Cached by version when a VariableStore.
+        """
+        version = getattr(variables, "version", None)
+        if version is not None:
+            with self._lock:
+                fragment = self._fragments.get(version)
+                if fragment is not None:
+                    self._fragments.move_to_end(version)
+                    return fragment
+
+        # Copying is atomic, so concurrent writers cannot change the variables while serializing
+        selected = dict(variables)
+        if self.variables is not None:
+            selected = {
+                name: selected[name] for name in self.variables if name in selected
+            }
+        if self.max_size is not None:
+            selected = {
+                name: self._shorten(name, value) for name, value in selected.items()
+            }
+        fragment = json.dumps(selected)
+
+        if version is not None:
+            with self._lock:
+                _put(self._fragments, version, fragment, self.cache_size)
+        return fragment
+
+    def _shorten(self, name: str, value: Any) -> Any:
+        serialized = value if isinstance(value, str) else json.dumps(value)
+        if len(serialized) <= self.max_size:
+            return value
+        if self.summarizer is None:
+            return serialized[: self.max_size] + "...[truncated]"
+
+        key = (name, serialized)
+        with self._lock:
+            summary = self._summaries.get(key)
+        if summary is None:
+            summary = self.summarizer(name, serialized)
+            logger.debug("Summarized context variable %s: %s", name, summary)
+            with self._lock:
+                _put(self._summaries, key, summary, self.cache_size)
+        return summary
+
+
+def _put(cache: OrderedDict, key, value, capacity: int):
+    cache[key] = value
+    cache.move_to_end(key)
+    while len(cache) > capacity:
+        cache.popitem(last=False)
@@ -1,8 +1,18 @@
 from abc import ABC, abstractmethod
-from queue import SimpleQueue
-from pydantic import BaseModel
-
+from collections import OrderedDict
+import hashlib
+import itertools
+import threading
+import warnings
+from typing import Callable, Iterable, Literal, Optional, Union
+from pydantic import BaseModel, PrivateAttr
+
+from .blobs import BlobStore, parse_ref, resolve_messages
+from .cancellation import CancellationToken, Deadline
+from .events import EventBus, EventBusClosed, StreamChannel, Subscription
 from .llm import LLM
+from .log import ConversationLog, LogSink
+from .messages import MessageList, as_dicts
 import logging
 
 logger = logging.getLogger(__name__)
@@ -10,88 +20,361 @@ logger = logging.getLogger(__name__)
 
 # a ConversationMetrics class with totalTokens, promptTokens and completionTokens
 class ConversationMetrics(BaseModel):
-    """A class to store conversation metrics."""
+    """A class to store conversation metrics.
+
+    Use `add` to accumulate usage, as `+=` on the fields is not atomic when several
+    askables of the conversation run concurrently.
+    """
 
     total_tokens: int = 0
     prompt_tokens: int = 0
     completion_tokens: int = 0
+    tool_calls: int = 0
+    tool_errors: int = 0
+    tool_timeouts: int = 0
+    tool_seconds: float = 0.0
+
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+
+    def add(self, usage: dict):
+        """Atomically accumulate the usage of an LLM call, or the metrics of another conversation.
+
+        Args:
+            usage (dict): The usage, with "total_tokens", "prompt_tokens" and "completion_tokens" keys, and optionally the tool metrics.
+        """
+        with self._lock:
+            self.total_tokens += usage["total_tokens"]
+            self.prompt_tokens += usage["prompt_tokens"]
+            self.completion_tokens += usage["completion_tokens"]
+            self.tool_calls += usage.get("tool_calls", 0)
+            self.tool_errors += usage.get("tool_errors", 0)
+            self.tool_timeouts += usage.get("tool_timeouts", 0)
+            self.tool_seconds += usage.get("tool_seconds", 0.0)
+
+    def add_tool_call(self, latency: float, outcome: str):
+        """Atomically record a tool call.
+
+        Args:
+            latency (float): The duration of the call in seconds, retries included.
+            outcome (str): The outcome of the call: "ok", "error" or "timeout".
+        """
+        with self._lock:
+            self.tool_calls += 1
+            self.tool_seconds += latency
+            if outcome == "error":
+                self.tool_errors += 1
+            elif outcome == "timeout":
+                self.tool_timeouts += 1
+
+
+# Shared by all the variable stores, so a version identifies a single state of a single store
+_variable_versions = itertools.count(1)
+# Shared by all the conversations, so a generation identifies a single message list
+_message_generations = itertools.count(1)
+
+
+class VariableStore(dict):
+    """The variables of a conversation, as a dictionary tracking a version.
+
+    Every write gets a new version, unique across all the stores, so derived data
+    (e.g. the serialized context of an agent) can be cached by version.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.version = next(_variable_versions)
+
+    def _touch(self):
+        # next() on a count is atomic, so concurrent writers never share a version
+        self.version = next(_variable_versions)
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self._touch()
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._touch()
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self._touch()
+
+    def setdefault(self, key, default=None):
+        value = super().setdefault(key, default)
+        self._touch()
+        return value
+
+    def pop(self, key, *args):
+        value = super().pop(key, *args)
+        self._touch()
+        return value
+
+    def popitem(self):
+        item = super().popitem()
+        self._touch()
+        return item
+
+    def clear(self):
+        super().clear()
+        self._touch()
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
 
 
 class Conversation:
     messages: list[dict]
     variables: dict[str, str]
-    log: list
+    log: ConversationLog
     metrics: ConversationMetrics
+    blob_store: BlobStore
     """A class to represent a conversation.
 
     This is only stateful object in the system, and is used to store the conversation
     state, including messages, variables, and metrics.
+
+    Askables running concurrently on the same conversation must mutate it through
+    `append_messages`, `replace_last_message`, `set_variable`, `merge_variables` and
+    `metrics.add`, which are atomic.
     """
 
     def __init__(
         self,
-        messages: list[dict] = [],
-        variables: dict[str, str] = {},
-        metrics=ConversationMetrics(
-            total_tokens=0, prompt_tokens=0, completion_tokens=0
-        ),
-        log=[],
+        messages: list[dict] = None,
+        variables: dict[str, str] = None,
+        metrics: ConversationMetrics = None,
+        log: list = None,
+        blob_store: BlobStore = None,
+        compact: bool = False,
+        log_capacity: int = 1000,
+        log_sink: LogSink = None,
+        event_capacity: int = 1024,
+        stream_maxsize: int = 0,
+        stream_policy: Literal["block", "coalesce"] = "block",
     ):
         """Initialize the Conversation object. All arguments are optional.
 
         Args:
-            messages (list[dict]): The list of messages in the conversation.
-            variables (dict[str, str]): The variables in the conversation.
-            metrics (ConversationMetrics): The metrics of the conversation.
-            log (list): The log of the conversation.
+            messages (list[dict]): The list of messages in the conversation. Optional, a new empty list when not provided.
+            variables (dict[str, str]): The variables in the conversation, copied into a VariableStore. Optional, empty when not provided.
+            metrics (ConversationMetrics): The metrics of the conversation. Optional, new zeroed metrics when not provided.
+            log (list): The initial log events of the conversation, as LogEvent or legacy tuples.
+            blob_store (BlobStore): The store holding the images referenced by the messages. Optional, when not provided images are kept inline.
+            compact (bool): Whether to store messages as compact, immutable Message objects to reduce memory usage.
+            log_capacity (int): The maximum number of log events kept in memory.
+            log_sink (LogSink): The sink receiving the log events evicted from memory. Optional.
+            event_capacity (int): The number of most recent updates retained for the event bus subscribers.
+            stream_maxsize (int): The maximum number of updates queued for the stream consumer. Optional, unbounded when 0.
+            stream_policy (str): What to do when the stream is full: "block" the producer, or "coalesce" consecutive text and tool call argument deltas.
         """
-        self.messages = messages
+        # Defaults are created per instance, so conversations never share state
+        messages = messages if messages is not None else []
+        self.compact = compact
+        self.messages = MessageList(messages) if compact else messages
         self.variables = variables
-        self.log = log
-        self.metrics = metrics
-        self.stream_queue = SimpleQueue()
+        self.log = ConversationLog(log or [], capacity=log_capacity, sink=log_sink)
+        self.metrics = metrics if metrics is not None else ConversationMetrics()
+        self.blob_store = blob_store
+        self.stream_channel = StreamChannel(maxsize=stream_maxsize, policy=stream_policy)
+        self.events = EventBus(capacity=event_capacity)
+        # Guards the messages and variables, reentrant so strategies can nest operations
+        self._lock = threading.RLock()
+        # Shared by all the askables of the current run, replaced on each run
+        self.cancellation = CancellationToken()
+        # The time budget of the current run, if any, checked by the askables between steps
+        self.deadline: Optional[Deadline] = None
+
+    @property
+    def messages(self) -> list[dict]:
+        return self._messages
+
+    @messages.setter
+    def messages(self, messages: list[dict]):
+        self._messages = messages
+        self._messages_generation = next(_message_generations)
+
+    @property
+    def variables(self) -> VariableStore:
+        return self._variables
+
+    @variables.setter
+    def variables(self, variables: dict):
+        # Always a versioned store, also when replaced with a plain dictionary. The
+        # dictionary is copied: later writes to it do not reach the conversation
+        self._variables = VariableStore(variables or {})
+
+    @property
+    def stream_queue(self) -> StreamChannel:
+        """Deprecated alias of `stream_channel`, which offers the same `get` and `put_nowait` methods."""
+        warnings.warn(
+            "Conversation.stream_queue is deprecated, use Conversation.stream_channel instead",
+            DeprecationWarning,
+            stacklevel=2,
+        )
+        return self.stream_channel
+
+    @property
+    def deadline_exceeded(self) -> bool:
+        """Whether the deadline of the current run, if any, has passed."""
+        return self.deadline is not None and self.deadline.expired
+
+    def time_remaining(self) -> Optional[float]:
+        """Get the remaining time budget of the current run in seconds, or None if it has no deadline."""
+        return self.deadline.remaining() if self.deadline is not None else None
 
     def stream(self):
         """Stream conversation updates, like LLM delta updates, to the consumer.
 
-        NOTE this is an INFINITE generator function, and must be kept so. Consumers
-        should break the loop themselves, typically using a stack count logic
+        NOTE this generator only ends when the stream channel is closed. Prefer a
+        `StreamSession` (see `stream` module), which ends deterministically when the
+        askable completes.
+        """
+        while True:
+            try:
+                mark, content = self.stream_channel.get()
+            except EventBusClosed:
+                return
+            yield [mark, content]
+
+    async def astream(self):
+        """Asynchronously stream conversation updates to the consumer, without blocking the event loop.
+
+        Like `stream`, only ends when the stream channel is closed. Prefer iterating a
+        `StreamSession` with `async for`.
         """
         while True:
-            mark, content = self.stream_queue.get()
+            try:
+                mark, content = await self.stream_channel.aget()
+            except EventBusClosed:
+                return
             yield [mark, content]
 
+    def subscribe(self, replay: bool = False) -> Subscription:
+        """Subscribe to conversation updates, independently of other consumers.
+
+        Unlike `stream`, any number of subscribers can read the same updates, each with
+        its own cursor, without slowing down the producer or each other.
+
+        Args:
+            replay (bool): Whether to start from the oldest retained update, instead of the next one.
+        """
+        return self.events.subscribe(replay=replay)
+
     def update(self, delta):
         """Update the conversation signalling a delta."""
-        self.stream_queue.put_nowait(delta)
+        self.stream_channel.put(delta)
+        self.events.publish(delta)
+
+    def append_messages(self, messages: Union[dict, list[dict]]):
+        """Atomically append one or more messages to the conversation.
+
+        Args:
+            messages (Union[dict, list[dict]]): The message, or list of messages, to append.
+        """
+        if not isinstance(messages, list):
+            messages = [messages]
+        with self._lock:
+            self.messages.extend(messages)
+
+    def replace_last_message(self, message: dict):
+        """Atomically replace the last message of the conversation."""
+        with self._lock:
+            self.messages[-1] = message
+            self._messages_generation = next(_message_generations)
+
+    def set_variable(self, name: str, value):
+        """Atomically set a conversation variable."""
+        with self._lock:
+            self.variables[name] = value
+
+    def merge_variables(self, variables: dict, deleted: Iterable[str] = ()):
+        """Atomically merge variables into the conversation ones.
+
+        Variables not in the given dictionary are kept, so concurrent writes to
+        other variables are not lost.
+
+        Args:
+            variables (dict): The variables to set.
+            deleted (Iterable[str]): The names of the variables to delete, if present. Optional.
+        """
+        with self._lock:
+            self.variables.update(variables)
+            for name in deleted:
+                self.variables.pop(name, None)
+
+    def snapshot(self) -> tuple[list[dict], dict]:
+        """Get a consistent copy of the messages and variables, safe to read while other askables write."""
+        with self._lock:
+            return self.messages.copy(), self.variables.copy()
+
+    def snapshot_messages(self) -> tuple[list[dict], tuple[int, int]]:
+        """Get a consistent copy of the messages, with their version.
+
+        The version is the (generation, number of messages). The generation changes when
+        the messages are rewritten rather than appended to, i.e. by `replace_last_message`
+        or by assigning `messages`, so data derived from the messages (e.g. embeddings)
+        can be extended on appends instead of rebuilt. Messages changed in place, not
+        through the conversation, are not tracked.
+        """
+        with self._lock:
+            return self.messages.copy(), (self._messages_generation, len(self.messages))
 
     def to_dict(self):
         """Convert the conversation to a raw dictionary."""
+        messages, variables = self.snapshot()
         return {
-            "messages": self.messages,
-            "variables": self.variables,
+            "messages": as_dicts(messages),
+            "variables": variables,
             "metrics": self.metrics.model_dump(),
         }
 
     def fork(self):
-        """Fork the conversation into a new conversation object."""
-        return Conversation(
-            messages=self.messages.copy(), variables=self.variables.copy()
+        """Fork the conversation into a new conversation object.
+
+        The fork shares the cancellation token and the deadline, as it belongs to the same run.
+        """
+        messages, variables = self.snapshot()
+        fork = Conversation(
+            messages=messages,
+            variables=variables,
+            blob_store=self.blob_store,
+            compact=self.compact,
         )
+        fork.cancellation = self.cancellation
+        fork.deadline = self.deadline
+        return fork
+
+    def resolve_messages(self, messages: list[dict]) -> list[dict]:
+        """Prepare the given messages for the LLM, as plain dictionaries with inline images.
+
+        Compact messages are converted to dictionaries and blob references are resolved
+        into data URLs. To be used at the LLM boundary only.
+        """
+        messages = as_dicts(messages)
+        if self.blob_store is None:
+            return messages
+        return resolve_messages(messages, self.blob_store)
 
     @classmethod
-    def from_dict(cls, data: dict):
+    def from_dict(cls, data: dict, blob_store: BlobStore = None):
         """Create a conversation object from a raw dictionary."""
         return cls(
             messages=data.get("messages", []),
             variables=data.get("variables", {}),
             log=data.get("log", []),
             metrics=ConversationMetrics(**data.get("metrics", {})),
+            blob_store=blob_store,
         )
 
 
 class ConversationReadingStrategy(ABC):
-    """Base class for conversation reading strategies."""
+    """Base class for conversation reading strategies.
+
+    Strategies read the messages from `conversation.snapshot()`, so they are not
+    affected by askables writing to the conversation concurrently.
+    """
 
     @abstractmethod
     def get_messages(self, conversation: Conversation) -> list[dict]:
@@ -114,14 +397,16 @@ class LastNMessagesStrategy(ConversationReadingStrategy):
         self.n = n
 
     def get_messages(self, conversation: Conversation) -> list[dict]:
-        return self.exclude_system_messages(conversation.messages)[-self.n :]
+        messages, _ = conversation.snapshot()
+        return self.exclude_system_messages(messages)[-self.n :]
 
 
 class AllMessagesStrategy(ConversationReadingStrategy):
     """A conversation reading strategy that reads all messages from the conversation."""
 
     def get_messages(self, conversation: Conversation) -> list[dict]:
-        return self.exclude_system_messages(conversation.messages)
+        messages, _ = conversation.snapshot()
+        return self.exclude_system_messages(messages)
 
 
 class TopKLastNMessagesStrategy(ConversationReadingStrategy):
@@ -139,7 +424,8 @@ class TopKLastNMessagesStrategy(ConversationReadingStrategy):
         self.n = n
 
     def get_messages(self, conversation: Conversation) -> list[dict]:
-        list = self.exclude_system_messages(conversation.messages)
+        messages, _ = conversation.snapshot()
+        list = self.exclude_system_messages(messages)
         return list[: self.k] + list[-self.n :]
 
 
@@ -160,8 +446,11 @@ class SummarizeMessagesStrategy(ConversationReadingStrategy):
 
     def get_messages(self, conversation: Conversation) -> list[dict]:
         # Extract the conversation text from the messages
+        messages, _ = conversation.snapshot()
         local_messages = []
-        local_messages += self.exclude_system_messages(conversation.messages)
+        local_messages += conversation.resolve_messages(
+            self.exclude_system_messages(messages)
+        )
         local_messages.append({"role": "user", "content": self.system_prompt})
 
         # Summarize the conversation text
@@ -172,6 +461,114 @@ class SummarizeMessagesStrategy(ConversationReadingStrategy):
         return [{"role": "assistant", "name": "summarizer", "content": summarized_text}]
 
 
+class ImageRetentionMetrics(BaseModel):
+    """A class to store the savings of an image retention strategy, counting each distinct image once."""
+
+    images_replaced: int = 0
+    bytes_saved: int = 0
+    tokens_saved: int = 0
+
+
+class ImageRetentionStrategy(ConversationReadingStrategy):
+    """A conversation reading strategy that stops resending images after a number of user turns.
+
+    Images attached to messages older than `max_turns` user turns are replaced by a
+    compact text placeholder, or by a caption when a captioner is provided. Replaced
+    images are cached by digest, up to `max_images` least recently used, so each image
+    is captioned and counted in the metrics only once. Original messages are never
+    modified.
+    """
+
+    def __init__(
+        self,
+        max_turns: int = 1,
+        placeholder: str = "[image omitted]",
+        captioner: Callable[[str], str] = None,
+        tokens_per_image: int = 765,
+        max_images: int = 1024,
+    ):
+        """
+        Initialize the ImageRetentionStrategy.
+
+        Args:
+            max_turns (int): The number of most recent user turns whose images are kept.
+            placeholder (str): The text to use in place of removed images.
+            captioner (Callable[[str], str]): A function returning a caption given the image URL. Optional.
+            tokens_per_image (int): The estimated prompt tokens of an image, used to report the savings.
+            max_images (int): The maximum number of replaced images whose text is cached.
+        """
+        self.max_turns = max_turns
+        self.placeholder = placeholder
+        self.captioner = captioner
+        self.tokens_per_image = tokens_per_image
+        self.max_images = max_images
+        self.metrics = ImageRetentionMetrics()
+        # Image digest -> replacement text, least recently used first
+        self._replaced = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_messages(self, conversation: Conversation) -> list[dict]:
+        messages, _ = conversation.snapshot()
+        messages = self.exclude_system_messages(messages)
+        result = []
+        turns = 0
+        for message in reversed(messages):
+            if message["role"] == "user":
+                turns += 1
+            if turns > self.max_turns and isinstance(message.get("content"), list):
+                message = self._strip_images(message, conversation.blob_store)
+            result.append(message)
+        result.reverse()
+        return result
+
+    def _strip_images(self, message: dict, blob_store: Optional[BlobStore]) -> dict:
+        content = []
+        for part in message["content"]:
+            if isinstance(part, dict) and part.get("type") == "image_url":
+                url = part["image_url"]["url"]
+                part = {"type": "text", "text": self._describe(url, blob_store)}
+            content.append(part)
+        return {**message, "content": content}
+
+    def _describe(self, url: str, blob_store: Optional[BlobStore]) -> str:
+        ref = parse_ref(url)
+        # Blob references already carry the digest of the image
+        key = ref[1] if ref is not None else hashlib.sha256(url.encode("utf-8")).hexdigest()
+        with self._lock:
+            text = self._replaced.get(key)
+            if text is not None:
+                self._replaced.move_to_end(key)
+                return text
+
+        if self.captioner is None:
+            text = self.placeholder
+        else:
+            text = f"[image: {self.captioner(url)}]"
+            logger.debug("Captioned image: %s", text)
+        bytes_saved = max(self._sent_size(url, ref, blob_store) - len(text), 0)
+        with self._lock:
+            if key not in self._replaced:
+                self.metrics.images_replaced += 1
+                self.metrics.bytes_saved += bytes_saved
+                self.metrics.tokens_saved += self.tokens_per_image
+            self._replaced[key] = text
+            self._replaced.move_to_end(key)
+            while len(self._replaced) > self.max_images:
+                self._replaced.popitem(last=False)
+        return text
+
+    @staticmethod
+    def _sent_size(url: str, ref: Optional[tuple[str, str]], blob_store: Optional[BlobStore]) -> int:
+        if ref is None or blob_store is None:
+            return len(url)
+        # References are sent to the LLM as data URLs
+        media_type, digest = ref
+        with blob_store.open(digest) as data:
+            if data is None:
+                return len(url)
+            return len(f"data:{media_type};base64,") + 4 * ((len(data) + 2) // 3)
+
+
 class PipelineConversationReadingStrategy(ConversationReadingStrategy):
     """A conversation reading strategy that reads the conversation messages through a pipeline of strategies."""
 
@@ -185,9 +582,11 @@ class PipelineConversationReadingStrategy(ConversationReadingStrategy):
         self.strategies = strategies
 
     def get_messages(self, conversation: Conversation) -> list[dict]:
-        messages = conversation.messages
+        messages, _ = conversation.snapshot()
         for strategy in self.strategies:
-            messages = strategy.get_messages(Conversation(messages=messages))
+            messages = strategy.get_messages(
+                Conversation(messages=messages, blob_store=conversation.blob_store)
+            )
         return messages
 
 
@@ -203,17 +602,14 @@ class AppendMessagesUpdateStrategy(ConversationUpdateStrategy):
     """An update strategy that appends messages to the conversation."""
 
     def update(self, conversation: Conversation, delta: any):
-        if isinstance(delta, list):
-            conversation.messages += delta
-        else:
-            conversation.messages += [delta]
+        conversation.append_messages(delta)
 
 
 class ReplaceLastMessageUpdateStrategy(ConversationUpdateStrategy):
     """An update strategy that replaces the last message in the conversation."""
 
     def update(self, conversation: Conversation, delta: any):
-        conversation.messages[-1] = delta
+        conversation.replace_last_message(delta)
 
 
 class NoopUpdateStrategy(ConversationUpdateStrategy):
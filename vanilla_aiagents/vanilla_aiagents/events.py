@@ -0,0 +1,569 @@
+import asyncio
+import queue
+import threading
+import time
+import weakref
+from collections import deque
+from typing import Any, Callable, Literal, Optional
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class EventBusClosed(Exception):
+    """Raised when reading from a closed bus, subscription or channel with no events left."""
+
+    pass
+
+
+class EventGap(Exception):
+    """Raised when a strict subscription needs events already evicted from the bus, e.g. when resuming too late."""
+
+    def __init__(self, cursor: int, oldest: int):
+        super().__init__(f"Events {cursor} to {oldest - 1} are no longer retained")
+        self.cursor = cursor
+        self.oldest = oldest
+
+
+# Marks delimiting the stream lifecycle, which must never be dropped or merged
+LIFECYCLE_MARKS = frozenset(["start", "end", "response", "error", "result"])
+
+
+class EventBus:
+    """A publish/subscribe bus over a shared ring buffer of conversation events.
+
+    Every published event gets a monotonically increasing sequence number. Each
+    subscriber reads the buffer with its own cursor, so publishing never blocks and a
+    slow subscriber never delays the others: when it falls behind by more than the
+    buffer capacity, it skips ahead to the oldest retained event and the skipped
+    events are counted as dropped. Strict subscriptions raise EventGap instead, and a
+    ReplayChannel publishing to the bus keeps its open subscriptions from lagging that far.
+    """
+
+    def __init__(self, capacity: int = 1024):
+        """Initialize the EventBus.
+
+        Args:
+            capacity (int): The number of most recent events retained for subscribers.
+        """
+        self.capacity = capacity
+        # Allocated on first publish, so idle conversations do not pay for it
+        self._buffer = None
+        self._next = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        # Futures of the async subscribers waiting for an event, with their loops
+        self._waiters = []
+        self._subscriptions = weakref.WeakSet()
+        # Producers waiting for the slowest subscription to catch up
+        self._blocked = 0
+
+    @property
+    def next_sequence(self) -> int:
+        """The sequence number the next published event will get."""
+        return self._next
+
+    @property
+    def oldest_sequence(self) -> int:
+        """The sequence number of the oldest event still retained."""
+        return max(0, self._next - self.capacity)
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def lag(self) -> int:
+        """Get how many events the slowest open subscription is behind."""
+        with self._cond:
+            return self._lag()
+
+    def _lag(self) -> int:
+        # Called with the lock held
+        return max(
+            (self._next - subscription.cursor for subscription in self._subscriptions if not subscription._closed),
+            default=0,
+        )
+
+    def _wait_for_room(self, max_lag: int, cancelled: Callable[[], bool]) -> float:
+        # Called with the lock held, returns how long the producer was blocked
+        if self._lag() < max_lag:
+            return 0.0
+        start = time.monotonic()
+        self._blocked += 1
+        try:
+            self._cond.wait_for(lambda: self._lag() < max_lag or cancelled())
+        finally:
+            self._blocked -= 1
+        return time.monotonic() - start
+
+    def publish(self, event: Any, max_lag: Optional[int] = None) -> int:
+        """Publish an event to all the subscribers, returning its sequence number.
+
+        Args:
+            event (Any): The event to publish.
+            max_lag (int): Wait until the slowest open subscription is less than this number of events behind. Optional, never waits when not provided.
+        """
+        with self._cond:
+            if max_lag is not None:
+                self._wait_for_room(max_lag, lambda: self._closed)
+            if self._buffer is None:
+                self._buffer = [None] * self.capacity
+            sequence = self._next
+            self._buffer[sequence % self.capacity] = event
+            self._next += 1
+            self._cond.notify_all()
+            _wake_waiters(self._waiters)
+        return sequence
+
+    def subscribe(
+        self, replay: bool = False, after: Optional[int] = None, strict: bool = False
+    ) -> "Subscription":
+        """Subscribe to the events.
+
+        Args:
+            replay (bool): Whether to start from the oldest retained event, instead of the next published one.
+            after (int): The sequence number of the last event already received, to resume right after it. Optional, takes precedence over replay.
+            strict (bool): Whether to raise EventGap when events to read are no longer retained, instead of skipping them.
+
+        Raises:
+            EventGap: if the subscription is strict and the events after `after` are no longer retained.
+        """
+        with self._cond:
+            if after is not None:
+                cursor = after + 1
+            else:
+                cursor = self.oldest_sequence if replay else self._next
+            if strict and cursor < self.oldest_sequence:
+                raise EventGap(cursor, self.oldest_sequence)
+            subscription = Subscription(self, cursor, strict)
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def close(self):
+        """Close the bus. Subscribers receive the remaining events, then stop iterating."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+            _wake_waiters(self._waiters)
+
+
+class Subscription:
+    """A subscriber cursor over an EventBus, iterating events in publishing order."""
+
+    def __init__(self, bus: EventBus, cursor: int, strict: bool = False):
+        """Initialize the Subscription.
+
+        Args:
+            bus (EventBus): The bus to read from.
+            cursor (int): The sequence number of the next event to read.
+            strict (bool): Whether to raise EventGap when lapped by the producer, instead of skipping the evicted events.
+        """
+        self.bus = bus
+        self.cursor = cursor
+        self.strict = strict
+        self.dropped = 0
+        self._closed = False
+
+    def get(self, timeout: Optional[float] = None) -> tuple[int, Any]:
+        """Get the next event, waiting for it to be published.
+
+        Args:
+            timeout (float): The maximum time to wait, in seconds. Optional, waits indefinitely when not provided.
+
+        Returns:
+            tuple[int, Any]: The sequence number and the event.
+
+        Raises:
+            queue.Empty: if no event is published before the timeout.
+            EventBusClosed: if the bus or the subscription is closed and all the events were read.
+            EventGap: if the subscription is strict and the next event is no longer retained.
+        """
+        bus = self.bus
+        with bus._cond:
+            available = bus._cond.wait_for(
+                lambda: self.cursor < bus._next or bus._closed or self._closed,
+                timeout,
+            )
+            if self._closed or (self.cursor >= bus._next and bus._closed):
+                raise EventBusClosed()
+            if not available:
+                raise queue.Empty()
+            return self._read()
+
+    async def aget(self, timeout: Optional[float] = None) -> tuple[int, Any]:
+        """Get the next event without blocking the event loop, waiting for it to be published.
+
+        Args:
+            timeout (float): The maximum time to wait, in seconds. Optional, waits indefinitely when not provided.
+
+        Returns:
+            tuple[int, Any]: The sequence number and the event.
+
+        Raises:
+            queue.Empty: if no event is published before the timeout.
+            EventBusClosed: if the bus or the subscription is closed and all the events were read.
+            EventGap: if the subscription is strict and the next event is no longer retained.
+        """
+        bus = self.bus
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout if timeout is not None else None
+        while True:
+            with bus._cond:
+                if self._closed or (self.cursor >= bus._next and bus._closed):
+                    raise EventBusClosed()
+                if self.cursor < bus._next:
+                    return self._read()
+                waiter = loop.create_future()
+                bus._waiters.append((loop, waiter))
+
+            await _wait(bus._cond, bus._waiters, loop, waiter, deadline)
+
+    def _read(self) -> tuple[int, Any]:
+        # Called with the bus lock held, when an event is available
+        bus = self.bus
+        oldest = bus.oldest_sequence
+        if self.cursor < oldest:
+            if self.strict:
+                raise EventGap(self.cursor, oldest)
+            # Lapped by the producer, skip to the oldest retained event
+            self.dropped += oldest - self.cursor
+            logger.debug("Subscriber lagging, dropped %d events", oldest - self.cursor)
+            self.cursor = oldest
+
+        sequence = self.cursor
+        event = bus._buffer[sequence % bus.capacity]
+        self.cursor += 1
+        if bus._blocked:
+            # Room for a producer waiting on this subscription
+            bus._cond.notify_all()
+        return sequence, event
+
+    def close(self):
+        """Stop the subscription, waking it up if waiting."""
+        with self.bus._cond:
+            self._closed = True
+            self.bus._subscriptions.discard(self)
+            self.bus._cond.notify_all()
+            _wake_waiters(self.bus._waiters)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return self.get()[1]
+        except EventBusClosed:
+            raise StopIteration()
+
+
+class StreamChannel:
+    """A bounded, thread-safe channel carrying conversation updates to a single consumer.
+
+    When the channel is full, the producer is blocked until the consumer catches up
+    ("block" policy), or consecutive deltas are merged into a single larger delta
+    ("coalesce" policy): text deltas are concatenated, and so are the argument
+    fragments of a same tool call. Lifecycle events are never dropped nor merged: with
+    the "coalesce" policy they are always enqueued, since there are only a few of them
+    per run, while any other update which cannot be merged (e.g. the first delta of a
+    tool call) blocks the producer, so memory stays bounded.
+
+    The channel also offers the `put_nowait`, `get_nowait`, `qsize` and `empty` methods
+    of `queue.SimpleQueue`, which it replaces as the conversation stream queue.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 0,
+        policy: Literal["block", "coalesce"] = "block",
+        transform: Optional[Callable[[list], Optional[list]]] = None,
+    ):
+        """Initialize the StreamChannel.
+
+        Args:
+            maxsize (int): The maximum number of queued updates. Optional, unbounded when 0.
+            policy (str): The policy to apply when the channel is full, either "block" or "coalesce".
+            transform (Callable): A function applied to each update before queueing it, returning the update to queue or None to drop it. Optional.
+        """
+        if policy not in ("block", "coalesce"):
+            raise ValueError(f"Invalid stream policy: {policy}")
+        self.maxsize = maxsize
+        self.policy = policy
+        self.transform = transform
+        self.dropped = 0
+        self.coalesced = 0
+        self.blocked_seconds = 0.0
+        self._items = deque()
+        self._closed = False
+        self._cond = threading.Condition()
+        # Futures of the async consumers waiting for an update, with their loops
+        self._waiters = []
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def put(self, event: list):
+        """Put an update in the channel, applying the channel policy when full.
+
+        Updates put after the channel is closed, or dropped by the transform, are discarded.
+        """
+        if self.transform is not None:
+            event = self.transform(event)
+            if event is None:
+                with self._cond:
+                    self.dropped += 1
+                return
+        with self._cond:
+            coalesce = self.policy == "coalesce"
+            if self._is_full() and coalesce and self._merge(event):
+                self.coalesced += 1
+                return
+            if self._is_full() and not (coalesce and event[0] in LIFECYCLE_MARKS):
+                start = time.monotonic()
+                self._cond.wait_for(lambda: not self._is_full() or self._closed)
+                self.blocked_seconds += time.monotonic() - start
+            if self._closed:
+                return
+            self._items.append(event)
+            self._cond.notify_all()
+            _wake_waiters(self._waiters)
+
+    def put_nowait(self, event: list):
+        """Same as `put`, which only waits on a full bounded channel with the "block" policy."""
+        self.put(event)
+
+    def _is_full(self) -> bool:
+        return self.maxsize > 0 and len(self._items) >= self.maxsize
+
+    def _merge(self, event: list) -> bool:
+        if not self._items:
+            return False
+        merged = _merge_deltas(self._items[-1], event)
+        if merged is None:
+            return False
+        self._items[-1] = merged
+        return True
+
+    def get(self, timeout: Optional[float] = None) -> list:
+        """Get the next update, waiting for it to be available.
+
+        Args:
+            timeout (float): The maximum time to wait, in seconds. Optional, waits indefinitely when not provided.
+
+        Raises:
+            queue.Empty: if no update is available before the timeout.
+            EventBusClosed: if the channel is closed and all the updates were read.
+        """
+        with self._cond:
+            available = self._cond.wait_for(lambda: self._items or self._closed, timeout)
+            if self._items:
+                event = self._items.popleft()
+                self._cond.notify_all()
+                return event
+            if self._closed:
+                raise EventBusClosed()
+            if not available:
+                raise queue.Empty()
+
+    def get_nowait(self) -> list:
+        """Get the next update if available, or raise queue.Empty."""
+        return self.get(timeout=0)
+
+    def qsize(self) -> int:
+        return len(self)
+
+    def empty(self) -> bool:
+        return len(self) == 0
+
+    async def aget(self, timeout: Optional[float] = None) -> list:
+        """Get the next update without blocking the event loop, waiting for it to be available.
+
+        Args:
+            timeout (float): The maximum time to wait, in seconds. Optional, waits indefinitely when not provided.
+
+        Raises:
+            queue.Empty: if no update is available before the timeout.
+            EventBusClosed: if the channel is closed and all the updates were read.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout if timeout is not None else None
+        while True:
+            with self._cond:
+                if self._items:
+                    event = self._items.popleft()
+                    self._cond.notify_all()
+                    return event
+                if self._closed:
+                    raise EventBusClosed()
+                waiter = loop.create_future()
+                self._waiters.append((loop, waiter))
+
+            await _wait(self._cond, self._waiters, loop, waiter, deadline)
+
+    def close(self):
+        """Close the channel, discarding further updates and waking up blocked producers."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+            _wake_waiters(self._waiters)
+
+
+class ReplayChannel(StreamChannel):
+    """A stream channel publishing updates to an EventBus, so any number of subscribers can read and replay them.
+
+    The channel is full when its slowest open subscription is `maxsize` updates behind
+    (or the bus capacity, when lower or unbounded), and then applies its policy like a
+    StreamChannel: the producer is blocked, or the text delta is merged into the last
+    one when no subscription read it yet. Open subscriptions are never lapped, so they
+    never miss an update, lifecycle marks included.
+
+    Updates are read through subscriptions to the bus, not with `get`.
+    """
+
+    def __init__(
+        self,
+        bus: EventBus,
+        maxsize: int = 0,
+        policy: Literal["block", "coalesce"] = "block",
+        transform: Optional[Callable[[list], Optional[list]]] = None,
+    ):
+        """Initialize the ReplayChannel.
+
+        Args:
+            bus (EventBus): The bus to publish the updates to.
+            maxsize (int): The maximum number of updates the slowest subscription can be behind. Optional, the bus capacity when 0.
+            policy (str): The policy to apply when the channel is full, either "block" or "coalesce".
+            transform (Callable): A function applied to each update before publishing it, returning the update to publish or None to drop it. Optional.
+        """
+        super().__init__(maxsize=maxsize, policy=policy, transform=transform)
+        self.bus = bus
+        # Shares the bus lock, so closing the channel wakes up a producer blocked on the bus
+        self._cond = bus._cond
+
+    def __len__(self) -> int:
+        return self.bus.lag()
+
+    def put(self, event: list):
+        """Publish an update to the bus, applying the channel policy when full.
+
+        Updates put after the channel is closed, or dropped by the transform, are discarded.
+        """
+        if self.transform is not None:
+            event = self.transform(event)
+            if event is None:
+                with self._cond:
+                    self.dropped += 1
+                return
+        bus = self.bus
+        with self._cond:
+            if self._closed:
+                return
+            limit = min(self.maxsize or bus.capacity, bus.capacity)
+            coalesce = self.policy == "coalesce"
+            if bus._lag() >= limit:
+                if coalesce and self._merge_unread(event):
+                    self.coalesced += 1
+                    return
+                if coalesce and event[0] in LIFECYCLE_MARKS:
+                    # Never merged, only blocked when the bus would evict unread updates
+                    limit = bus.capacity
+                self.blocked_seconds += bus._wait_for_room(limit, lambda: self._closed)
+            if self._closed:
+                return
+            bus.publish(event)
+
+    def _merge_unread(self, event: list) -> bool:
+        bus = self.bus
+        last = bus._next - 1
+        if last < 0 or any(
+            subscription.cursor > last
+            for subscription in bus._subscriptions
+            if not subscription._closed
+        ):
+            return False
+        merged = _merge_deltas(bus._buffer[last % bus.capacity], event)
+        if merged is None:
+            return False
+        bus._buffer[last % bus.capacity] = merged
+        return True
+
+    def get(self, timeout: Optional[float] = None) -> list:
+        raise NotImplementedError("Read the updates with a subscription to the bus")
+
+    async def aget(self, timeout: Optional[float] = None) -> list:
+        raise NotImplementedError("Read the updates with a subscription to the bus")
+
+
+async def _wait(lock, waiters: list, loop, waiter: asyncio.Future, deadline: Optional[float]):
+    # Wait for an async waiter to be woken up, until the deadline on the loop clock
+    remaining = deadline - loop.time() if deadline is not None else None
+    try:
+        await asyncio.wait_for(waiter, remaining)
+    except asyncio.TimeoutError:
+        raise queue.Empty()
+    finally:
+        with lock:
+            if (loop, waiter) in waiters:
+                waiters.remove((loop, waiter))
+
+
+def _wake_waiters(waiters: list):
+    # Called with the lock held, possibly from a producer thread
+    for loop, waiter in waiters:
+        try:
+            loop.call_soon_threadsafe(_set_done, waiter)
+        except RuntimeError:
+            # The consumer loop was closed in the meantime
+            pass
+    waiters.clear()
+
+
+def _set_done(waiter: asyncio.Future):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+def _merge_deltas(tail, event) -> Optional[list]:
+    if _is_text_delta(tail) and _is_text_delta(event):
+        return [
+            "delta",
+            {**tail[1], "content": (tail[1].get("content") or "") + (event[1].get("content") or "")},
+        ]
+    tail_call, call = _tool_call_delta(tail), _tool_call_delta(event)
+    # Only argument fragments, without the ID and name of a new call, are appended
+    if (
+        tail_call is None
+        or call is None
+        or call.get("index") != tail_call.get("index")
+        or call.get("id")
+        or (call.get("function") or {}).get("name")
+    ):
+        return None
+    function = tail_call.get("function") or {}
+    arguments = (function.get("arguments") or "") + ((call.get("function") or {}).get("arguments") or "")
+    return [
+        "delta",
+        {**tail[1], "tool_calls": [{**tail_call, "function": {**function, "arguments": arguments}}]},
+    ]
+
+
+def _tool_call_delta(event) -> Optional[dict]:
+    # The delta of a single tool call, with no content, as streamed by the LLM
+    if event[0] != "delta" or not isinstance(event[1], dict):
+        return None
+    delta = event[1]
+    tool_calls = delta.get("tool_calls")
+    if delta.get("content") or delta.get("function_call") or not tool_calls or len(tool_calls) != 1:
+        return None
+    return tool_calls[0]
+
+
+def _is_text_delta(event) -> bool:
+    if event[0] != "delta" or not isinstance(event[1], dict):
+        return False
+    delta = event[1]
+    return not delta.get("tool_calls") and not delta.get("function_call")
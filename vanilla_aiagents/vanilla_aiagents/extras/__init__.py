@@ -42,7 +42,8 @@ class CompressSystemPromptStrategy(ConversationReadingStrategy):
 
     def get_messages(self, conversation: Conversation) -> list[dict]:
         # Get system message
-        system_message = conversation.messages[0]
+        messages, _ = conversation.snapshot()
+        system_message = messages[0]
         if system_message["role"] != "system":
             raise ValueError("First message in conversation should be system message")
 
@@ -50,6 +51,4 @@ class CompressSystemPromptStrategy(ConversationReadingStrategy):
         compressed_text = self.compressor.compress(system_message["content"])
 
         # Return the original conversation with the compressed system message
-        return [{"role": "system", "content": compressed_text}] + conversation.messages[
-            1:
-        ]
+        return [{"role": "system", "content": compressed_text}] + messages[1:]
@@ -1,10 +1,12 @@
 from collections import defaultdict
-from typing import Generator, NamedTuple, Optional
+from typing import Callable, Generator, NamedTuple, Optional
 from openai import NOT_GIVEN, AzureOpenAI, Stream
-from openai.types.chat import ChatCompletionChunk
+from openai.types.chat import ChatCompletionChunk, ChatCompletionMessage
 from abc import ABC, abstractmethod
 from azure.identity import DefaultAzureCredential, get_bearer_token_provider
 
+from .cancellation import CancellationToken, Deadline
+
 import json
 import logging
 
@@ -17,6 +19,31 @@ class LLMConstraints(NamedTuple):
     temperature: Optional[float] = None
 
 
+class DeferredResponse(Exception):
+    """Raised by LLMs answering asynchronously, e.g. in batch mode, when the response is not available yet.
+
+    The request is queued: ask again with the same messages once its response is available.
+    """
+
+    def __init__(self, request_id: str):
+        super().__init__(f"Response deferred: {request_id}")
+        self.request_id = request_id
+
+
+def ends_turn(function: Callable) -> Callable:
+    """Mark a tool function as ending the turn: once it is called, the tool loop stops without another completion.
+
+    The response is the content of the message calling the tool, or the tool result when empty.
+    """
+    function._ends_turn = True
+    return function
+
+
+def is_turn_ending(function: Callable) -> bool:
+    """Whether the tool function was marked with `ends_turn`."""
+    return getattr(function, "_ends_turn", False)
+
+
 class LLM(ABC):
     """Abstract class for the Language Model clients."""
 
@@ -38,6 +65,7 @@ class LLM(ABC):
         tools_function: dict[str, callable] = None,
         temperature: float = 0.7,
         response_format=None,
+        timeout: Optional[float] = None,
     ) -> tuple[dict, dict]:
         pass
 
@@ -48,8 +76,32 @@ class LLM(ABC):
         tools: list = None,
         tools_function: dict[str, callable] = None,
         temperature: float = 0.7,
+        cancellation: Optional[CancellationToken] = None,
+        timeout: Optional[float] = None,
     ) -> Generator[tuple[str, any], None, tuple[dict, any]]:
         pass
+
+    def complete(
+        self,
+        messages: list,
+        tools: list = None,
+        temperature: float = 0.7,
+        timeout: Optional[float] = None,
+    ) -> tuple[dict, dict]:
+        """Get a single completion of the messages, returning the tool calls instead of running them.
+
+        Used by the callers running the tool loop themselves, e.g. the batch services.
+
+        Args:
+            messages (list): The list of messages to send to the LLM.
+            tools (list): The list of tools to use in the LLM.
+            temperature (float): The temperature to use in the LLM.
+            timeout (float): The time budget of the request, in seconds. Optional.
+
+        Returns:
+            tuple: The response message, with its tool calls if any, and the usage metrics.
+        """
+        raise NotImplementedError(f"{type(self).__name__} does not support single completions")
     
     def _check_system_messages(self, messages: list) -> list:
         """Ensures that system messages are not sent to the LLM when the constraints are set.
@@ -92,6 +144,7 @@ class ErrorTestingLLM(LLM):
         tools_function: dict[str, callable] = None,
         temperature: float = 0.7,
         response_format=None,
+        timeout: Optional[float] = None,
     ):
         raise Exception("Fake error")
 
@@ -101,6 +154,8 @@ class ErrorTestingLLM(LLM):
         tools: list = None,
         tools_function: dict[str, callable] = None,
         temperature: float = 0.7,
+        cancellation: Optional[CancellationToken] = None,
+        timeout: Optional[float] = None,
     ):
         yield ["start", ""]
         yield ["error", "Fake error"]
@@ -154,6 +209,7 @@ class AzureOpenAILLM(LLM):
         tools_function: dict[str, callable] = None,
         temperature: float = 0.7,
         response_format=NOT_GIVEN,
+        timeout: Optional[float] = None,
     ):
         """Ask the LLM to generate a completion given the messages.
 
@@ -163,6 +219,7 @@ class AzureOpenAILLM(LLM):
             tools_function (dict): The dictionary of tool functions to use in the LLM.
             temperature (float): The temperature to use in the LLM.
             response_format: The response format to use in the LLM (Structured Output)
+            timeout (float): The time budget of the whole call, including the tool calls round trips, in seconds. Optional.
 
         Returns:
             tuple: The response message and the usage metrics.
@@ -171,6 +228,7 @@ class AzureOpenAILLM(LLM):
         
         temperature = self.constraints.temperature if self.constraints.temperature else temperature
         messages = self._check_system_messages(messages)
+        deadline = Deadline(timeout) if timeout is not None else None
 
         if not self.constraints.structured_output or response_format is NOT_GIVEN:
             response = self.client.chat.completions.create(
@@ -179,6 +237,7 @@ class AzureOpenAILLM(LLM):
                 tools=tools if tools and len(tools) > 0 else NOT_GIVEN,
                 temperature=temperature,
                 tool_choice="auto" if tools else NOT_GIVEN,
+                timeout=_request_timeout(deadline),
             )
         else:
             response = self.client.beta.chat.completions.parse(
@@ -188,6 +247,7 @@ class AzureOpenAILLM(LLM):
                 temperature=temperature,
                 tool_choice="auto" if tools else NOT_GIVEN,
                 response_format=response_format,
+                timeout=_request_timeout(deadline),
             )
 
         response_message = response.choices[0].message
@@ -198,14 +258,16 @@ class AzureOpenAILLM(LLM):
         while response_message.tool_calls:
             logger.debug("Tool calls detected: %s", response_message.tool_calls)
             messages.append(response.choices[0].message)
+            end_result = None
             for tool_call in response_message.tool_calls:
                 function_args = json.loads(tool_call.function.arguments)
                 logger.debug("Function arguments: %s", function_args)
 
-                function_result = tools_function[tool_call.function.name](
-                    **function_args
-                )
+                function = tools_function[tool_call.function.name]
+                function_result = function(**function_args)
                 logger.debug("Function result: %s", function_result)
+                if is_turn_ending(function):
+                    end_result = function_result
 
                 messages.append(
                     {
@@ -216,6 +278,14 @@ class AzureOpenAILLM(LLM):
                     }
                 )
 
+            if end_result is not None:
+                # E.g. a handoff, the next agent answers instead of asking the model again
+                logger.debug("Turn ended by tool call: %s", end_result)
+                response_message = ChatCompletionMessage(
+                    role="assistant", content=response_message.content or end_result
+                )
+                break
+
             # Second API call: Get the next response from the model given the func call result
             response = self.client.chat.completions.create(
                 messages=messages,
@@ -223,6 +293,7 @@ class AzureOpenAILLM(LLM):
                 tools=tools,
                 temperature=temperature,
                 tool_choice="auto" if tools else None,
+                timeout=_request_timeout(deadline),
             )
             response_message = response.choices[0].message
 
@@ -236,24 +307,60 @@ class AzureOpenAILLM(LLM):
             "total_tokens": response.usage.total_tokens,
         }
 
+    def complete(
+        self,
+        messages: list,
+        tools: list = None,
+        temperature: float = 0.7,
+        timeout: Optional[float] = None,
+    ):
+        temperature = self.constraints.temperature if self.constraints.temperature else temperature
+        messages = self._check_system_messages(messages)
+        response = self.client.chat.completions.create(
+            messages=messages,
+            model=self.config["azure_deployment"],
+            tools=tools if tools and len(tools) > 0 else NOT_GIVEN,
+            temperature=temperature,
+            tool_choice="auto" if tools else NOT_GIVEN,
+            timeout=timeout if timeout is not None else NOT_GIVEN,
+        )
+        response_message = response.choices[0].message
+        logger.debug("Response message: %s", response_message)
+
+        return response_message, {
+            "completion_tokens": response.usage.completion_tokens,
+            "prompt_tokens": response.usage.prompt_tokens,
+            "total_tokens": response.usage.total_tokens,
+        }
+
     def ask_stream(
         self,
         messages: list,
         tools: list = None,
         tools_function: dict[str, callable] = None,
         temperature: float = 0.7,
+        cancellation: Optional[CancellationToken] = None,
+        timeout: Optional[float] = None,
     ):
         """Ask the LLM to generate a completion given the messages and stream the updates.
 
+        When the cancellation is requested or the timeout expires, the completion stream
+        is closed, pending tool calls are skipped and the generator ends without a
+        "response" update, with a "usage" update carrying the tokens used so far.
+
         Args:
             messages (list): The list of messages to send to the LLM.
             tools (list): The list of tools to use in the LLM.
             tools_function (dict): The dictionary of tool functions to use in the LLM.
             temperature (float): The temperature to use in the LLM.
+            cancellation (CancellationToken): The token to stop the generation early. Optional.
+            timeout (float): The time budget of the whole generation, including the tool calls round trips, in seconds. Optional.
 
         Yields:
             tuple: The mark and content of the conversation update.
         """
+        cancellation = cancellation or CancellationToken()
+        deadline = Deadline(timeout) if timeout is not None else None
         # Accumulate messages and usage
         response_message = None
         usage = {"completion_tokens": 0, "prompt_tokens": 0, "total_tokens": 0}
@@ -262,6 +369,13 @@ class AzureOpenAILLM(LLM):
 
         yield ["start", ""]
         while True:
+            if _interrupted(cancellation, deadline):
+                # Do not start another completion after the tool calls
+                logger.debug("Generation interrupted: %s", cancellation.reason or "timeout")
+                yield ["usage", usage]
+                yield ["end", ""]
+                return [None, usage]
+
             response_message = {
                 "content": "",
                 "role": "assistant",
@@ -285,23 +399,40 @@ class AzureOpenAILLM(LLM):
                     tool_choice="auto" if tools else None,
                     stream=True,
                     stream_options={"include_usage": True},
+                    timeout=_request_timeout(deadline),
                 )
             )
 
-            # Yield the intermediate updates
-            for chunk in completion:
-                if len(chunk.choices) > 0:
-                    delta = json.loads(chunk.choices[0].delta.model_dump_json())
-                    yield ["delta", delta]
-                    delta.pop("role", None)
-                    delta.pop("name", None)
-                    # Update the accumulated response message
-                    merge_chunk(response_message, delta)
-                # Also accumulate usage, if any
-                if chunk.usage:
-                    usage["completion_tokens"] += chunk.usage.completion_tokens
-                    usage["prompt_tokens"] += chunk.usage.prompt_tokens
-                    usage["total_tokens"] += chunk.usage.total_tokens
+            # Closing the stream from the cancelling thread also interrupts a stalled read
+            unregister = cancellation.on_cancel(completion.close)
+            try:
+                # Yield the intermediate updates
+                for chunk in completion:
+                    if _interrupted(cancellation, deadline):
+                        break
+                    if len(chunk.choices) > 0:
+                        delta = json.loads(chunk.choices[0].delta.model_dump_json())
+                        yield ["delta", delta]
+                        # Update the accumulated response message
+                        merge_chunk(response_message, delta)
+                    # Also accumulate usage, if any
+                    if chunk.usage:
+                        usage["completion_tokens"] += chunk.usage.completion_tokens
+                        usage["prompt_tokens"] += chunk.usage.prompt_tokens
+                        usage["total_tokens"] += chunk.usage.total_tokens
+            except Exception:
+                # Reading a stream closed by the cancellation, or timing out, fails
+                if not _interrupted(cancellation, deadline):
+                    raise
+            finally:
+                unregister()
+                completion.close()
+
+            if _interrupted(cancellation, deadline):
+                logger.debug("Generation interrupted: %s", cancellation.reason or "timeout")
+                yield ["usage", usage]
+                yield ["end", ""]
+                return [None, usage]
 
             logger.debug("Response message: %s", response_message)
 
@@ -318,14 +449,23 @@ class AzureOpenAILLM(LLM):
 
             logger.debug("Tool calls detected: %s", response_message["tool_calls"])
             messages.append(response_message)
+            end_result = None
             for tool_call in response_message["tool_calls"]:
+                if _interrupted(cancellation, deadline):
+                    # Skip the pending tool calls
+                    logger.debug("Generation interrupted: %s", cancellation.reason or "timeout")
+                    yield ["usage", usage]
+                    yield ["end", ""]
+                    return [None, usage]
+
                 function_args = json.loads(tool_call["function"]["arguments"])
                 logger.debug("Function arguments: %s", function_args)
 
-                function_result = tools_function[tool_call["function"]["name"]](
-                    **function_args
-                )
+                function = tools_function[tool_call["function"]["name"]]
+                function_result = function(**function_args)
                 logger.debug("Function result: %s", function_result)
+                if is_turn_ending(function):
+                    end_result = function_result
                 yield [
                     "function_result",
                     {"name": tool_call["function"]["name"], "result": function_result},
@@ -339,6 +479,11 @@ class AzureOpenAILLM(LLM):
                         "content": function_result,
                     }
                 )
+            if end_result is not None:
+                # E.g. a handoff, the next agent answers instead of asking the model again
+                logger.debug("Turn ended by tool call: %s", end_result)
+                response_message["content"] = response_message["content"] or end_result
+                break
             # NOTE: The loop will continue until there are no more tool calls
 
         # Strip the tool calls from the final response message
@@ -355,6 +500,15 @@ class AzureOpenAILLM(LLM):
         return [response_message, usage]
 
 
+def _request_timeout(deadline: Optional[Deadline]):
+    # Each request of a call gets the time left, so the tool calls round trips share the budget
+    return deadline.remaining() if deadline is not None else NOT_GIVEN
+
+
+def _interrupted(cancellation: CancellationToken, deadline: Optional[Deadline]) -> bool:
+    return cancellation.cancelled or (deadline is not None and deadline.expired)
+
+
 def merge_fields(target, source):
     for key, value in source.items():
         if isinstance(value, str):
@@ -364,10 +518,12 @@ def merge_fields(target, source):
 
 
 def merge_chunk(source: dict, delta: dict) -> None:
-    delta.pop("role", None)
-    merge_fields(source, delta)
+    # The delta may still be queued for the stream consumers, so it is never modified
+    merge_fields(
+        source, {k: v for k, v in delta.items() if k not in ("role", "name")}
+    )
 
     tool_calls = delta.get("tool_calls")
     if tool_calls and len(tool_calls) > 0:
-        index = tool_calls[0].pop("index")
+        index = tool_calls[0]["index"]
         merge_fields(source["tool_calls"][index], tool_calls[0])
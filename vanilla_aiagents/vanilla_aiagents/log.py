@@ -0,0 +1,237 @@
+import json
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import Iterable, Optional, Union
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class LogEvent:
+    """A structured conversation log event.
+
+    Legacy tuple entries like ("info", "team/choice", team_id, agent_id, reason) map to
+    level, kind and source, with any remaining value kept in payload.
+    """
+
+    __slots__ = ("level", "kind", "source", "timestamp", "payload")
+
+    level: str
+    kind: str
+    source: Optional[str]
+    timestamp: float
+    payload: tuple
+
+    def __init__(
+        self,
+        level: str,
+        kind: str,
+        source: str = None,
+        payload: tuple = (),
+        timestamp: float = None,
+    ):
+        """Initialize the LogEvent.
+
+        Args:
+            level (str): The level of the event, e.g. "info" or "error".
+            kind (str): The kind of the event, e.g. "agent/stop".
+            source (str): The ID of the askable which generated the event. Optional.
+            payload (tuple): Additional event values. Exceptions are stored as strings, so they do not keep tracebacks alive.
+            timestamp (float): The UNIX timestamp of the event. Optional, defaults to now.
+        """
+        self.level = level
+        self.kind = kind
+        self.source = source
+        self.payload = tuple(_sanitize(value) for value in payload)
+        self.timestamp = timestamp if timestamp is not None else time.time()
+
+    @classmethod
+    def from_entry(cls, entry: Union["LogEvent", dict, Iterable]) -> "LogEvent":
+        """Create an event from a legacy tuple, a dictionary or another event."""
+        if isinstance(entry, LogEvent):
+            return entry
+        if isinstance(entry, dict):
+            return cls(
+                entry["level"],
+                entry["kind"],
+                entry.get("source"),
+                tuple(entry.get("payload", ())),
+                entry.get("timestamp"),
+            )
+        level, kind, *rest = entry
+        return cls(level, kind, rest[0] if rest else None, tuple(rest[1:]))
+
+    def as_tuple(self) -> tuple:
+        """Convert the event to the legacy tuple format."""
+        if self.source is None and not self.payload:
+            return (self.level, self.kind)
+        return (self.level, self.kind, self.source, *self.payload)
+
+    def to_dict(self) -> dict:
+        return {
+            "level": self.level,
+            "kind": self.kind,
+            "source": self.source,
+            "timestamp": self.timestamp,
+            "payload": list(self.payload),
+        }
+
+    def __eq__(self, other):
+        if isinstance(other, LogEvent):
+            return self.as_tuple() == other.as_tuple()
+        if isinstance(other, (tuple, list)):
+            return self.as_tuple() == tuple(other)
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"LogEvent{self.as_tuple()!r}"
+
+
+def _sanitize(value):
+    if isinstance(value, BaseException):
+        return f"{type(value).__name__}: {value}"
+    return value
+
+
+class LogSink(ABC):
+    """Base class for sinks receiving the events evicted from a conversation log."""
+
+    @abstractmethod
+    def write(self, event: LogEvent):
+        pass
+
+
+class JSONLLogSink(LogSink):
+    """A sink appending events to a JSON Lines file."""
+
+    def __init__(self, path: str):
+        """Initialize the JSONLLogSink.
+
+        Args:
+            path (str): The path of the file to append the events to.
+        """
+        self.path = path
+        self._lock = threading.Lock()
+
+    def write(self, event: LogEvent):
+        line = json.dumps(event.to_dict(), default=str)
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+class ConversationLog:
+    """A bounded conversation log, keeping the most recent events in a ring buffer.
+
+    When full, the oldest events are evicted and, when provided, written to a sink.
+    Accepts legacy tuple entries on append, and compares equal to the list of their
+    tuples.
+    """
+
+    def __init__(
+        self,
+        events: Iterable = (),
+        capacity: int = 1000,
+        sink: Optional[LogSink] = None,
+    ):
+        """Initialize the ConversationLog.
+
+        Args:
+            events (Iterable): The initial events, as LogEvent, tuples or dictionaries.
+            capacity (int): The maximum number of events to keep in memory.
+            sink (LogSink): The sink receiving the evicted events. Optional, evicted events are discarded when not provided.
+        """
+        self.capacity = capacity
+        self.sink = sink
+        self.total = 0
+        self._events = deque(maxlen=capacity)
+        self._last_by_kind = {}
+        self._lock = threading.Lock()
+        for event in events:
+            self.append(event)
+
+    def append(self, entry: Union[LogEvent, tuple, dict]):
+        """Append an event to the log."""
+        event = LogEvent.from_entry(entry)
+        with self._lock:
+            if len(self._events) == self.capacity:
+                self._evict(self._events[0])
+            self._events.append(event)
+            self._last_by_kind[event.kind] = event
+            self.total += 1
+
+    def log(self, level: str, kind: str, source: str = None, *payload):
+        """Append an event to the log, given its fields."""
+        self.append(LogEvent(level, kind, source, payload))
+
+    def _evict(self, event: LogEvent):
+        if self._last_by_kind.get(event.kind) is event:
+            del self._last_by_kind[event.kind]
+        if self.sink is not None:
+            try:
+                self.sink.write(event)
+            except Exception as e:
+                logger.error("Error writing log event to sink: %s", e)
+
+    def _snapshot(self) -> list[LogEvent]:
+        # Iterating the ring buffer while another thread appends to it raises
+        with self._lock:
+            return list(self._events)
+
+    def last(
+        self, kind: str = None, level: str = None, source: str = None
+    ) -> Optional[LogEvent]:
+        """Get the most recent event matching the given filters, if any."""
+        if kind is not None and level is None and source is None:
+            return self._last_by_kind.get(kind)
+        return next(
+            (e for e in reversed(self._snapshot()) if _matches(e, kind, level, source)),
+            None,
+        )
+
+    def find(
+        self, kind: str = None, level: str = None, source: str = None
+    ) -> list[LogEvent]:
+        """Get all the events matching the given filters, oldest first."""
+        return [e for e in self._snapshot() if _matches(e, kind, level, source)]
+
+    def to_list(self) -> list[tuple]:
+        """Convert the log to a list of legacy tuples."""
+        return [event.as_tuple() for event in self._snapshot()]
+
+    def __iter__(self):
+        return iter(self._snapshot())
+
+    def __reversed__(self):
+        return reversed(self._snapshot())
+
+    def __len__(self) -> int:
+        return len(self._events)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self._snapshot()[index]
+        with self._lock:
+            return self._events[index]
+
+    def __eq__(self, other):
+        if isinstance(other, ConversationLog):
+            return self.to_list() == other.to_list()
+        if isinstance(other, list):
+            return self.to_list() == [
+                LogEvent.from_entry(entry).as_tuple() for entry in other
+            ]
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"ConversationLog({self.to_list()!r})"
+
+
+def _matches(event: LogEvent, kind: str, level: str, source: str) -> bool:
+    return (
+        (kind is None or event.kind == kind)
+        and (level is None or event.level == level)
+        and (source is None or event.source == source)
+    )
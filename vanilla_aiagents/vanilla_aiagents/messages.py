@@ -0,0 +1,142 @@
+import sys
+from collections.abc import Mapping
+from typing import Any, Iterable
+
+
+class Message(Mapping):
+    """A compact, immutable chat message.
+
+    Stores role, name and content in slots, interning role and name values so they
+    are shared across all the messages. Any other non-empty field (e.g. tool_calls)
+    is kept in a separate dictionary. Implements the read-only Mapping interface, so
+    it can be read like the plain message dictionaries used elsewhere, and converted
+    back to an OpenAI message dictionary via `to_dict`.
+    """
+
+    __slots__ = ("role", "name", "content", "_extra")
+
+    def __init__(self, role: str, content: Any = None, name: str = None, **extra):
+        """Initialize the Message.
+
+        Args:
+            role (str): The role of the message author.
+            content (Any): The content of the message, either a string or a list of content parts.
+            name (str): The name of the message author. Optional.
+            extra: Any other message field. Fields set to None are dropped.
+        """
+        object.__setattr__(self, "role", sys.intern(role))
+        object.__setattr__(self, "name", sys.intern(name) if name else None)
+        object.__setattr__(
+            self, "content", tuple(content) if isinstance(content, list) else content
+        )
+        extra = {key: value for key, value in extra.items() if value is not None}
+        object.__setattr__(self, "_extra", extra or None)
+
+    @classmethod
+    def from_dict(cls, message: Mapping) -> "Message":
+        """Create a compact message from a message dictionary."""
+        if isinstance(message, Message):
+            return message
+        return cls(**message)
+
+    def to_dict(self) -> dict:
+        """Convert the message to an OpenAI message dictionary."""
+        message = {"role": self.role}
+        if self.name is not None:
+            message["name"] = self.name
+        message["content"] = (
+            list(self.content) if isinstance(self.content, tuple) else self.content
+        )
+        if self._extra:
+            message.update(self._extra)
+        return message
+
+    def __setattr__(self, key, value):
+        raise AttributeError("Message is immutable")
+
+    def __getitem__(self, key: str) -> Any:
+        if key == "role":
+            return self.role
+        if key == "content":
+            return list(self.content) if isinstance(self.content, tuple) else self.content
+        if key == "name" and self.name is not None:
+            return self.name
+        if self._extra and key in self._extra:
+            return self._extra[key]
+        raise KeyError(key)
+
+    def __iter__(self):
+        yield "role"
+        if self.name is not None:
+            yield "name"
+        yield "content"
+        if self._extra:
+            yield from self._extra
+
+    def __len__(self) -> int:
+        return 2 + (self.name is not None) + len(self._extra or ())
+
+    def __repr__(self) -> str:
+        return f"Message({self.to_dict()!r})"
+
+    def __reduce__(self):
+        return (_message_from_dict, (self.to_dict(),))
+
+
+def _message_from_dict(message: dict) -> Message:
+    return Message(**message)
+
+
+class MessageList(list):
+    """A list of messages converting every added message into a compact Message."""
+
+    def __init__(self, messages: Iterable = ()):
+        super().__init__(Message.from_dict(message) for message in messages)
+
+    def append(self, message):
+        super().append(Message.from_dict(message))
+
+    def extend(self, messages):
+        super().extend(Message.from_dict(message) for message in messages)
+
+    def insert(self, index, message):
+        super().insert(index, Message.from_dict(message))
+
+    def __iadd__(self, messages):
+        self.extend(messages)
+        return self
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            value = [Message.from_dict(message) for message in value]
+        else:
+            value = Message.from_dict(value)
+        super().__setitem__(index, value)
+
+    def copy(self):
+        # Messages are immutable, so the copy can share them
+        copy = MessageList()
+        list.extend(copy, self)
+        return copy
+
+
+def as_dicts(messages: Iterable) -> list[dict]:
+    """Convert messages to plain dictionaries, as expected by the LLM and serializers."""
+    return [
+        message.to_dict() if isinstance(message, Message) else message
+        for message in messages
+    ]
+
+
+def message_text(message: dict) -> str:
+    """Extract the plain text of a message, skipping non-text content parts (e.g. images)."""
+    content = message.get("content")
+    if content is None:
+        return ""
+    if isinstance(content, str):
+        return content
+    return " ".join(
+        part.get("text", "")
+        for part in content
+        if isinstance(part, dict) and part.get("type") == "text"
+    )
@@ -5,6 +5,7 @@ from pydantic import BaseModel
 
 from .conversation import Conversation, ConversationReadingStrategy
 from .askable import Askable
+from .cancellation import is_timeout, supported_kwargs
 from .llm import LLM
 
 import logging
@@ -83,7 +84,15 @@ class PlannedTeam(Askable):
         # TODO persist plan in a conversation variable and read it from there
         # to support resuming plans
         if self.plan is None:
-            self.plan = self._create_plan(conversation)
+            if conversation.deadline_exceeded:
+                return self._deadline_exceeded(conversation)
+            try:
+                self.plan = self._create_plan(conversation)
+            except Exception as e:
+                if not (conversation.deadline_exceeded and is_timeout(e)):
+                    raise
+                # The planning LLM call timed out
+                return self._deadline_exceeded(conversation)
             logger.debug("[PlannedTeam %s] created plan: %s", self.id, self.plan)
 
         execution_result = "done"
@@ -94,13 +103,22 @@ class PlannedTeam(Askable):
         if stream:
             conversation.update(["start", self.id])
         for step in self.plan:
+            if conversation.cancellation.cancelled:
+                logger.debug("[PlannedTeam %s] cancelled, ending workflow.", self.id)
+                conversation.log.append(("info", "plannedteam/cancelled", self.id))
+                execution_result = "cancelled"
+                break
+            if conversation.deadline_exceeded:
+                execution_result = self._deadline_exceeded(conversation)
+                break
+
             self.current_agent = self.agents_dict[step.agent_id]
             logger.debug(
                 "[PlannedTeam %s] current agent: %s", self.id, self.current_agent.id
             )
 
             # TODO check behavior
-            local_conversation.messages.append(
+            local_conversation.append_messages(
                 {"role": "assistant", "name": self.id, "content": step.instructions}
             )
 
@@ -125,21 +143,37 @@ class PlannedTeam(Askable):
                 conversation.log.append(("error", "plannedteam/error", self.id))
                 execution_result = "agent-error"
                 break
+            elif agent_result == "cancelled":
+                logger.debug("[PlannedTeam %s] cancelled, ending workflow.", self.id)
+                conversation.log.append(("info", "plannedteam/cancelled", self.id))
+                execution_result = "cancelled"
+                break
+            elif agent_result == "deadline-exceeded":
+                execution_result = self._deadline_exceeded(conversation)
+                break
 
         if self.repeat_until is not None:
-            while not self.repeat_until(local_conversation):
+            while execution_result not in (
+                "cancelled",
+                "deadline-exceeded",
+            ) and not self.repeat_until(local_conversation):
                 execution_result = self.ask(local_conversation, stream=stream)
 
         if stream:
             local_conversation.update(["end", self.id])
 
         if self.fork_conversation:
-            conversation.messages.extend(
+            conversation.append_messages(
                 self.fork_strategy.get_messages(local_conversation)
             )
 
         return execution_result
 
+    def _deadline_exceeded(self, conversation: Conversation) -> str:
+        logger.debug("[PlannedTeam %s] deadline exceeded, ending workflow.", self.id)
+        conversation.log.append(("info", "plannedteam/deadline-exceeded", self.id))
+        return "deadline-exceeded"
+
     def _create_plan(self, conversation: Conversation):
         system_prompt = """
 You are a team orchestrator that must create a plan to solve the user inquiry by using the available agents.
@@ -195,7 +229,11 @@ BE SURE TO READ AGAIN THE INSTUCTIONS ABOVE BEFORE PROCEEDING.
 
         # logger.debug("[Team %s] messages for selecting next agent: %s", self.id, local_messages)
 
-        result, usage = self.llm.ask(messages=local_messages, response_format=TeamPlan)
+        result, usage = self.llm.ask(
+            messages=local_messages,
+            response_format=TeamPlan,
+            **supported_kwargs(self.llm.ask, timeout=conversation.time_remaining()),
+        )
         logger.debug("[PlannedTeam %s] result from Azure OpenAI: %s", self.id, result)
         if self.llm.constraints.structured_output:
             plan = result.parsed
@@ -207,9 +245,7 @@ BE SURE TO READ AGAIN THE INSTUCTIONS ABOVE BEFORE PROCEEDING.
 
         if usage is not None:
             # Update conversation metrics with response usage
-            conversation.metrics.total_tokens += usage["total_tokens"]
-            conversation.metrics.prompt_tokens += usage["prompt_tokens"]
-            conversation.metrics.completion_tokens += usage["completion_tokens"]
+            conversation.metrics.add(usage)
 
         return output.plan
 
@@ -6,7 +6,9 @@ from dapr.clients import DaprClient
 from pydantic import BaseModel
 
 from vanilla_aiagents.askable import Askable
+from vanilla_aiagents.blobs import FileSystemBlobStore
 from vanilla_aiagents.conversation import Conversation
+from vanilla_aiagents.messages import as_dicts
 from vanilla_aiagents.workflow import Workflow
 import logging
 
@@ -15,6 +17,8 @@ PUBSUB_NAME = os.getenv("PUBSUB_NAME", "workflow")
 TOPIC_NAME = os.getenv("TOPIC_NAME", "events")
 ACTOR_ENTRYPOINT = os.getenv("ACTOR_ENTRYPOINT", "_actor_askable.py")
 ACTOR_VARIABLE = os.getenv("ACTOR_VARIABLE", "_actor_askable")
+# When set, images are kept in this directory and actor state only holds references
+BLOB_STORE_DIR = os.getenv("BLOB_STORE_DIR")
 
 
 class WorkflowRunResult(BaseModel):
@@ -94,7 +98,10 @@ class WorkflowActor(Actor, WorkflowActorInterface):
 
         self.workflow = Workflow(
             askable=askable_class,
-            conversation=Conversation.from_dict(state if state is not None else {}),
+            conversation=Conversation.from_dict(
+                state if state is not None else {},
+                blob_store=FileSystemBlobStore(BLOB_STORE_DIR) if BLOB_STORE_DIR else None,
+            ),
         )
 
     async def get_conversation(self) -> dict:
@@ -107,7 +114,7 @@ class WorkflowActor(Actor, WorkflowActorInterface):
         try:
             n = len(self.workflow.conversation.messages)
             run_result.result = self.workflow.run(workflow_input)
-            run_result.messages = self.workflow.conversation.messages[n + 1 :]
+            run_result.messages = as_dicts(self.workflow.conversation.messages[n + 1 :])
 
             if run_result.result == "agent-stop":
                 self._notify_stop()
@@ -123,7 +130,7 @@ class WorkflowActor(Actor, WorkflowActorInterface):
     async def run_stream(self, workflow_input: Union[str, dict]):
         result: str = None
         with DaprClient() as client:
-            async for [mark, content] in self.workflow.run_stream(workflow_input):
+            async for [mark, content] in self.workflow.arun_stream(workflow_input):
                 event = StreamChunkWorkflowEvent(
                     type="stream", id=str(self.id), mark=mark, content=content
                 )
@@ -164,11 +171,13 @@ class WorkflowActor(Actor, WorkflowActorInterface):
 
     def _notify_stop(self):
         # Retrieve which askable stopped the conversation
-        (level, kind, agent) = next(
-            (l, k, a)
-            for (l, k, a) in reversed(self.workflow.conversation.log)
-            if k == "agent/stop"
-        )
+        stop = self.workflow.conversation.log.last(kind="agent/stop")
+        if stop is None:
+            # Evicted from a bounded log, the stop event is still published
+            logger.warning("Got stop signal with no agent/stop event in the log")
+            agent = ""
+        else:
+            agent = stop.source
         logger.info(f"Got stop signal from '{agent}'. Publishing stop event")
         with DaprClient() as client:
             event = StopWorkflowEvent(
@@ -1,9 +1,10 @@
 import json
-import queue
-import threading
 from .remote import AskableHost, Connection
 from ..conversation import Conversation
 from ..askable import Askable
+from ..cancellation import Deadline
+from ..events import EventBusClosed, EventGap, Subscription
+from ..stream import StreamFilter, StreamRegistry, StreamRun, StreamSession
 import grpc
 from grpc_reflection.v1alpha import reflection
 from concurrent import futures
@@ -18,17 +19,25 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+# Status codes of a dropped connection, after which a stream can be resumed
+_RESUMABLE_CODES = (grpc.StatusCode.UNAVAILABLE, grpc.StatusCode.INTERNAL)
+
+# Calls without a deadline report a practically infinite time remaining (about 290 billion years)
+_NO_DEADLINE = 10**9
+
 
 class GRPCConnection(Connection):
     """A connection to a gRPC server."""
 
-    def __init__(self, url: str):
+    def __init__(self, url: str, resume_attempts: int = 3):
         """
         Initialize the GRPCConnection.
 
         Args:
             url (str): The URL of the gRPC server.
+            resume_attempts (int): The maximum number of times an interrupted stream is resumed from the last received update.
         """
+        self.resume_attempts = resume_attempts
         # URL must be in the format host:port
         self.channel = grpc.insecure_channel(
             url.replace("http://", ""), compression=grpc.Compression.Gzip
@@ -36,6 +45,7 @@ class GRPCConnection(Connection):
         self.stub = RemoteServiceStub(self.channel)
 
     def _create_conversation_request(self, target_id, payload):
+        stream_filter = payload.get("stream_filter")
         return remote_pb2.ConversationRequest(
             agent_id=target_id,
             messages=[
@@ -45,14 +55,28 @@ class GRPCConnection(Connection):
                 for msg in payload["messages"]
             ],
             variables=payload["variables"],
+            stream_filter=(
+                remote_pb2.StreamFilter(
+                    marks=stream_filter.get("marks") or [],
+                    delta_fields=stream_filter.get("delta_fields") or [],
+                )
+                if stream_filter
+                else None
+            ),
         )
 
-    def send(self, target_id: str, operation: str, payload: dict[str, any]) -> dict:
-        """Send a request to the gRPC server."""
+    def send(
+        self,
+        target_id: str,
+        operation: str,
+        payload: dict[str, any],
+        timeout: float = None,
+    ) -> dict:
+        """Send a request to the gRPC server, with the remaining time budget as the call deadline if provided."""
         try:
             if operation == "ask":
                 request = self._create_conversation_request(target_id, payload)
-                response = self.stub.Ask(request)
+                response = self.stub.Ask(request, timeout=timeout)
                 return {
                     "conversation": {
                         "messages": [
@@ -86,8 +110,14 @@ class GRPCConnection(Connection):
             logger.error(f"Unexpected error: {e}")
             raise
 
-    def stream(self, target_id: str, operation: str, payload: dict[str, any]):
-        """Send a request to the gRPC server and stream the response."""
+    def stream(
+        self,
+        target_id: str,
+        operation: str,
+        payload: dict[str, any],
+        timeout: float = None,
+    ):
+        """Send a request to the gRPC server and stream the response, with the remaining time budget as the call deadline if provided."""
         logger.debug(
             f"Streaming operation '{operation}' for target_id '{target_id}' with payload: {payload}"
         )
@@ -95,19 +125,50 @@ class GRPCConnection(Connection):
         request = self._create_conversation_request(target_id, payload)
 
         result = None
-
-        for response in self.stub.AskStream(request):
-            mark = response.mark
-            content = json.loads(response.content)
-            logger.debug(
-                f"Received stream response with mark '{mark}' and content: {content}"
-            )
-            # Always yield the intermediate response to the caller
-            yield [mark, content]
-            # If the mark is 'result', then the response is the final response
-            if mark == "result":
-                result = content
-                break
+        run_id = None
+        last_id = None
+        attempts = 0
+        deadline = Deadline(timeout) if timeout is not None else None
+        responses = self.stub.AskStream(request, timeout=timeout)
+        try:
+            while True:
+                try:
+                    for response in responses:
+                        run_id = response.run_id or run_id
+                        last_id = response.id
+                        mark = response.mark
+                        content = json.loads(response.content)
+                        logger.debug(
+                            f"Received stream response with mark '{mark}' and content: {content}"
+                        )
+                        # Always yield the intermediate response to the caller
+                        yield [mark, content]
+                        # If the mark is 'result', then the response is the final response
+                        if mark == "result":
+                            result = content
+                            break
+                    break
+                except grpc.RpcError as e:
+                    # Resume from the last received update if the connection dropped
+                    if (
+                        e.code() not in _RESUMABLE_CODES
+                        or not run_id
+                        or attempts >= self.resume_attempts
+                    ):
+                        raise
+                    attempts += 1
+                    logger.warning(
+                        f"Stream interrupted ({e.code()}), resuming run {run_id} after update {last_id}"
+                    )
+                    responses = self.stub.ResumeStream(
+                        remote_pb2.ResumeRequest(
+                            agent_id=target_id, run_id=run_id, last_id=last_id
+                        ),
+                        timeout=deadline.remaining() if deadline else None,
+                    )
+        finally:
+            # Also when the consumer stops early, so the host can cancel the run
+            responses.cancel()
 
         logger.info(
             f"Streaming operation '{operation}' for target_id '{target_id}' completed with result: {result}"
@@ -118,7 +179,18 @@ class GRPCConnection(Connection):
 class GRPCHost(AskableHost):
     """A host for gRPC remote Askables."""
 
-    def __init__(self, askables: list[Askable], host: str, port: int):
+    def __init__(
+        self,
+        askables: list[Askable],
+        host: str,
+        port: int,
+        stream_maxsize: int = 1024,
+        stream_policy: str = "coalesce",
+        stream_timeout: float = None,
+        replay_capacity: int = 10000,
+        replay_ttl: float = 300,
+        disconnect_grace: float = 10,
+    ):
         """
         Initialize the GRPCHost.
 
@@ -126,10 +198,22 @@ class GRPCHost(AskableHost):
             askables (list[Askable]): The list of Askables to host.
             host (str): The host of the gRPC server.
             port (int): The port of the gRPC server.
+            stream_maxsize (int): The maximum number of updates buffered for a streaming client. 0 means unbounded.
+            stream_policy (str): What to do when a streaming client is too slow: "block" the askable, or "coalesce" text and tool call argument deltas.
+            stream_timeout (float): The maximum time to wait for the next update of a streaming run, in seconds. Optional.
+            replay_capacity (int): The maximum number of updates of a streaming run retained for clients resuming it.
+            replay_ttl (float): How long a streaming run can be resumed after it ended, in seconds.
+            disconnect_grace (float): How long to wait for a disconnected streaming client to resume before cancelling its run, in seconds. None to never cancel.
         """
         self.askables = askables
         self.host = host.replace("http://", "")
         self.port = port
+        self.stream_maxsize = stream_maxsize
+        self.stream_policy = stream_policy
+        self.stream_timeout = stream_timeout
+        self.replay_capacity = replay_capacity
+        self.replay_ttl = replay_ttl
+        self.disconnect_grace = disconnect_grace
 
     def start(self):
         """Start the gRPC server."""
@@ -143,7 +227,16 @@ class GRPCHost(AskableHost):
         self.server = grpc.server(
             thread_pool=futures.ThreadPoolExecutor(max_workers=10)
         )
-        add_RemoteServiceServicer_to_server(GRPCServer(self.askables), self.server)
+        self.servicer = GRPCServer(
+            self.askables,
+            stream_maxsize=self.stream_maxsize,
+            stream_policy=self.stream_policy,
+            stream_timeout=self.stream_timeout,
+            replay_capacity=self.replay_capacity,
+            replay_ttl=self.replay_ttl,
+            disconnect_grace=self.disconnect_grace,
+        )
+        add_RemoteServiceServicer_to_server(self.servicer, self.server)
 
         # Enable reflection
         SERVICE_NAMES = (
@@ -160,19 +253,41 @@ class GRPCHost(AskableHost):
     def stop(self):
         """Stop the gRPC server."""
         self.server.stop(grace=0)
+        self.servicer.runs.close()
 
 
 class GRPCServer(RemoteServiceServicer):
     """A gRPC server for Askables."""
 
-    def __init__(self, askables: list[Askable]):
+    def __init__(
+        self,
+        askables: list[Askable],
+        stream_maxsize: int = 1024,
+        stream_policy: str = "coalesce",
+        stream_timeout: float = None,
+        replay_capacity: int = 10000,
+        replay_ttl: float = 300,
+        disconnect_grace: float = 10,
+    ):
         """
         Initialize the GRPCServer.
 
         Args:
             askables (list[Askable]): The list of Askables to host.
+            stream_maxsize (int): The maximum number of updates buffered for a streaming client. 0 means unbounded.
+            stream_policy (str): What to do when a streaming client is too slow: "block" the askable, or "coalesce" text and tool call argument deltas.
+            stream_timeout (float): The maximum time to wait for the next update of a streaming run, in seconds. Optional.
+            replay_capacity (int): The maximum number of updates of a streaming run retained for clients resuming it.
+            replay_ttl (float): How long a streaming run can be resumed after it ended, in seconds.
+            disconnect_grace (float): How long to wait for a disconnected streaming client to resume before cancelling its run, in seconds. None to never cancel.
         """
         self.askables = askables
+        self.stream_maxsize = stream_maxsize
+        self.stream_policy = stream_policy
+        self.stream_timeout = stream_timeout
+        self.replay_capacity = replay_capacity
+        self.runs = StreamRegistry(ttl=replay_ttl)
+        self.disconnect_grace = disconnect_grace
         self.askables_dict = {askable.id: askable for askable in askables}
 
     def Ask(self, request: remote_pb2.ConversationRequest, context):
@@ -190,6 +305,7 @@ class GRPCServer(RemoteServiceServicer):
             ],
             variables=dict(request.variables),
         )
+        conv.deadline = _deadline_from_context(context)
         result = askable.ask(conv)
 
         return remote_pb2.AskResponse(
@@ -230,72 +346,85 @@ class GRPCServer(RemoteServiceServicer):
                 for msg in request.messages
             ],
             variables=dict(request.variables),
+            stream_maxsize=self.stream_maxsize,
+            stream_policy=self.stream_policy,
         )
+        conversation.deadline = _deadline_from_context(context)
 
         logger.debug(
             f"Received stream request for agent '{agent_id}' with messages: {conversation.messages}"
         )
 
-        # In order to stream the response, we need to run the askable.ask method in a separate thread
-        # updates to the conversation object will be streamed back to the client below.
-        # The result of the askable.ask method will be sent back as the final response via a thread-safe queue
-        result_queue = queue.SimpleQueue()
-
-        def ask_in_thread():
-            res = None
-            try:
-                res = askable.ask(conversation, True)
-            except Exception as e:
-                logger.error("Error during askable.ask: %s", e, exc_info=True)
-                conversation.update(["error", str(e)])
-                res = "error"
-
-            result_queue.put_nowait(res)
-
-        thread = threading.Thread(target=ask_in_thread)
-        thread.start()
-
-        # Stream the intermediate responses back to the client
-        # Since the conversation stream is an infinite generator, we need to keep track of the stack count to know when to break
-        stack_count = 0
-        for mark, content in conversation.stream():
-            logger.debug(
-                f"Streaming response with mark '{mark}' and content: {content}"
-            )
-            # Always yield the response to the client
-            yield remote_pb2.AskStreamingResponse(
-                mark=mark,
-                content=json.dumps(
-                    content
-                ),  # Convert the content to a JSON string, as the content must be a string for semplification
-            )
+        # The askable runs in a background thread, while its updates to the conversation
+        # object are streamed back to the client below, until the session completes
+        session = StreamSession(
+            askable,
+            conversation,
+            timeout=self.stream_timeout,
+            stream_filter=_stream_filter_from_request(request),
+        )
 
-            # Keep track of the stack count to know when to break
-            if mark == "start":
-                stack_count += 1
-            elif mark == "end":
-                stack_count -= 1
-
-            # break the loop when the stack count is 0 or an error is received
-            logger.debug("Stack count: %s", stack_count)
-            if stack_count == 0:
-                logger.debug("Received response and stack count is 0, breaking stream.")
-                break
-            if mark == "error":
-                logger.debug("Received error, breaking stream.")
-                break
-
-        # The stream is complete, can join the thread and send the final response
-        thread.join()
-
-        response = {
-            "conversation": conversation.to_dict(),  # Updated conversation object
-            "result": result_queue.get(),  # Result from askable.ask method
-        }
-        logger.debug(f"Streaming operation completed with result: {response}")
-        yield remote_pb2.AskStreamingResponse(
-            mark="result", content=json.dumps(response)
+        def _finalize(session: StreamSession):
+            response = {
+                "conversation": conversation.to_dict(),  # Updated conversation object
+                "result": session.result,  # Result from askable.ask method
+            }
+            logger.debug(f"Streaming operation completed with result: {response}")
+            return response
+
+        # The run keeps going if the client disconnects, so it can resume it
+        run = StreamRun(
+            session,
+            finalize=_finalize,
+            capacity=self.replay_capacity,
+            disconnect_grace=self.disconnect_grace,
         )
+        # Subscribed before starting, so the client paces the run from its first update
+        subscription = run.subscribe()
+        run.start()
+        self.runs.add(run)
+
+        yield from self._stream_run(run, subscription, context)
+
+    def ResumeStream(self, request: remote_pb2.ResumeRequest, context):
+        """Handle a ResumeStream request, streaming the updates of a run after the last one received."""
+        run = self.runs.get(request.run_id, askable_id=request.agent_id)
+        if run is None:
+            context.set_code(grpc.StatusCode.NOT_FOUND)
+            context.set_details("Stream run not found")
+            logger.error(f"Stream run '{request.run_id}' not found")
+            return
+
+        # Unset to resume from the first update, as 0 is the ID of the first update
+        last_id = request.last_id if request.HasField("last_id") else None
+        try:
+            subscription = run.subscribe(last_id)
+        except EventGap as e:
+            context.set_code(grpc.StatusCode.OUT_OF_RANGE)
+            context.set_details(f"Stream updates expired: {e}")
+            logger.error(f"Stream run '{request.run_id}' cannot be resumed: {e}")
+            return
+        yield from self._stream_run(run, subscription, context)
+
+    def _stream_run(self, run: StreamRun, subscription: Subscription, context):
+        # Wake up the subscription when the client goes away
+        context.add_callback(subscription.close)
+        try:
+            for id, (mark, content) in _with_ids(run, subscription):
+                logger.debug(
+                    f"Streaming response with mark '{mark}' and content: {content}"
+                )
+                # Always yield the response to the client
+                yield remote_pb2.AskStreamingResponse(
+                    mark=mark,
+                    content=json.dumps(
+                        content
+                    ),  # Convert the content to a JSON string, as the content must be a string for semplification
+                    id=id,
+                    run_id=run.run_id,
+                )
+        finally:
+            run.unsubscribe(subscription)
 
     def Describe(self, request: remote_pb2.DescribeRequest, context):
         """Handle a Describe request.
@@ -311,3 +440,30 @@ class GRPCServer(RemoteServiceServicer):
             context.set_code(grpc.StatusCode.NOT_FOUND)
             context.set_details("Askable not found")
             return remote_pb2.Empty()
+
+
+def _stream_filter_from_request(request) -> StreamFilter:
+    # Empty repeated fields mean no restriction, as proto3 has no optional lists
+    if not request.HasField("stream_filter"):
+        return None
+    return StreamFilter(
+        marks=list(request.stream_filter.marks) or None,
+        delta_fields=list(request.stream_filter.delta_fields) or None,
+    )
+
+
+def _deadline_from_context(context) -> Deadline:
+    # Continue the time budget of the caller run, when the call has a deadline
+    remaining = context.time_remaining()
+    if remaining is None or remaining > _NO_DEADLINE:
+        return None
+    return Deadline(remaining)
+
+
+def _with_ids(run: StreamRun, subscription: Subscription):
+    # Iterate the (id, update) pairs of a subscription until the run ends
+    while True:
+        try:
+            yield run.read(subscription)
+        except EventBusClosed:
+            return
@@ -3,14 +3,16 @@ import contextlib
 import gzip
 import json
 import logging
-import queue
 import time
-from typing import Generator, Protocol
+from typing import Annotated, Generator, Optional, Protocol
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Header, HTTPException, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.exception_handlers import request_validation_exception_handler
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.gzip import GZipMiddleware
-from fastapi.responses import StreamingResponse
-from pydantic import BaseModel
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel, Field
 import uvicorn
 import threading
 import requests
@@ -19,6 +21,16 @@ import os
 
 from starlette_gzip_request import GZipRequestMiddleware
 
+from ..blobs import (
+    DIGEST_PATTERN,
+    BlobDigestMismatchError,
+    BlobStore,
+    InMemoryBlobStore,
+    InvalidBlobDigestError,
+    collect_digests,
+    decode_blobs,
+    encode_blobs,
+)
 from ..conversation import (
     AllMessagesStrategy,
     Conversation,
@@ -26,16 +38,25 @@ from ..conversation import (
     ConversationReadingStrategy,
 )
 from ..askable import Askable
+from ..cancellation import Deadline, is_timeout, supported_kwargs
+from ..messages import as_dicts
+from ..events import EventBusClosed, EventGap
+from ..events import Subscription
+from ..stream import StreamFilter, StreamRegistry, StreamRun, StreamSession
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# Header carrying the remaining time budget of the caller run, in seconds
+DEADLINE_HEADER = "X-Deadline-Remaining"
+
 
 class ConversationRequest(BaseModel):
     """A class to store a conversation request to a remote askable."""
 
     messages: list[dict]
     variables: dict
+    stream_filter: Optional[StreamFilter] = None
 
 
 class ConversationResponse(BaseModel):
@@ -46,6 +67,29 @@ class ConversationResponse(BaseModel):
     metrics: ConversationMetrics
 
 
+# Blob digests are used as file names by the blob stores, only accept SHA-256 hex digests
+BlobDigest = Annotated[str, Field(pattern=DIGEST_PATTERN)]
+
+
+class BlobsRequest(BaseModel):
+    """A class to store a request to check or fetch blobs from a remote host."""
+
+    digests: list[BlobDigest]
+
+
+class PutBlobsRequest(BaseModel):
+    """A class to store a request to upload base64 encoded blobs to a remote host."""
+
+    blobs: dict[BlobDigest, str]
+
+
+class ResumeRequest(BaseModel):
+    """A class to store a request to resume a streaming run on a remote host."""
+
+    run_id: str
+    last_id: Optional[int] = None
+
+
 class AskResponse(BaseModel):
     """A class to store an ask response from a remote askable."""
 
@@ -57,41 +101,50 @@ class Connection(Protocol):
     """A common interface for a connection to a remote askable."""
 
     @abstractmethod
-    def send(target_id: str, self, operation: str, payload: any) -> dict:
-        """Send a payload to the remote askable."""
+    def send(
+        target_id: str, self, operation: str, payload: any, timeout: float = None
+    ) -> dict:
+        """Send a payload to the remote askable, forwarding the remaining time budget if any."""
         pass
 
     @abstractmethod
-    def stream(target_id: str, self, operation: str, payload: any) -> dict:
-        """Send a payload to the remote askable and stream the response."""
+    def stream(
+        target_id: str, self, operation: str, payload: any, timeout: float = None
+    ) -> dict:
+        """Send a payload to the remote askable and stream the response, forwarding the remaining time budget if any."""
         pass
 
 
 class RESTConnection(Connection):
     """A connection to a remote askable using HTTP REST."""
 
-    def __init__(self, url: str):
+    def __init__(self, url: str, resume_attempts: int = 3):
         """Initialize the RESTConnection object.
 
         Args:
             url (str): The URL of the remote askable.
+            resume_attempts (int): The maximum number of times an interrupted stream is resumed from the last received update.
         """
         self.url = url
+        self.resume_attempts = resume_attempts
         logger.debug(f"RESTConnection initialized with URL: {self.url}")
 
-    def send(self, target_id: str, operation: str, payload: any) -> dict:
+    def send(
+        self, target_id: str, operation: str, payload: any, timeout: float = None
+    ) -> dict:
         """Send a payload to the remote askable.
 
         Args:
             target_id (str): The ID of the remote askable.
             operation (str): The operation to perform.
             payload (any): The payload to send.
+            timeout (float): The remaining time budget of the caller run, forwarded to the host in the X-Deadline-Remaining header. Optional.
 
         Returns:
             dict: The response from the remote askable, deserialized from JSON.
         """
         logger.debug(f"Sending payload to {self.url}/{operation}: {payload}")
-        headers = {"Content-Encoding": "gzip", "Content-Type": "application/json"}
+        headers = _headers(timeout)
         compressed_payload = gzip.compress(json.dumps(payload).encode("utf-8"))
         response = requests.post(
             f"{self.url}/{target_id}/{operation}",
@@ -104,7 +157,9 @@ class RESTConnection(Connection):
 
         return response
 
-    def stream(self, target_id: str, operation: str, payload: any):
+    def stream(
+        self, target_id: str, operation: str, payload: any, timeout: float = None
+    ):
         """
         Send a payload to the remote askable and stream the response.
 
@@ -112,31 +167,74 @@ class RESTConnection(Connection):
             target_id (str): The ID of the remote askable.
             operation (str): The operation to perform.
             payload (any): The payload to send.
+            timeout (float): The remaining time budget of the caller run, forwarded to the host in the X-Deadline-Remaining header. Optional.
+
+        If the connection drops mid-stream, the stream is resumed from the last
+        received update, without asking the remote askable again.
 
         Yields:
             dict: The response from the remote askable, deserialized from JSON.
         """
         logger.debug(f"Streaming payload to {self.url}/{operation}: {payload}")
-        headers = {"Content-Encoding": "gzip", "Content-Type": "application/json"}
+        response = self._post_stream(
+            f"{self.url}/{target_id}/{operation}?stream=true", payload, timeout
+        )
+        run_id = response.headers.get("X-Run-Id")
+        last_id = None
+        attempts = 0
+        result = None
+        try:
+            while True:
+                try:
+                    for line in response.iter_lines():
+                        if line:
+                            logger.debug(f"Received line: {line}")
+                            mark, content, *rest = json.loads(line)
+                            if rest:
+                                last_id = rest[0]
+                            yield [mark, content]
+                            if mark == "result":
+                                result = content
+                                break
+                    break
+                except requests.exceptions.RequestException as e:
+                    if run_id is None or attempts >= self.resume_attempts:
+                        raise
+                    attempts += 1
+                    logger.warning(
+                        f"Stream interrupted ({e}), resuming run {run_id} after update {last_id}"
+                    )
+                    response.close()
+                    response = self._post_stream(
+                        f"{self.url}/{target_id}/resume",
+                        {"run_id": run_id, "last_id": last_id},
+                    )
+        finally:
+            # Also when the consumer stops early, so the host can cancel the run
+            response.close()
+
+        return result
+
+    def _post_stream(
+        self, url: str, payload: any, timeout: float = None
+    ) -> requests.Response:
+        headers = _headers(timeout)
         compressed_payload = gzip.compress(json.dumps(payload).encode("utf-8"))
         response = requests.post(
-            f"{self.url}/{target_id}/{operation}?stream=true",
+            url,
             data=compressed_payload,
             headers=headers,
             stream=True,
         )
         response.raise_for_status()
-        result = None
-        for line in response.iter_lines():
-            if line:
-                logger.debug(f"Received line: {line}")
-                mark, content = json.loads(line)
-                yield [mark, content]
-                if mark == "result":
-                    result = content
-                    break
+        return response
 
-        return result
+
+def _headers(timeout: float = None) -> dict:
+    headers = {"Content-Encoding": "gzip", "Content-Type": "application/json"}
+    if timeout is not None:
+        headers[DEADLINE_HEADER] = f"{timeout:.3f}"
+    return headers
 
 
 class RemoteAskable(Askable):
@@ -147,6 +245,7 @@ class RemoteAskable(Askable):
         id: str,
         connection: Connection,
         reading_strategy: ConversationReadingStrategy = AllMessagesStrategy(),
+        stream_filter: Optional[StreamFilter] = None,
     ):
         """Initialize the RemoteAskable object.
 
@@ -154,11 +253,13 @@ class RemoteAskable(Askable):
             id (str): The ID of the RemoteAskable object. Will be used to uniquely identify it.
             connection (Connection): The connection to the remote askable.
             reading_strategy (ConversationReadingStrategy): The reading strategy to use to select the messages to send to the remote askable.
+            stream_filter (StreamFilter): The filter applied by the remote host to the streamed updates, so unwanted updates are not sent over the wire. Optional.
         """
         super().__init__("", "")
         self.connection = connection
         self.id = id
         self.reading_strategy = reading_strategy
+        self.stream_filter = stream_filter
 
         response = self.connection.send(self.id, "describe", {})
         self.description = response["description"]
@@ -174,36 +275,105 @@ class RemoteAskable(Askable):
             conversation (Conversation): The conversation to use for the execution
             stream (bool): Whether to stream the conversation updates.
         """
-        source_messages = self.reading_strategy.get_messages(conversation)
-        payload = {"messages": source_messages, "variables": conversation.variables}
+        if conversation.deadline_exceeded:
+            return self._deadline_exceeded(conversation)
+
+        source_messages = as_dicts(self.reading_strategy.get_messages(conversation))
+        self._push_blobs(conversation, source_messages)
+        _, variables = conversation.snapshot()
+        payload = {"messages": source_messages, "variables": variables}
         logger.debug(f"Asking with payload: {payload}")
 
         result = None
         conv = None
-        if not stream:
-            response = self.connection.send(self.id, "ask", payload)
-        else:
-            gen = self.connection.stream(self.id, "ask", payload)
-            for mark, content in gen:
-                conversation.update([mark, content])
-                if mark == "result":
-                    response = content
+        try:
+            # The remote host gets the remaining time budget of this run
+            timeout = conversation.time_remaining()
+            if not stream:
+                response = self.connection.send(
+                    self.id,
+                    "ask",
+                    payload,
+                    **supported_kwargs(self.connection.send, timeout=timeout),
+                )
+            else:
+                if self.stream_filter is not None:
+                    payload["stream_filter"] = self.stream_filter.model_dump()
+                gen = self.connection.stream(
+                    self.id,
+                    "ask",
+                    payload,
+                    **supported_kwargs(self.connection.stream, timeout=timeout),
+                )
+                for mark, content in gen:
+                    if conversation.cancellation.cancelled:
+                        # Disconnecting makes the remote host cancel the run
+                        gen.close()
+                        conversation.log.append(("info", "remote/cancelled", self.id))
+                        return "cancelled"
+                    conversation.update([mark, content])
+                    if mark == "result":
+                        response = content
+        except Exception as e:
+            if not (conversation.deadline_exceeded and is_timeout(e)):
+                raise
+            # The remote call was cut by the deadline
+            return self._deadline_exceeded(conversation)
 
         result = response["result"]
         conv = response["conversation"]
 
         # Original metrics are not part of the payload, so we need to sum them
-        conversation.metrics.completion_tokens += conv["metrics"]["completion_tokens"]
-        conversation.metrics.prompt_tokens += conv["metrics"]["prompt_tokens"]
-        conversation.metrics.total_tokens += conv["metrics"]["total_tokens"]
+        conversation.metrics.add(conv["metrics"])
         # Update the conversation with the new messages
-        conversation.messages += conv["messages"][len(source_messages):]
-        # Update the conversation variables
-        conversation.variables = conv["variables"]
+        new_messages = conv["messages"][len(source_messages):]
+        self._pull_blobs(conversation, new_messages)
+        conversation.append_messages(new_messages)
+        # Merge only the variables the remote askable changed or deleted, keeping the ones written concurrently
+        remote_variables = conv["variables"]
+        conversation.merge_variables(
+            {
+                name: value
+                for name, value in remote_variables.items()
+                if name not in variables or variables[name] != value
+            },
+            deleted=[name for name in variables if name not in remote_variables],
+        )
         logger.debug(f"Updated conversation: {conversation}")
 
         return result
 
+    def _deadline_exceeded(self, conversation: Conversation) -> str:
+        logger.debug(f"RemoteAskable {self.id} deadline exceeded")
+        conversation.log.append(("info", "remote/deadline-exceeded", self.id))
+        return "deadline-exceeded"
+
+    def _push_blobs(self, conversation: Conversation, messages: list[dict]):
+        # Upload only the referenced blobs the remote host does not already have
+        digests = collect_digests(messages)
+        if not digests or conversation.blob_store is None:
+            return
+        missing = self.connection.send(self.id, "blobs/missing", {"digests": digests})[
+            "missing"
+        ]
+        if missing:
+            logger.debug(f"Uploading {len(missing)} blobs to remote host")
+            self.connection.send(
+                self.id,
+                "blobs/put",
+                {"blobs": encode_blobs(conversation.blob_store, missing)},
+            )
+
+    def _pull_blobs(self, conversation: Conversation, messages: list[dict]):
+        # Download the blobs produced by the remote host, if any
+        if conversation.blob_store is None:
+            return
+        missing = conversation.blob_store.missing(collect_digests(messages))
+        if missing:
+            logger.debug(f"Downloading {len(missing)} blobs from remote host")
+            response = self.connection.send(self.id, "blobs/get", {"digests": missing})
+            decode_blobs(conversation.blob_store, response["blobs"])
+
 
 class AskableHost(Protocol):
     """A common interface for a host that can host askables."""
@@ -244,6 +414,13 @@ class RESTHost(AskableHost):
         host: str,
         port: int,
         config: uvicorn.Config = None,
+        blob_store: BlobStore = None,
+        stream_maxsize: int = 1024,
+        stream_policy: str = "coalesce",
+        stream_timeout: float = None,
+        replay_capacity: int = 10000,
+        replay_ttl: float = 300,
+        disconnect_grace: float = 10,
     ):
         """Initialize the RESTHost object.
 
@@ -252,8 +429,22 @@ class RESTHost(AskableHost):
             host (str): The host to bind the server to.
             port (int): The port to bind the server to.
             config (uvicorn.Config): The configuration to use for the server.
+            blob_store (BlobStore): The store for the images referenced by the conversations. Optional, defaults to an in-memory store.
+            stream_maxsize (int): The maximum number of updates buffered for a streaming client. 0 means unbounded.
+            stream_policy (str): What to do when a streaming client is too slow: "block" the askable, or "coalesce" text and tool call argument deltas.
+            stream_timeout (float): The maximum time to wait for the next update of a streaming run, in seconds. Optional.
+            replay_capacity (int): The maximum number of updates of a streaming run retained for clients resuming it.
+            replay_ttl (float): How long a streaming run can be resumed after it ended, in seconds.
+            disconnect_grace (float): How long to wait for a disconnected streaming client to resume before cancelling its run, in seconds. None to never cancel.
         """
         self.askables = askables
+        self.blob_store = blob_store or InMemoryBlobStore()
+        self.stream_maxsize = stream_maxsize
+        self.stream_policy = stream_policy
+        self.stream_timeout = stream_timeout
+        self.replay_capacity = replay_capacity
+        self.runs = StreamRegistry(ttl=replay_ttl)
+        self.disconnect_grace = disconnect_grace
         self.askables_dict = {askable.id: askable for askable in askables}
         self._build_app()
         self.config = config or uvicorn.Config(app=self.app, host=host, port=port)
@@ -279,6 +470,7 @@ class RESTHost(AskableHost):
         logger.debug("Stopping server")
         self.server.should_exit = True
         self.server.thread.join()
+        self.runs.close()
         logger.debug("Server stopped")
 
     def _build_app(self):
@@ -287,6 +479,13 @@ class RESTHost(AskableHost):
         self.app.add_middleware(GZipMiddleware, minimum_size=1000)
         self.app.add_middleware(GZipRequestMiddleware)
 
+        @self.app.exception_handler(RequestValidationError)
+        async def validation_error(request: Request, exc: RequestValidationError):
+            # Invalid blob digests are bad requests, not just unprocessable entities
+            if "/blobs/" in request.url.path:
+                return JSONResponse(status_code=400, content={"detail": jsonable_encoder(exc.errors())})
+            return await request_validation_exception_handler(request, exc)
+
         @self.app.post("/{id}/describe")
         async def describe(id: str):
             if id in self.askables_dict:
@@ -296,71 +495,85 @@ class RESTHost(AskableHost):
                 # Return 404 if the askable is not found
                 return {"detail": "Askable not found"}, 404
 
+        @self.app.post("/{id}/blobs/missing")
+        async def missing_blobs(id: str, request: BlobsRequest):
+            try:
+                return {"missing": self.blob_store.missing(request.digests)}
+            except InvalidBlobDigestError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+
+        @self.app.post("/{id}/blobs/put")
+        async def put_blobs(id: str, request: PutBlobsRequest):
+            try:
+                decode_blobs(self.blob_store, request.blobs)
+            except (BlobDigestMismatchError, InvalidBlobDigestError) as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            return {"stored": list(request.blobs)}
+
+        @self.app.post("/{id}/blobs/get")
+        async def get_blobs(id: str, request: BlobsRequest):
+            try:
+                return {"blobs": encode_blobs(self.blob_store, request.digests)}
+            except InvalidBlobDigestError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+
         @self.app.post("/{id}/ask")
-        async def ask(id: str, request: ConversationRequest, stream: bool = False):
+        async def ask(
+            id: str,
+            request: ConversationRequest,
+            stream: bool = False,
+            x_deadline_remaining: Optional[float] = Header(None),
+        ):
             logger.debug(f"Received ask request: {request} for askable {id}")
-            conv = Conversation(request.messages, request.variables)
+            conv = Conversation(
+                request.messages,
+                request.variables,
+                blob_store=self.blob_store,
+                stream_maxsize=self.stream_maxsize,
+                stream_policy=self.stream_policy,
+            )
+            if x_deadline_remaining is not None:
+                # Continue the time budget of the caller run
+                conv.deadline = Deadline(x_deadline_remaining)
 
             if id in self.askables_dict:
                 askable = self.askables_dict[id]
 
                 if stream:
-                    result_queue = queue.SimpleQueue()
-
-                    def ask_in_thread():
-                        res = None
-                        try:
-                            res = askable.ask(conv, True)
-                        except Exception as e:
-                            logger.error(
-                                "Error during askable.ask: %s", e, exc_info=True
-                            )
-                            conv.update(["error", str(e)])
-                            res = "error"
-
-                        result_queue.put_nowait(res)
-
-                    thread = threading.Thread(target=ask_in_thread)
-                    thread.start()
-
-                    async def _stream():
-                        # Since we are using an infinite generator, we need to keep track of the stack count to know when to break
-                        stack_count = 0
-                        for mark, content in conv.stream():
-                            json_string = json.dumps([mark, content])
-
-                            # Always yield the update back to the client, as a JSON string
-                            yield json_string + "\n"  # NEW LINE DELIMITED JSON, otherwise the client will not be able to read the stream
-
-                            # Keep track of the stack count to know when to break
-                            if mark == "start":
-                                stack_count += 1
-                            elif mark == "end":
-                                stack_count -= 1
-
-                            logger.debug("Stack count: %s", stack_count)
-                            if stack_count == 0:
-                                logger.debug(
-                                    "Received response and stack count is 0, breaking stream."
-                                )
-                                break
-                            if mark == "error":
-                                logger.debug("Received error, breaking stream.")
-                                break
+                    session = StreamSession(
+                        askable,
+                        conv,
+                        timeout=self.stream_timeout,
+                        stream_filter=request.stream_filter,
+                    )
+
 
-                        thread.join()
-                        response = AskResponse(
+                    def _finalize(session: StreamSession):
+                        return AskResponse(
                             conversation=ConversationResponse(
                                 messages=conv.messages,
                                 variables=conv.variables,
                                 metrics=conv.metrics,
                             ),
-                            result=result_queue.get(),
+                            result=session.result,
                         ).model_dump()
-                        yield json.dumps(["result", response])
+
+                    # The run keeps going if the client disconnects, so it can resume it
+                    run = StreamRun(
+                        session,
+                        finalize=_finalize,
+                        capacity=self.replay_capacity,
+                        disconnect_grace=self.disconnect_grace,
+                    )
+                    # Subscribed before starting, so the client paces the run from its first update
+                    subscription = run.subscribe()
+                    run.start()
+                    self.runs.add(run)
 
                     response = StreamingResponse(
-                        _stream(), media_type="application/x-ndjson"
+                        _stream_run(run, subscription),
+                        media_type="application/x-ndjson",
+                        headers={"X-Run-Id": run.run_id},
                     )
                 else:
                     result = askable.ask(conv, stream=False)
@@ -380,6 +593,41 @@ class RESTHost(AskableHost):
                 # Return 404 if the askable is not found
                 return {"detail": "Askable not found"}, 404
 
+        @self.app.post("/{id}/resume")
+        async def resume(id: str, request: ResumeRequest):
+            logger.debug(f"Received resume request: {request} for askable {id}")
+            run = self.runs.get(request.run_id, askable_id=id)
+            if run is None:
+                raise HTTPException(status_code=404, detail="Stream run not found")
+            try:
+                subscription = run.subscribe(request.last_id)
+            except EventGap as e:
+                raise HTTPException(
+                    status_code=410, detail=f"Stream updates expired: {e}"
+                )
+
+            return StreamingResponse(
+                _stream_run(run, subscription),
+                media_type="application/x-ndjson",
+                headers={"X-Run-Id": run.run_id},
+            )
+
+
+async def _stream_run(run: StreamRun, subscription: Subscription):
+    try:
+        while True:
+            try:
+                id, (mark, content) = await run.aread(subscription)
+            except EventBusClosed:
+                return
+            # Always yield the update back to the client, as a JSON string with its ID
+            yield json.dumps(
+                [mark, content, id]
+            ) + "\n"  # NEW LINE DELIMITED JSON, otherwise the client will not be able to read the stream
+    finally:
+        # Cancels the run after a grace period if the client disconnected for good
+        run.unsubscribe(subscription)
+
 
 def find_askables(source_dir: str = None):
     """Find all askables in the given source directory.
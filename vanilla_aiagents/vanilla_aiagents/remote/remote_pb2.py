@@ -19,7 +19,7 @@ _sym_db = _symbol_database.Default()
 
 
 DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(
-    b'\n\x0cremote.proto\x12\x0bremote.grpc"6\n\x07Message\x12\x0c\n\x04role\x18\x01 \x01(\t\x12\x0f\n\x07\x63ontent\x18\x02 \x01(\t\x12\x0c\n\x04name\x18\x03 \x01(\t"]\n\x13\x43onversationMetrics\x12\x19\n\x11\x63ompletion_tokens\x18\x01 \x01(\x05\x12\x15\n\rprompt_tokens\x18\x02 \x01(\x05\x12\x14\n\x0ctotal_tokens\x18\x03 \x01(\x05"\xc5\x01\n\x13\x43onversationRequest\x12\x10\n\x08\x61gent_id\x18\x01 \x01(\t\x12&\n\x08messages\x18\x02 \x03(\x0b\x32\x14.remote.grpc.Message\x12\x42\n\tvariables\x18\x03 \x03(\x0b\x32/.remote.grpc.ConversationRequest.VariablesEntry\x1a\x30\n\x0eVariablesEntry\x12\x0b\n\x03key\x18\x01 \x01(\t\x12\r\n\x05value\x18\x02 \x01(\t:\x02\x38\x01"\xe8\x01\n\x14\x43onversationResponse\x12&\n\x08messages\x18\x01 \x03(\x0b\x32\x14.remote.grpc.Message\x12\x43\n\tvariables\x18\x02 \x03(\x0b\x32\x30.remote.grpc.ConversationResponse.VariablesEntry\x12\x31\n\x07metrics\x18\x03 \x01(\x0b\x32 .remote.grpc.ConversationMetrics\x1a\x30\n\x0eVariablesEntry\x12\x0b\n\x03key\x18\x01 \x01(\t\x12\r\n\x05value\x18\x02 \x01(\t:\x02\x38\x01"V\n\x0b\x41skResponse\x12\x0e\n\x06result\x18\x01 \x01(\t\x12\x37\n\x0c\x63onversation\x18\x02 \x01(\x0b\x32!.remote.grpc.ConversationResponse"#\n\x0f\x44\x65scribeRequest\x12\x10\n\x08\x61gent_id\x18\x01 \x01(\t"3\n\x10\x44\x65scribeResponse\x12\n\n\x02id\x18\x01 \x01(\t\x12\x13\n\x0b\x64\x65scription\x18\x02 \x01(\t"5\n\x14\x41skStreamingResponse\x12\x0c\n\x04mark\x18\x01 \x01(\t\x12\x0f\n\x07\x63ontent\x18\x02 \x01(\t2\xef\x01\n\rRemoteService\x12\x41\n\x03\x41sk\x12 .remote.grpc.ConversationRequest\x1a\x18.remote.grpc.AskResponse\x12R\n\tAskStream\x12 .remote.grpc.ConversationRequest\x1a!.remote.grpc.AskStreamingResponse0\x01\x12G\n\x08\x44\x65scribe\x12\x1c.remote.grpc.DescribeRequest\x1a\x1d.remote.grpc.DescribeResponseb\x06proto3'
+    b'\n\x0cremote.proto\x12\x0bremote.grpc"6\n\x07Message\x12\x0c\n\x04role\x18\x01 \x01(\t\x12\x0f\n\x07\x63ontent\x18\x02 \x01(\t\x12\x0c\n\x04name\x18\x03 \x01(\t"]\n\x13\x43onversationMetrics\x12\x19\n\x11\x63ompletion_tokens\x18\x01 \x01(\x05\x12\x15\n\rprompt_tokens\x18\x02 \x01(\x05\x12\x14\n\x0ctotal_tokens\x18\x03 \x01(\x05"\xf7\x01\n\x13\x43onversationRequest\x12\x10\n\x08\x61gent_id\x18\x01 \x01(\t\x12&\n\x08messages\x18\x02 \x03(\x0b\x32\x14.remote.grpc.Message\x12\x42\n\tvariables\x18\x03 \x03(\x0b\x32/.remote.grpc.ConversationRequest.VariablesEntry\x12\x30\n\rstream_filter\x18\x04 \x01(\x0b\x32\x19.remote.grpc.StreamFilter\x1a\x30\n\x0eVariablesEntry\x12\x0b\n\x03key\x18\x01 \x01(\t\x12\r\n\x05value\x18\x02 \x01(\t:\x02\x38\x01"3\n\x0cStreamFilter\x12\r\n\x05marks\x18\x01 \x03(\t\x12\x14\n\x0c\x64\x65lta_fields\x18\x02 \x03(\t"\xe8\x01\n\x14\x43onversationResponse\x12&\n\x08messages\x18\x01 \x03(\x0b\x32\x14.remote.grpc.Message\x12\x43\n\tvariables\x18\x02 \x03(\x0b\x32\x30.remote.grpc.ConversationResponse.VariablesEntry\x12\x31\n\x07metrics\x18\x03 \x01(\x0b\x32 .remote.grpc.ConversationMetrics\x1a\x30\n\x0eVariablesEntry\x12\x0b\n\x03key\x18\x01 \x01(\t\x12\r\n\x05value\x18\x02 \x01(\t:\x02\x38\x01"V\n\x0b\x41skResponse\x12\x0e\n\x06result\x18\x01 \x01(\t\x12\x37\n\x0c\x63onversation\x18\x02 \x01(\x0b\x32!.remote.grpc.ConversationResponse"#\n\x0f\x44\x65scribeRequest\x12\x10\n\x08\x61gent_id\x18\x01 \x01(\t"3\n\x10\x44\x65scribeResponse\x12\n\n\x02id\x18\x01 \x01(\t\x12\x13\n\x0b\x64\x65scription\x18\x02 \x01(\t"Q\n\x14\x41skStreamingResponse\x12\x0c\n\x04mark\x18\x01 \x01(\t\x12\x0f\n\x07\x63ontent\x18\x02 \x01(\t\x12\n\n\x02id\x18\x03 \x01(\x03\x12\x0e\n\x06run_id\x18\x04 \x01(\t"S\n\rResumeRequest\x12\x10\n\x08\x61gent_id\x18\x01 \x01(\t\x12\x0e\n\x06run_id\x18\x02 \x01(\t\x12\x14\n\x07last_id\x18\x03 \x01(\x03H\x00\x88\x01\x01\x42\n\n\x08_last_id2\xc0\x02\n\rRemoteService\x12\x41\n\x03\x41sk\x12 .remote.grpc.ConversationRequest\x1a\x18.remote.grpc.AskResponse\x12R\n\tAskStream\x12 .remote.grpc.ConversationRequest\x1a!.remote.grpc.AskStreamingResponse0\x01\x12G\n\x08\x44\x65scribe\x12\x1c.remote.grpc.DescribeRequest\x1a\x1d.remote.grpc.DescribeResponse\x12O\n\x0cResumeStream\x12\x1a.remote.grpc.ResumeRequest\x1a!.remote.grpc.AskStreamingResponse0\x01\x62\x06proto3'
 )
 
 _globals = globals()
@@ -36,21 +36,25 @@ if not _descriptor._USE_C_DESCRIPTORS:
     _globals["_CONVERSATIONMETRICS"]._serialized_start = 85
     _globals["_CONVERSATIONMETRICS"]._serialized_end = 178
     _globals["_CONVERSATIONREQUEST"]._serialized_start = 181
-    _globals["_CONVERSATIONREQUEST"]._serialized_end = 378
-    _globals["_CONVERSATIONREQUEST_VARIABLESENTRY"]._serialized_start = 330
-    _globals["_CONVERSATIONREQUEST_VARIABLESENTRY"]._serialized_end = 378
-    _globals["_CONVERSATIONRESPONSE"]._serialized_start = 381
-    _globals["_CONVERSATIONRESPONSE"]._serialized_end = 613
-    _globals["_CONVERSATIONRESPONSE_VARIABLESENTRY"]._serialized_start = 330
-    _globals["_CONVERSATIONRESPONSE_VARIABLESENTRY"]._serialized_end = 378
-    _globals["_ASKRESPONSE"]._serialized_start = 615
-    _globals["_ASKRESPONSE"]._serialized_end = 701
-    _globals["_DESCRIBEREQUEST"]._serialized_start = 703
-    _globals["_DESCRIBEREQUEST"]._serialized_end = 738
-    _globals["_DESCRIBERESPONSE"]._serialized_start = 740
-    _globals["_DESCRIBERESPONSE"]._serialized_end = 791
-    _globals["_ASKSTREAMINGRESPONSE"]._serialized_start = 793
-    _globals["_ASKSTREAMINGRESPONSE"]._serialized_end = 846
-    _globals["_REMOTESERVICE"]._serialized_start = 849
-    _globals["_REMOTESERVICE"]._serialized_end = 1088
+    _globals["_CONVERSATIONREQUEST"]._serialized_end = 428
+    _globals["_CONVERSATIONREQUEST_VARIABLESENTRY"]._serialized_start = 380
+    _globals["_CONVERSATIONREQUEST_VARIABLESENTRY"]._serialized_end = 428
+    _globals["_STREAMFILTER"]._serialized_start = 430
+    _globals["_STREAMFILTER"]._serialized_end = 481
+    _globals["_CONVERSATIONRESPONSE"]._serialized_start = 484
+    _globals["_CONVERSATIONRESPONSE"]._serialized_end = 716
+    _globals["_CONVERSATIONRESPONSE_VARIABLESENTRY"]._serialized_start = 380
+    _globals["_CONVERSATIONRESPONSE_VARIABLESENTRY"]._serialized_end = 428
+    _globals["_ASKRESPONSE"]._serialized_start = 718
+    _globals["_ASKRESPONSE"]._serialized_end = 804
+    _globals["_DESCRIBEREQUEST"]._serialized_start = 806
+    _globals["_DESCRIBEREQUEST"]._serialized_end = 841
+    _globals["_DESCRIBERESPONSE"]._serialized_start = 843
+    _globals["_DESCRIBERESPONSE"]._serialized_end = 894
+    _globals["_ASKSTREAMINGRESPONSE"]._serialized_start = 896
+    _globals["_ASKSTREAMINGRESPONSE"]._serialized_end = 977
+    _globals["_RESUMEREQUEST"]._serialized_start = 979
+    _globals["_RESUMEREQUEST"]._serialized_end = 1062
+    _globals["_REMOTESERVICE"]._serialized_start = 1065
+    _globals["_REMOTESERVICE"]._serialized_end = 1385
 # @@protoc_insertion_point(module_scope)
@@ -55,6 +55,12 @@ class RemoteServiceStub(object):
             response_deserializer=remote__pb2.DescribeResponse.FromString,
             _registered_method=True,
         )
+        self.ResumeStream = channel.unary_stream(
+            "/remote.grpc.RemoteService/ResumeStream",
+            request_serializer=remote__pb2.ResumeRequest.SerializeToString,
+            response_deserializer=remote__pb2.AskStreamingResponse.FromString,
+            _registered_method=True,
+        )
 
 
 class RemoteServiceServicer(object):
@@ -78,6 +84,12 @@ class RemoteServiceServicer(object):
         context.set_details("Method not implemented!")
         raise NotImplementedError("Method not implemented!")
 
+    def ResumeStream(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details("Method not implemented!")
+        raise NotImplementedError("Method not implemented!")
+
 
 def add_RemoteServiceServicer_to_server(servicer, server):
     rpc_method_handlers = {
@@ -96,6 +108,11 @@ def add_RemoteServiceServicer_to_server(servicer, server):
             request_deserializer=remote__pb2.DescribeRequest.FromString,
             response_serializer=remote__pb2.DescribeResponse.SerializeToString,
         ),
+        "ResumeStream": grpc.unary_stream_rpc_method_handler(
+            servicer.ResumeStream,
+            request_deserializer=remote__pb2.ResumeRequest.FromString,
+            response_serializer=remote__pb2.AskStreamingResponse.SerializeToString,
+        ),
     }
     generic_handler = grpc.method_handlers_generic_handler(
         "remote.grpc.RemoteService", rpc_method_handlers
@@ -199,3 +216,33 @@ class RemoteService(object):
             metadata,
             _registered_method=True,
         )
+
+    @staticmethod
+    def ResumeStream(
+        request,
+        target,
+        options=(),
+        channel_credentials=None,
+        call_credentials=None,
+        insecure=False,
+        compression=None,
+        wait_for_ready=None,
+        timeout=None,
+        metadata=None,
+    ):
+        return grpc.experimental.unary_stream(
+            request,
+            target,
+            "/remote.grpc.RemoteService/ResumeStream",
+            remote__pb2.ResumeRequest.SerializeToString,
+            remote__pb2.AskStreamingResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True,
+        )
@@ -0,0 +1,442 @@
+from abc import ABC, abstractmethod
+from collections import Counter
+import re
+import threading
+from typing import Callable, Iterable, NamedTuple, Optional, Union
+
+from .askable import Askable
+from .conversation import Conversation
+from .messages import message_text
+from .tools import tokenize
+
+try:
+    import numpy as np
+except ImportError:
+    # Only the LearnedRouter needs it, with the "semantic" extra
+    np = None
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class TeamRouter(ABC):
+    """Base class for the routers choosing the next agent of a Team without asking the orchestrator LLM.
+
+    A Team asks its routers in order, and the first one returning an agent wins. When
+    none of them does, the orchestrator LLM decides. Routers only choose among the
+    candidates allowed after the current agent, and should return None whenever the
+    choice is not certain.
+    """
+
+    name: str = "router"
+    """The name of the router, logged with its decisions."""
+
+    @abstractmethod
+    def route(
+        self, conversation: Conversation, candidates: list[str]
+    ) -> Optional[str]:
+        """Choose the next agent.
+
+        Args:
+            conversation (Conversation): The conversation of the team.
+            candidates (list[str]): The IDs of the agents allowed to speak next.
+
+        Returns:
+            str: The ID of the next agent, or None to let the next router decide.
+        """
+        pass
+
+
+class TransitionGraphRouter(TeamRouter):
+    """Routes to the only agent allowed after the current one, when the allowed transitions leave a single candidate."""
+
+    name = "transition-graph"
+
+    def route(
+        self, conversation: Conversation, candidates: list[str]
+    ) -> Optional[str]:
+        return candidates[0] if len(candidates) == 1 else None
+
+
+class UserInputRouter(TeamRouter):
+    """Routes user messages to the only candidate handling them, e.g. the front desk agent of a flow."""
+
+    name = "user-input"
+
+    def __init__(self, agents: list[Union[Askable, str]]):
+        """Initialize the UserInputRouter.
+
+        Args:
+            agents (list[Union[Askable, str]]): The agents answering user messages, or their IDs.
+        """
+        self.agents = {
+            agent if isinstance(agent, str) else agent.id for agent in agents
+        }
+
+    def route(
+        self, conversation: Conversation, candidates: list[str]
+    ) -> Optional[str]:
+        if not conversation.messages or conversation.messages[-1]["role"] != "user":
+            return None
+        handling = [candidate for candidate in candidates if candidate in self.agents]
+        return handling[0] if len(handling) == 1 else None
+
+
+# A rule condition: a keyword or regular expression searched in the last message, or a predicate on the conversation
+RuleCondition = Union[str, re.Pattern, Callable[[Conversation], bool]]
+
+
+class RuleRouter(TeamRouter):
+    """Routes with keyword, regular expression or predicate rules, the first matching rule wins.
+
+    Example:
+        RuleRouter([
+            (r"\\b(refund|chargeback)\\b", "billing"),
+            (lambda conversation: "ORDER_ID" not in conversation.variables, "order_lookup"),
+        ])
+    """
+
+    name = "rules"
+
+    def __init__(
+        self,
+        rules: list[tuple[RuleCondition, str]],
+        name: Optional[str] = None,
+    ):
+        """Initialize the RuleRouter.
+
+        Args:
+            rules (list[tuple[RuleCondition, str]]): The (condition, agent ID) rules, in priority order. String conditions are case-insensitive regular expressions searched in the last message text.
+            name (str): The name of the router, logged with its decisions. Optional.
+        """
+        self.rules = [
+            (re.compile(condition, re.IGNORECASE) if isinstance(condition, str) else condition, agent_id)
+            for condition, agent_id in rules
+        ]
+        if name:
+            self.name = name
+
+    def route(
+        self, conversation: Conversation, candidates: list[str]
+    ) -> Optional[str]:
+        text = message_text(conversation.messages[-1]) if conversation.messages else ""
+        for condition, agent_id in self.rules:
+            if agent_id not in candidates:
+                continue
+            if isinstance(condition, re.Pattern):
+                matched = condition.search(text) is not None
+            else:
+                matched = condition(conversation)
+            if matched:
+                logger.debug("Rule matched for agent %s", agent_id)
+                return agent_id
+        return None
+
+
+def routing_examples(
+    conversation: Conversation, team_id: Optional[str] = None
+) -> list[tuple[list[dict], str]]:
+    """Extract the routing decisions of a conversation, from its "team/choice" log events.
+
+    Each decision is paired with the messages preceding the first message of the chosen
+    agent that follows the previous decision. Decisions whose agent never spoke are
+    dropped, as are all the decisions of conversations whose log evicted events.
+    Decisions made by a LearnedRouter are skipped, so a router is never trained on
+    its own predictions.
+
+    Args:
+        conversation (Conversation): The conversation, with its log.
+        team_id (str): The ID of the team whose decisions to extract. Optional, all teams when not provided.
+
+    Returns:
+        list[tuple[list[dict], str]]: The (context messages, chosen agent ID) pairs.
+    """
+    if conversation.log.total > len(conversation.log):
+        # The decisions could no longer be paired with their messages
+        logger.debug("Skipping conversation with evicted log events")
+        return []
+    choices = [
+        event.payload
+        for event in conversation.log.find(kind="team/choice", level="info", source=team_id)
+        if event.payload
+    ]
+    messages, _ = conversation.snapshot()
+    examples = []
+    position = 0
+    for agent_id, *reason in choices:
+        index = next(
+            (
+                i
+                for i in range(position, len(messages))
+                if messages[i].get("name") == agent_id
+            ),
+            None,
+        )
+        if index is None:
+            continue
+        if reason[:1] != [f"router:{LearnedRouter.name}"]:
+            examples.append((messages[:index], agent_id))
+        position = index + 1
+    return examples
+
+
+class LearnedRouterReport(NamedTuple):
+    """The quality and usage statistics of a LearnedRouter.
+
+    Args:
+        examples (int): The number of routing decisions the router was trained on.
+        accuracy (float): The accuracy on the validation decisions, all predictions included.
+        coverage (float): The share of validation decisions predicted with enough confidence to be routed.
+        confident_accuracy (float): The accuracy on the validation decisions predicted with enough confidence.
+        routed (int): The number of decisions served by the router.
+        fallbacks (int): The number of decisions left to the next router or the LLM orchestrator.
+        fallback_rate (float): The share of decisions left to the next router or the LLM orchestrator.
+    """
+
+    examples: int
+    accuracy: float
+    coverage: float
+    confident_accuracy: float
+    routed: int
+    fallbacks: int
+    fallback_rate: float
+
+
+class _RouterModel(NamedTuple):
+    classes: list[str]
+    vocabulary: dict[str, int]
+    idf: np.ndarray
+    weights: np.ndarray
+    bias: np.ndarray
+
+
+class LearnedRouter(TeamRouter):
+    """A router trained from the logged routing decisions of a team, with a TF-IDF and softmax classifier.
+
+    The features are the words of the latest messages and the name of the latest
+    speaker. Decisions are served in microseconds when the most likely allowed
+    candidate is confident enough among all the known agents; otherwise the next router
+    or the LLM orchestrator decides. Place it after the deterministic routers.
+
+    Example:
+        router = LearnedRouter(threshold=0.9)
+        router.fit(logged_conversations, team_id="call-center")
+        print(router.report())
+        team = Team(..., routers=[TransitionGraphRouter(), router])
+    """
+
+    name = "learned"
+
+    def __init__(
+        self,
+        threshold: float = 0.9,
+        history: int = 2,
+        epochs: int = 300,
+        learning_rate: float = 2.0,
+        l2: float = 1e-4,
+    ):
+        """Initialize the LearnedRouter. Requires the "semantic" extra (numpy).
+
+        Args:
+            threshold (float): The minimum probability of a prediction to be routed.
+            history (int): The number of latest messages used as features.
+            epochs (int): The number of gradient descent steps of the training.
+            learning_rate (float): The gradient descent step size.
+            l2 (float): The L2 regularization of the weights.
+        """
+        if np is None:
+            raise ImportError('LearnedRouter requires numpy, install the "semantic" extra')
+        self.threshold = threshold
+        self.history = history
+        self.epochs = epochs
+        self.learning_rate = learning_rate
+        self.l2 = l2
+        self.examples = 0
+        self.accuracy = 0.0
+        self.coverage = 0.0
+        self.confident_accuracy = 0.0
+        self.routed = 0
+        self.fallbacks = 0
+        # Replaced as a whole, so decisions are never served by a partially trained model
+        self._model = None
+        self._lock = threading.Lock()
+
+    @property
+    def fitted(self) -> bool:
+        return self._model is not None
+
+    @property
+    def classes(self) -> list[str]:
+        return self._model.classes if self._model is not None else []
+
+    def fit(
+        self,
+        conversations: Iterable[Conversation],
+        team_id: Optional[str] = None,
+        validation: float = 0.2,
+        seed: int = 0,
+    ) -> LearnedRouterReport:
+        """Train the router on the routing decisions logged in the given conversations.
+
+        A share of the decisions is held out to measure the accuracy, then the router is
+        trained again on all of them.
+
+        Args:
+            conversations (Iterable[Conversation]): The conversations, with their logs.
+            team_id (str): The ID of the team whose decisions to learn. Optional, all teams when not provided.
+            validation (float): The share of decisions held out to measure the accuracy.
+            seed (int): The seed of the validation split.
+        """
+        features, labels = [], []
+        for conversation in conversations:
+            for messages, agent_id in routing_examples(conversation, team_id):
+                features.append(self._features(messages))
+                labels.append(agent_id)
+        if not labels:
+            raise ValueError("No routing decisions found to train on")
+
+        order = np.random.default_rng(seed).permutation(len(labels))
+        held_out = int(len(labels) * validation)
+        if held_out > 0:
+            train, test = order[held_out:], order[:held_out]
+            model = self._train([features[i] for i in train], [labels[i] for i in train])
+            probabilities = _softmax(
+                _vectorize(model, [features[i] for i in test]) @ model.weights
+                + model.bias
+            )
+            predicted = [model.classes[i] for i in probabilities.argmax(axis=1)]
+            correct = np.array([p == labels[i] for p, i in zip(predicted, test)])
+            confident = probabilities.max(axis=1) >= self.threshold
+            self.accuracy = float(correct.mean())
+            self.coverage = float(confident.mean())
+            self.confident_accuracy = (
+                float(correct[confident].mean()) if confident.any() else 0.0
+            )
+
+        self._model = self._train(features, labels)
+        self.examples = len(labels)
+        logger.info(
+            "Trained router on %d decisions: accuracy %.3f, coverage %.3f, confident accuracy %.3f",
+            self.examples,
+            self.accuracy,
+            self.coverage,
+            self.confident_accuracy,
+        )
+        return self.report()
+
+    def predict(
+        self, conversation: Conversation, candidates: Optional[list[str]] = None
+    ) -> tuple[Optional[str], float]:
+        """Predict the next agent among the candidates, with its probability among all the known agents.
+
+        The probability is not renormalized over the candidates, so it stays comparable
+        to the threshold and to the validation coverage measured by fit.
+
+        Returns:
+            tuple[str, float]: The predicted agent ID and its probability, or (None, 0.0) if no candidate is known.
+        """
+        model = self._model
+        if model is None:
+            return None, 0.0
+        probabilities = _predict_one(model, self._features(conversation.messages))
+        if candidates is not None:
+            known = [i for i, agent_id in enumerate(model.classes) if agent_id in candidates]
+            if not known:
+                return None, 0.0
+            best = known[int(probabilities[known].argmax())]
+            return model.classes[best], float(probabilities[best])
+        best = int(probabilities.argmax())
+        return model.classes[best], float(probabilities[best])
+
+    def route(
+        self, conversation: Conversation, candidates: list[str]
+    ) -> Optional[str]:
+        agent_id, probability = self.predict(conversation, candidates)
+        routed = agent_id is not None and probability >= self.threshold
+        with self._lock:
+            if routed:
+                self.routed += 1
+            else:
+                self.fallbacks += 1
+        logger.debug("Predicted agent %s with probability %.3f", agent_id, probability)
+        return agent_id if routed else None
+
+    def report(self) -> LearnedRouterReport:
+        """Get the validation accuracy and the fallback rate of the router."""
+        with self._lock:
+            routed, fallbacks = self.routed, self.fallbacks
+        total = routed + fallbacks
+        return LearnedRouterReport(
+            examples=self.examples,
+            accuracy=self.accuracy,
+            coverage=self.coverage,
+            confident_accuracy=self.confident_accuracy,
+            routed=routed,
+            fallbacks=fallbacks,
+            fallback_rate=fallbacks / total if total else 0.0,
+        )
+
+    def _features(self, messages: list[dict]) -> Counter:
+        terms = Counter()
+        for message in messages[-self.history :]:
+            terms.update(tokenize(message_text(message)))
+        if messages:
+            speaker = messages[-1].get("name") or messages[-1].get("role")
+            terms[f"__speaker__{speaker}"] += 1
+        return terms
+
+    def _train(self, features: list[Counter], labels: list[str]) -> _RouterModel:
+        classes = sorted(set(labels))
+        document_frequency = Counter()
+        for terms in features:
+            document_frequency.update(terms.keys())
+        vocabulary = {term: i for i, term in enumerate(sorted(document_frequency))}
+        frequencies = np.array(
+            [document_frequency[term] for term in vocabulary], dtype=np.float32
+        )
+        idf = np.log((1 + len(features)) / (1 + frequencies)) + 1
+        model = _RouterModel(classes, vocabulary, idf, None, None)
+
+        x = _vectorize(model, features)
+        y = np.zeros((len(labels), len(classes)), dtype=np.float32)
+        y[np.arange(len(labels)), [classes.index(label) for label in labels]] = 1.0
+        weights = np.zeros((x.shape[1], len(classes)), dtype=np.float32)
+        bias = np.zeros(len(classes), dtype=np.float32)
+        # Full batch gradient descent of the cross-entropy loss
+        for _ in range(self.epochs):
+            error = (_softmax(x @ weights + bias) - y) / len(labels)
+            weights -= self.learning_rate * (x.T @ error + self.l2 * weights)
+            bias -= self.learning_rate * error.sum(axis=0)
+        return model._replace(weights=weights, bias=bias)
+
+
+def _vectorize(model: _RouterModel, features: list[Counter]) -> np.ndarray:
+    matrix = np.zeros((len(features), len(model.vocabulary)), dtype=np.float32)
+    for row, terms in enumerate(features):
+        for term, count in terms.items():
+            column = model.vocabulary.get(term)
+            if column is not None:
+                matrix[row, column] = count
+    matrix *= model.idf
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def _predict_one(model: _RouterModel, terms: Counter) -> np.ndarray:
+    # Only the rows of the known terms are read, so serving does not depend on the vocabulary size
+    columns = [model.vocabulary[term] for term in terms if term in model.vocabulary]
+    if not columns:
+        return _softmax(model.bias[None, :])[0]
+    values = np.array(
+        [count for term, count in terms.items() if term in model.vocabulary],
+        dtype=np.float32,
+    ) * model.idf[columns]
+    values /= np.linalg.norm(values)
+    return _softmax((values @ model.weights[columns] + model.bias)[None, :])[0]
+
+
+def _softmax(scores: np.ndarray) -> np.ndarray:
+    exponentials = np.exp(scores - scores.max(axis=1, keepdims=True))
+    return exponentials / exponentials.sum(axis=1, keepdims=True)
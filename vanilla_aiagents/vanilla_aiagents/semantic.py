@@ -0,0 +1,377 @@
+import hashlib
+import re
+import threading
+import weakref
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+import numpy as np
+
+from .conversation import Conversation, ConversationReadingStrategy
+from .messages import message_text
+from .tools import ToolSelector, tokenize, tool_name, tool_text
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+_TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+
+class Embedder(ABC):
+    """Base class for text embedders."""
+
+    @abstractmethod
+    def embed(self, texts: list[str]) -> np.ndarray:
+        """Embed the given texts.
+
+        Args:
+            texts (list[str]): The texts to embed.
+
+        Returns:
+            np.ndarray: A (len(texts), dim) float32 matrix, one row per text.
+        """
+        pass
+
+
+class HashingEmbedder(Embedder):
+    """A local, dependency-free embedder based on the hashing trick.
+
+    Words and word bigrams are hashed into a fixed number of buckets, with sublinear
+    term frequency weighting. Runs offline and is deterministic across processes.
+    """
+
+    def __init__(self, dim: int = 512, bigrams: bool = True):
+        """Initialize the HashingEmbedder.
+
+        Args:
+            dim (int): The number of hash buckets, i.e. the embedding dimension.
+            bigrams (bool): Whether to include word bigrams as features.
+        """
+        self.dim = dim
+        self.bigrams = bigrams
+
+    def _bucket(self, token: str) -> tuple[int, float]:
+        digest = hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest()
+        value = int.from_bytes(digest, "little")
+        # Lowest bit decides the sign, to reduce the bias of bucket collisions
+        return (value >> 1) % self.dim, 1.0 if value & 1 else -1.0
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            tokens = _TOKEN_PATTERN.findall(text.lower())
+            features = tokens
+            if self.bigrams:
+                features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+            for feature in features:
+                index, sign = self._bucket(feature)
+                matrix[row, index] += sign
+        # Sublinear term frequency, keeping the sign of each bucket
+        return np.sign(matrix) * np.log1p(np.abs(matrix))
+
+
+class AzureOpenAIEmbedder(Embedder):
+    """An embedder using an Azure OpenAI embeddings deployment.
+
+    Args:
+    - config: dict with the following
+        - azure_deployment: str, Azure embeddings deployment name
+        - azure_endpoint: str, Azure endpoint
+        - api_key: str, Azure API key. Leave empty if using Azure AD token provider
+        - api_version: str, API version
+    """
+
+    def __init__(self, config: dict):
+        """Initialize the AzureOpenAIEmbedder.
+
+        Args:
+            config (dict): The configuration for the client.
+        """
+        from openai import AzureOpenAI
+        from azure.identity import DefaultAzureCredential, get_bearer_token_provider
+
+        self.config = config
+        api_key = config.get("api_key")
+        token_provider = (
+            get_bearer_token_provider(
+                DefaultAzureCredential(), "https://cognitiveservices.azure.com/.default"
+            )
+            if api_key is None or api_key == ""
+            else None
+        )
+        self.client = AzureOpenAI(
+            azure_deployment=config["azure_deployment"],
+            api_key=api_key,
+            azure_endpoint=config["azure_endpoint"],
+            api_version=config["api_version"],
+            azure_ad_token_provider=token_provider,
+        )
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        # Empty strings are rejected by the API, replace them with a single space
+        response = self.client.embeddings.create(
+            input=[text or " " for text in texts],
+            model=self.config["azure_deployment"],
+        )
+        return np.array([item.embedding for item in response.data], dtype=np.float32)
+
+
+class VectorIndex:
+    """An in-memory vector index, storing L2-normalized rows in a growable NumPy matrix.
+
+    Rows are appended incrementally, and searched by cosine similarity.
+    """
+
+    def __init__(self, dim: Optional[int] = None, initial_capacity: int = 64):
+        """Initialize the VectorIndex.
+
+        Args:
+            dim (int): The vector dimension. Optional, inferred from the first added vectors.
+            initial_capacity (int): The number of rows to preallocate.
+        """
+        self.dim = dim
+        self._capacity = initial_capacity
+        self._matrix = None
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def vectors(self) -> np.ndarray:
+        """The normalized vectors currently stored in the index."""
+        if self._matrix is None:
+            return np.zeros((0, self.dim or 0), dtype=np.float32)
+        return self._matrix[: self._size]
+
+    def add(self, vectors: np.ndarray):
+        """Append vectors to the index, growing the underlying matrix when needed."""
+        vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+        if len(vectors) == 0:
+            return
+        if self._matrix is None:
+            self.dim = self.dim or vectors.shape[1]
+            self._matrix = np.zeros(
+                (max(self._capacity, len(vectors)), self.dim), dtype=np.float32
+            )
+
+        required = self._size + len(vectors)
+        if required > len(self._matrix):
+            grown = np.zeros(
+                (max(required, 2 * len(self._matrix)), self.dim), dtype=np.float32
+            )
+            grown[: self._size] = self._matrix[: self._size]
+            self._matrix = grown
+
+        self._matrix[self._size : required] = _normalize(vectors)
+        self._size = required
+
+    def truncate(self, size: int):
+        """Drop all the rows after the given size."""
+        self._size = min(self._size, size)
+
+    def search(
+        self, query: np.ndarray, k: int, candidates: Optional[np.ndarray] = None
+    ) -> list[tuple[int, float]]:
+        """Find the k rows most similar to the query.
+
+        Args:
+            query (np.ndarray): The query vector.
+            k (int): The number of results to return.
+            candidates (np.ndarray): Optional row indexes to restrict the search to.
+
+        Returns:
+            list[tuple[int, float]]: The (row, cosine similarity) pairs, best first.
+        """
+        if self._size == 0 or k <= 0:
+            return []
+        query = _normalize(np.atleast_2d(np.asarray(query, dtype=np.float32)))[0]
+        rows = (
+            np.arange(self._size)
+            if candidates is None
+            else np.asarray(candidates, dtype=np.int64)
+        )
+        if len(rows) == 0:
+            return []
+        scores = self._matrix[rows] @ query
+        k = min(k, len(rows))
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best], kind="stable")]
+        return [(int(rows[i]), float(scores[i])) for i in best]
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class _ConversationIndex:
+    """Embeddings of the messages of a single conversation, in message order."""
+
+    def __init__(self):
+        self.index = VectorIndex()
+        # Generation of the embedded messages, see `Conversation.snapshot_messages`
+        self.generation = None
+        self.lock = threading.Lock()
+
+
+class SemanticRelevanceStrategy(ConversationReadingStrategy):
+    """A conversation reading strategy that selects the messages most relevant to the latest user turn.
+
+    Messages are embedded incrementally as they are appended to the conversation, and
+    the top K messages by cosine similarity to the latest user message are returned
+    along with the last N messages, preserving the conversation order. Embeddings are
+    also cached by message content, so rewritten histories and the conversations
+    derived from another one (e.g. forks, pipeline stages) only embed their new messages.
+    """
+
+    def __init__(
+        self,
+        k: int,
+        n: int,
+        embedder: Embedder = None,
+        min_similarity: float = 0.0,
+        cache_size: int = 10000,
+    ):
+        """Initialize the SemanticRelevanceStrategy.
+
+        Args:
+            k (int): The number of most relevant messages to read, besides the last N.
+            n (int): The number of last messages to always read.
+            embedder (Embedder): The embedder to use. Optional, defaults to a local HashingEmbedder.
+            min_similarity (float): The minimum cosine similarity for a message to be considered relevant.
+            cache_size (int): The maximum number of message embeddings cached by content.
+        """
+        self.k = k
+        self.n = n
+        self.embedder = embedder or HashingEmbedder()
+        self.min_similarity = min_similarity
+        self.cache_size = cache_size
+        self._indexes = weakref.WeakKeyDictionary()
+        self._embeddings = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_messages(self, conversation: Conversation) -> list[dict]:
+        messages, (generation, _) = conversation.snapshot_messages()
+        messages = self.exclude_system_messages(messages)
+        if len(messages) <= self.k + self.n:
+            return messages
+
+        query = next(
+            (m for m in reversed(messages) if m["role"] == "user"), messages[-1]
+        )
+        tail_start = len(messages) - self.n if self.n > 0 else len(messages)
+        query_vector = self._embed([query])[0]
+
+        state = self._state(conversation)
+        with state.lock:
+            self._sync_index(state, messages, generation)
+            hits = state.index.search(
+                query_vector, self.k, candidates=np.arange(tail_start)
+            )
+
+        selected = sorted(
+            row for row, score in hits if score > self.min_similarity
+        ) + list(range(tail_start, len(messages)))
+        logger.debug(
+            "Selected %d relevant messages out of %d", len(selected), len(messages)
+        )
+        return [messages[i] for i in selected]
+
+    def _state(self, conversation: Conversation) -> _ConversationIndex:
+        with self._lock:
+            state = self._indexes.get(conversation)
+            if state is None:
+                state = _ConversationIndex()
+                self._indexes[conversation] = state
+            return state
+
+    def _sync_index(self, state: _ConversationIndex, messages: list[dict], generation: int):
+        # Appends keep the generation, so only the new messages are embedded
+        size = len(state.index)
+        if state.generation != generation or size > len(messages):
+            logger.debug("Messages were rewritten, rebuilding the index")
+            state.index.truncate(0)
+            state.generation = generation
+            size = 0
+        if size < len(messages):
+            state.index.add(self._embed(messages[size:]))
+
+    def _embed(self, messages: list[dict]) -> np.ndarray:
+        digests = [_digest(message) for message in messages]
+        with self._lock:
+            vectors = {d: self._embeddings.get(d) for d in digests}
+        missing = {
+            d: message
+            for d, message in zip(digests, messages)
+            if vectors[d] is None
+        }
+        if missing:
+            embedded = self.embedder.embed([message_text(m) for m in missing.values()])
+            vectors.update(zip(missing, embedded))
+        with self._lock:
+            for d in digests:
+                self._embeddings[d] = vectors[d]
+                self._embeddings.move_to_end(d)
+            while len(self._embeddings) > self.cache_size:
+                self._embeddings.popitem(last=False)
+        return np.stack([vectors[d] for d in digests])
+
+
+def _digest(message: dict) -> bytes:
+    h = hashlib.blake2b(digest_size=16)
+    for part in (message.get("role"), message.get("name"), message_text(message)):
+        h.update(str(part).encode("utf-8"))
+        h.update(b"\0")
+    return h.digest()
+
+
+class EmbeddingToolSelector(ToolSelector):
+    """A tool selector ranking tools by cosine similarity between their embedded descriptions and the query.
+
+    Each tool is embedded once, when registered, into an in-memory vector index.
+    """
+
+    def __init__(
+        self,
+        top_k: int = 5,
+        pinned: Optional[list[str]] = None,
+        embedder: Embedder = None,
+        min_similarity: float = 0.0,
+    ):
+        """Initialize the EmbeddingToolSelector.
+
+        Args:
+            top_k (int): The number of most relevant tools to select, besides the pinned ones.
+            pinned (list[str]): The names of the tools always selected. Optional.
+            embedder (Embedder): The embedder to use. Optional, defaults to a local HashingEmbedder.
+            min_similarity (float): The minimum cosine similarity for a tool to be considered relevant.
+        """
+        super().__init__(top_k=top_k, pinned=pinned)
+        self.embedder = embedder or HashingEmbedder()
+        self.min_similarity = min_similarity
+        self._names = []
+        self._index = VectorIndex()
+        self._lock = threading.Lock()
+
+    def add(self, tools: list[dict]):
+        if not tools:
+            return
+        vectors = self.embedder.embed([tool_text(tool) for tool in tools])
+        with self._lock:
+            self._index.add(vectors)
+            self._names.extend(tool_name(tool) for tool in tools)
+
+    def rank(self, query: str, k: int) -> list[tuple[str, float]]:
+        query_vector = self.embedder.embed([query])[0]
+        with self._lock:
+            hits = self._index.search(query_vector, k)
+            return [
+                (self._names[row], score)
+                for row, score in hits
+                if score > self.min_similarity
+            ]
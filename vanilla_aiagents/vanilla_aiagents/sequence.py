@@ -46,6 +46,15 @@ class Sequence(Askable):
         if stream:
             conversation.update(["start", self.id])
         for step in self.steps:
+            if conversation.cancellation.cancelled:
+                logger.debug("[Sequence %s] cancelled, ending workflow.", self.id)
+                conversation.log.append(("info", "sequence/cancelled", self.id))
+                execution_result = "cancelled"
+                break
+            if conversation.deadline_exceeded:
+                execution_result = self._deadline_exceeded(conversation)
+                break
+
             agent_result = step.ask(conversation, stream=stream)
             logger.debug(
                 "[Sequence %s] asked step '%s' with messages: %s",
@@ -66,8 +75,21 @@ class Sequence(Askable):
                 )
                 execution_result = "agent-error"
                 break
+            elif agent_result == "cancelled":
+                logger.debug("[Sequence %s] cancelled, ending workflow.", self.id)
+                conversation.log.append(("info", "sequence/cancelled", self.id))
+                execution_result = "cancelled"
+                break
+            elif agent_result == "deadline-exceeded":
+                execution_result = self._deadline_exceeded(conversation)
+                break
 
         if stream:
             conversation.update(["end", self.id])
 
         return execution_result
+
+    def _deadline_exceeded(self, conversation: Conversation) -> str:
+        logger.debug("[Sequence %s] deadline exceeded, ending workflow.", self.id)
+        conversation.log.append(("info", "sequence/deadline-exceeded", self.id))
+        return "deadline-exceeded"
@@ -0,0 +1,486 @@
+import asyncio
+from concurrent.futures import Executor, ThreadPoolExecutor
+import queue
+import threading
+import time
+import uuid
+from typing import Any, Callable, Optional
+
+from pydantic import BaseModel
+
+from .askable import Askable
+from .conversation import Conversation
+from .events import EventBus, EventBusClosed, ReplayChannel, StreamChannel, Subscription
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Private mark signalling the askable completed, never yielded to consumers
+_DONE = "__done__"
+
+# Marks delivered regardless of any filter, since consumers rely on them to complete
+_UNFILTERED_MARKS = frozenset(["error", "result", _DONE])
+
+
+class StreamFilter(BaseModel):
+    """Selects the stream updates delivered to a consumer, and the delta fields they carry.
+
+    Updates are filtered before being queued, so unwanted updates are never
+    serialized. "error" and "result" updates are always delivered.
+
+    Example:
+        # Only text deltas, carrying just their content
+        StreamFilter(marks=["delta"], delta_fields=["content"])
+    """
+
+    marks: Optional[list[str]] = None
+    """The marks to deliver, e.g. "delta", "function_result" or "start". Optional, all marks when not provided."""
+    delta_fields: Optional[list[str]] = None
+    """The fields to keep in "delta" updates, e.g. "content". Deltas with none of these fields set are dropped. Optional, all fields when not provided."""
+
+    def apply(self, update: list) -> Optional[list]:
+        """Apply the filter to an update, returning the projected update or None if it must be dropped."""
+        mark, content = update
+        if mark in _UNFILTERED_MARKS:
+            return update
+        if self.marks is not None and mark not in self.marks:
+            return None
+        if mark == "delta" and self.delta_fields is not None and isinstance(content, dict):
+            content = {
+                field: content[field]
+                for field in self.delta_fields
+                if content.get(field) is not None
+            }
+            if not content:
+                return None
+            return [mark, content]
+        return update
+
+
+class StreamSession:
+    """A streaming run of an askable, with a deterministic end.
+
+    The askable is asked in a background thread, while the conversation updates are
+    yielded to the consumer. When the askable returns (or fails), a completion
+    sentinel closes the stream, so consumers no longer need to count start/end
+    marks. A timeout bounds the wait for each update, and the session can be
+    cancelled by the consumer at any time.
+
+    Sessions can also be iterated with `async for`: the askable then runs in a
+    dedicated thread pool, and updates are awaited without blocking the loop. The pool
+    is sized independently of the event loop default executor, so long-running askables
+    do not starve other `run_in_executor` calls; sessions started while all its
+    threads are busy wait for one to be available.
+
+    Example:
+        session = StreamSession(askable, conversation, timeout=60)
+        for mark, content in session:
+            ...
+        print(session.result)
+    """
+
+    _default_executor = None
+    _default_lock = threading.Lock()
+    # The size of the pool shared by the sessions with no executor, read on first use
+    default_max_workers = 32
+
+    def __init__(
+        self,
+        askable: Askable,
+        conversation: Conversation,
+        timeout: Optional[float] = None,
+        stream_filter: Optional[StreamFilter] = None,
+        executor: Optional[Executor] = None,
+    ):
+        """Initialize the StreamSession.
+
+        Args:
+            askable (Askable): The askable to run.
+            conversation (Conversation): The conversation to use for the execution.
+            timeout (float): The maximum time to wait for the next update, in seconds. Optional, waits indefinitely when not provided.
+            stream_filter (StreamFilter): The filter selecting the updates to deliver. Optional, all updates are delivered when not provided.
+            executor (Executor): The executor running the askable when iterated asynchronously. Optional, a pool shared by all sessions when not provided.
+        """
+        self.askable = askable
+        self.conversation = conversation
+        self.timeout = timeout
+        self.stream_filter = stream_filter
+        self.executor = executor
+        self.result = None
+        self.cancelled = False
+        self.done = threading.Event()
+        self.channel = None
+        self._started = False
+
+    def _open_channel(self, bus: Optional[EventBus] = None) -> bool:
+        if self._started:
+            return False
+        self._started = True
+        # Each session gets its own channel, so closing it does not affect later runs
+        current = self.conversation.stream_channel
+        transform = self.stream_filter.apply if self.stream_filter else None
+        if bus is not None:
+            self.channel = ReplayChannel(
+                bus, maxsize=current.maxsize, policy=current.policy, transform=transform
+            )
+        else:
+            self.channel = StreamChannel(
+                maxsize=current.maxsize, policy=current.policy, transform=transform
+            )
+        self.conversation.stream_channel = self.channel
+        return True
+
+    def start(self) -> "StreamSession":
+        """Start asking the askable in a background thread. Called implicitly when iterating."""
+        if self._open_channel():
+            threading.Thread(target=self._run, daemon=True).start()
+        return self
+
+    def astart(self) -> "StreamSession":
+        """Start asking the askable in the session executor. Called implicitly when iterating asynchronously."""
+        if self._open_channel():
+            executor = self.executor or StreamSession.default_executor()
+            asyncio.get_running_loop().run_in_executor(executor, self._run)
+        return self
+
+    @classmethod
+    def default_executor(cls) -> Executor:
+        """Get the thread pool shared by the sessions iterated asynchronously with no executor."""
+        with cls._default_lock:
+            if cls._default_executor is None:
+                cls._default_executor = ThreadPoolExecutor(
+                    max_workers=cls.default_max_workers, thread_name_prefix="stream"
+                )
+            return cls._default_executor
+
+    def _run(self):
+        try:
+            self._ask()
+        finally:
+            self.channel.put([_DONE, self.result])
+
+    def _ask(self):
+        result = None
+        try:
+            result = self.askable.ask(self.conversation, stream=True)
+        except Exception as e:
+            logger.error("Error during askable.ask: %s", e, exc_info=True)
+            self.conversation.update(["error", str(e)])
+            result = "error"
+        finally:
+            logger.debug("Stream session completed with result: %s", result)
+            if self.result is None:
+                self.result = result
+            self.done.set()
+
+    def __iter__(self):
+        self.start()
+        try:
+            while not self.cancelled:
+                try:
+                    mark, content = self.channel.get(timeout=self.timeout)
+                except queue.Empty:
+                    logger.error("Stream timed out after %s seconds", self.timeout)
+                    self.result = "timeout"
+                    self.cancel("timeout")
+                    yield ["error", f"Stream timed out after {self.timeout} seconds"]
+                    return
+                except EventBusClosed:
+                    return
+
+                if mark == _DONE:
+                    return
+                yield [mark, content]
+        finally:
+            # The consumer went away before completion, stop buffering updates for it
+            if not self.done.is_set():
+                self.cancel()
+
+    async def _aiterate(self):
+        self.astart()
+        try:
+            while not self.cancelled:
+                try:
+                    mark, content = await self.channel.aget(timeout=self.timeout)
+                except queue.Empty:
+                    logger.error("Stream timed out after %s seconds", self.timeout)
+                    self.result = "timeout"
+                    self.cancel("timeout")
+                    yield ["error", f"Stream timed out after {self.timeout} seconds"]
+                    return
+                except EventBusClosed:
+                    return
+
+                if mark == _DONE:
+                    return
+                yield [mark, content]
+        finally:
+            if not self.done.is_set():
+                self.cancel()
+
+    def __aiter__(self):
+        return self._aiterate()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Wait for the askable to complete, returning whether it did."""
+        return self.done.wait(timeout)
+
+    def cancel(self, reason: str = "cancelled"):
+        """Cancel the session: stop streaming, discard any further update and cancel the askable run.
+
+        Args:
+            reason (str): The reason of the cancellation.
+        """
+        if not self.cancelled:
+            logger.debug("Cancelling stream session: %s", reason)
+            self.cancelled = True
+            if self.channel is not None:
+                self.channel.close()
+            self.conversation.cancellation.cancel(reason)
+
+
+class StreamRun:
+    """A streaming run whose updates are numbered and retained for replay.
+
+    The askable runs in a single background thread, publishing its updates straight
+    into a replay buffer, so the run keeps going when a consumer disconnects. Every
+    update gets a monotonically increasing ID (its sequence number in the buffer), and
+    consumers can subscribe again after the last ID they received to catch up. The run
+    ends with a "result" update, built by the `finalize` function when provided.
+
+    The stream policy of the session conversation applies to the slowest subscribed
+    consumer (see `ReplayChannel`), so consumers never miss an update. Subscribing
+    after updates were evicted from the buffer raises EventGap.
+
+    When the last consumer unsubscribes before the run ended, the run is cancelled
+    after a grace period, unless a consumer subscribes again in the meantime.
+    """
+
+    def __init__(
+        self,
+        session: StreamSession,
+        finalize: Optional[Callable[[StreamSession], Any]] = None,
+        run_id: Optional[str] = None,
+        capacity: int = 10000,
+        disconnect_grace: Optional[float] = 10,
+    ):
+        """Initialize the StreamRun.
+
+        Args:
+            session (StreamSession): The session to run. Its timeout bounds the wait of the consumers for the next update.
+            finalize (Callable): A function building the content of the final "result" update from the completed session. Optional, the session result when not provided.
+            run_id (str): The ID of the run. Optional, a random ID when not provided.
+            capacity (int): The maximum number of updates retained for replay.
+            disconnect_grace (float): How long to wait for a consumer to resume before cancelling an abandoned run, in seconds. Optional, abandoned runs are never cancelled when None.
+        """
+        self.session = session
+        self.finalize = finalize
+        self.run_id = run_id or uuid.uuid4().hex
+        self.events = EventBus(capacity)
+        self.disconnect_grace = disconnect_grace
+        self.started_at = time.monotonic()
+        self.finished_at = None
+        self._subscribers = 0
+        self._abandon_timer = None
+        self._done_callbacks = []
+        self._lock = threading.Lock()
+
+    def start(self) -> "StreamRun":
+        """Start asking the askable in a background thread, publishing its updates into the replay buffer."""
+        if self.session._open_channel(self.events):
+            threading.Thread(target=self._run, daemon=True).start()
+        return self
+
+    def _run(self):
+        try:
+            self.session._ask()
+            result = (
+                self.finalize(self.session)
+                if self.finalize is not None
+                else self.session.result
+            )
+            self.events.publish(["result", result], max_lag=self.events.capacity)
+        except Exception as e:
+            logger.error("Error during stream run %s: %s", self.run_id, e, exc_info=True)
+            self.events.publish(["error", str(e)], max_lag=self.events.capacity)
+        finally:
+            with self._lock:
+                self.finished_at = time.monotonic()
+                if self._abandon_timer is not None:
+                    self._abandon_timer.cancel()
+                callbacks = self._done_callbacks
+                self._done_callbacks = []
+            self.events.close()
+            for callback in callbacks:
+                callback(self)
+
+    @property
+    def done(self) -> bool:
+        return self.finished_at is not None
+
+    def add_done_callback(self, callback: Callable[["StreamRun"], None]):
+        """Call a function with the run once it ended, right away if it already did."""
+        with self._lock:
+            if not self.done:
+                self._done_callbacks.append(callback)
+                return
+        callback(self)
+
+    def subscribe(self, last_id: Optional[int] = None) -> Subscription:
+        """Subscribe to the run updates, as (id, update) pairs.
+
+        Args:
+            last_id (int): The ID of the last update already received, to resume right after it. Optional, from the first update when not provided.
+
+        Raises:
+            EventGap: if updates after the last ID were already evicted from the replay buffer.
+        """
+        subscription = self.events.subscribe(
+            after=last_id if last_id is not None else -1, strict=True
+        )
+        with self._lock:
+            self._subscribers += 1
+            if self._abandon_timer is not None:
+                self._abandon_timer.cancel()
+                self._abandon_timer = None
+        return subscription
+
+    def read(self, subscription: Subscription) -> tuple[int, list]:
+        """Get the next (id, update) pair of a subscription, timing the run out when no update is published within the session timeout.
+
+        Raises:
+            EventBusClosed: if the run ended and all its updates were read.
+        """
+        while True:
+            try:
+                return subscription.get(timeout=self.session.timeout)
+            except queue.Empty:
+                self._time_out()
+
+    async def aread(self, subscription: Subscription) -> tuple[int, list]:
+        """Like `read`, without blocking the event loop."""
+        while True:
+            try:
+                return await subscription.aget(timeout=self.session.timeout)
+            except queue.Empty:
+                self._time_out()
+
+    def _time_out(self):
+        with self._lock:
+            if self.done or self.session.cancelled:
+                return
+            logger.error("Stream run %s timed out after %s seconds", self.run_id, self.session.timeout)
+            self.session.result = "timeout"
+        # The askable winds down in the background, then the result is published
+        self.events.publish(["error", f"Stream timed out after {self.session.timeout} seconds"])
+        self.session.cancel("timeout")
+
+    def unsubscribe(self, subscription: Subscription):
+        """Close a subscription, scheduling the cancellation of the run if it was the last one."""
+        subscription.close()
+        with self._lock:
+            self._subscribers -= 1
+            if self._subscribers > 0 or self.done or self.disconnect_grace is None:
+                return
+            logger.debug(
+                "Stream run %s abandoned, cancelling in %s seconds",
+                self.run_id,
+                self.disconnect_grace,
+            )
+            self._abandon_timer = threading.Timer(
+                self.disconnect_grace, self.cancel, args=("client-disconnected",)
+            )
+            self._abandon_timer.daemon = True
+            self._abandon_timer.start()
+
+    def cancel(self, reason: str = "cancelled"):
+        """Cancel the run, stopping the askable as soon as possible."""
+        if not self.done:
+            logger.info("Cancelling stream run %s: %s", self.run_id, reason)
+            self.session.cancel(reason)
+
+
+class StreamRegistry:
+    """A registry of the streaming runs of a host, retaining each run for a while after it ended so clients can resume it.
+
+    Expired runs are evicted when a run ends, and by a background sweep every `sweep_interval` seconds.
+    Runs lasting longer than `max_duration` are cancelled, and evicted after the TTL even if the askable ignores the cancellation.
+    """
+
+    def __init__(
+        self,
+        ttl: float = 300,
+        max_duration: Optional[float] = 3600,
+        sweep_interval: Optional[float] = None,
+    ):
+        """Initialize the StreamRegistry.
+
+        Args:
+            ttl (float): How long a run is retained after it ended, in seconds.
+            max_duration (float): How long a run can last before being cancelled, in seconds. Optional, runs are never cancelled when None.
+            sweep_interval (float): How often expired runs are evicted in the background, in seconds. Optional, the TTL (at most a minute) when not provided.
+        """
+        self.ttl = ttl
+        self.max_duration = max_duration
+        self.sweep_interval = sweep_interval or min(max(ttl, 0.01), 60)
+        self._runs: dict[str, StreamRun] = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._sweeper = None
+
+    def add(self, run: StreamRun):
+        """Add a run to the registry."""
+        with self._lock:
+            self._evict_expired()
+            self._runs[run.run_id] = run
+            if self._sweeper is None:
+                self._sweeper = threading.Thread(target=self._sweep, daemon=True)
+                self._sweeper.start()
+        run.add_done_callback(lambda _: self.evict_expired())
+
+    def get(self, run_id: str, askable_id: Optional[str] = None) -> Optional[StreamRun]:
+        """Get a run by ID, if still retained.
+
+        Args:
+            run_id (str): The ID of the run.
+            askable_id (str): The ID of the askable the run must belong to. Optional, any askable when not provided.
+        """
+        with self._lock:
+            self._evict_expired()
+            run = self._runs.get(run_id)
+        if run is not None and askable_id is not None and run.session.askable.id != askable_id:
+            # Runs are only resumed through the askable they were started for
+            return None
+        return run
+
+    def __len__(self) -> int:
+        return len(self._runs)
+
+    def evict_expired(self):
+        """Evict the runs ended more than the TTL ago, and cancel the runs lasting longer than the maximum duration."""
+        with self._lock:
+            self._evict_expired()
+
+    def close(self):
+        """Stop the background sweep."""
+        self._stopped.set()
+
+    def _sweep(self):
+        while not self._stopped.wait(self.sweep_interval):
+            self.evict_expired()
+
+    def _evict_expired(self):
+        now = time.monotonic()
+        expired = []
+        for run_id, run in self._runs.items():
+            if run.done:
+                if now - run.finished_at >= self.ttl:
+                    expired.append(run_id)
+            elif self.max_duration is not None and now - run.started_at > self.max_duration:
+                run.cancel("max-duration")
+                if now - run.started_at > self.max_duration + self.ttl:
+                    expired.append(run_id)
+        for run_id in expired:
+            logger.debug("Evicting expired stream run %s", run_id)
+            del self._runs[run_id]
@@ -1,12 +1,15 @@
-from typing import Annotated, Callable
+from contextlib import nullcontext
+from typing import Annotated, Callable, Optional
 
 from pydantic import BaseModel
 
 from .conversation import AllMessagesStrategy, Conversation, ConversationReadingStrategy
 
-from .agent import Agent
+from .agent import Agent, handoff_tools
 from .askable import Askable
+from .cancellation import is_timeout, supported_kwargs
 from .llm import LLM
+from .routing import TeamRouter, TransitionGraphRouter
 
 import logging
 
@@ -27,6 +30,8 @@ class Team(Askable):
         include_tools_descriptions (bool): Whether to include the tools descriptions in the system prompt to help the orchestrator decide.
         reading_strategy (ConversationReadingStrategy): The reading strategy to use to select the messages to use for the decision-making process.
         use_structured_output (bool): Whether to use JSON structured output for the decision-making process. Set to False to use an older LLM API version.
+        routers (list[TeamRouter]): The routers choosing the next agent without the orchestrator LLM when the choice is forced.
+        handoff (bool): Whether members choose the next agent themselves with `handoff_to_<agent>` tools.
     """
 
     def __init__(
@@ -41,6 +46,8 @@ class Team(Askable):
         include_tools_descriptions: bool = False,
         reading_strategy: ConversationReadingStrategy = AllMessagesStrategy(),
         use_structured_output: bool = True,
+        routers: Optional[list[TeamRouter]] = None,
+        handoff: bool = False,
     ):
         """
         Initialize the Team object.
@@ -56,6 +63,8 @@ class Team(Askable):
             include_tools_descriptions (bool): Whether to include the tools descriptions in the system prompt to help the orchestrator decide. Optional.
             reading_strategy (ConversationReadingStrategy): The reading strategy to use to select the messages to use for the decision-making process. Optional.
             use_structured_output (bool): Whether to use JSON structured output for the decision-making process. Set to False to use an older LLM API version. Optional.
+            routers (list[TeamRouter]): The routers asked in order before the orchestrator LLM, e.g. rule or transition-graph routers. Optional, a TransitionGraphRouter when not provided.
+            handoff (bool): Whether to give each Agent member a `handoff_to_<agent>` tool per agent allowed after it. The agent handed off to speaks next, and the orchestrator LLM is only asked when no handoff is made. Optional, defaults to False.
         """
         super().__init__(id, description)
         self.agents = members
@@ -65,9 +74,8 @@ class Team(Askable):
         self.allowed_transitions = allowed_transitions
         self.allowed_transitions_str_dict = (
             {
-                tr.id: [agent.id for agent in members]
+                tr.id: [agent.id for agent in self.allowed_transitions[tr]]
                 for tr in self.allowed_transitions
-                for agent in self.allowed_transitions[tr]
             }
             if self.allowed_transitions
             else None
@@ -79,6 +87,18 @@ class Team(Askable):
 
         self.llm = llm
         self.reading_strategy = reading_strategy
+        self.routers = routers if routers is not None else [TransitionGraphRouter()]
+        self.handoff = handoff
+        # Agent ID -> handoff tools, offered only while the team asks the agent
+        self.handoffs = (
+            {
+                agent.id: handoff_tools(agent.id, self._handoff_targets(agent))
+                for agent in members
+                if isinstance(agent, Agent)
+            }
+            if handoff
+            else {}
+        )
 
         logger.debug("[Team %s] initialized with agents: %s", self.id, self.agents_dict)
 
@@ -94,8 +114,32 @@ class Team(Askable):
             conversation.update(["start", self.id])
 
         execution_result = None
+        handoff_agent_id = None
         while True:
-            next_agent_id = self._select_next_agent(conversation)
+            if conversation.cancellation.cancelled:
+                logger.debug("[Team %s] cancelled, ending workflow.", self.id)
+                conversation.log.append(("info", "team/cancelled", self.id))
+                execution_result = "cancelled"
+                break
+            if conversation.deadline_exceeded:
+                execution_result = self._deadline_exceeded(conversation)
+                break
+
+            try:
+                if handoff_agent_id is not None and handoff_agent_id in self.candidates(conversation):
+                    # The previous agent chose the next one, no orchestrator LLM call needed
+                    next_agent_id = handoff_agent_id
+                    conversation.log.append(
+                        ("info", "team/choice", self.id, next_agent_id, "handoff")
+                    )
+                else:
+                    next_agent_id = self._select_next_agent(conversation)
+            except Exception as e:
+                if not (conversation.deadline_exceeded and is_timeout(e)):
+                    raise
+                # The orchestrator LLM call timed out
+                execution_result = self._deadline_exceeded(conversation)
+                break
             logger.debug("[Team %s] selected next agent ID: %s", self.id, next_agent_id)
 
             self.current_agent = self.agents_dict[next_agent_id]
@@ -103,7 +147,10 @@ class Team(Askable):
                 "[Team %s] current agent: '%s'", self.id, self.current_agent.id
             )
 
-            agent_result = self.current_agent.ask(conversation, stream=stream)
+            last_handoff = conversation.log.last(kind="agent/handoff", source=next_agent_id)
+            with self._handing_off(self.current_agent):
+                agent_result = self.current_agent.ask(conversation, stream=stream)
+            handoff_agent_id = self._handoff_agent_id(conversation, next_agent_id, last_handoff)
 
             logger.debug(
                 "[Team %s] asked current agent with messages: %s", self.id, agent_result
@@ -124,6 +171,14 @@ class Team(Askable):
                 conversation.log.append(("error", "team/error", self.id))
                 execution_result = "agent-error"
                 break
+            elif agent_result == "cancelled":
+                logger.debug("[Team %s] cancelled, ending workflow.", self.id)
+                conversation.log.append(("info", "team/cancelled", self.id))
+                execution_result = "cancelled"
+                break
+            elif agent_result == "deadline-exceeded":
+                execution_result = self._deadline_exceeded(conversation)
+                break
 
             if self.stop_callback(conversation):
                 logger.debug(
@@ -138,7 +193,86 @@ class Team(Askable):
 
         return execution_result
 
-    def _select_next_agent(self, conversation: Conversation):
+    def _deadline_exceeded(self, conversation: Conversation) -> str:
+        logger.debug("[Team %s] deadline exceeded, ending workflow.", self.id)
+        conversation.log.append(("info", "team/deadline-exceeded", self.id))
+        return "deadline-exceeded"
+
+    def _handoff_targets(self, agent: Agent) -> list[Askable]:
+        if self.allowed_transitions and agent in self.allowed_transitions:
+            return self.allowed_transitions[agent]
+        return [member for member in self.agents if member is not agent]
+
+    def _handing_off(self, agent: Askable):
+        handoffs = self.handoffs.get(agent.id)
+        if handoffs is None:
+            return nullcontext()
+        return agent.handing_off(handoffs)
+
+    def _handoff_agent_id(
+        self, conversation: Conversation, agent_id: str, last_handoff
+    ) -> Optional[str]:
+        if not self.handoff:
+            return None
+        event = conversation.log.last(kind="agent/handoff", source=agent_id)
+        if event is None or event is last_handoff:
+            return None
+        logger.debug("[Team %s] agent %s handed off to %s", self.id, agent_id, event.payload[0])
+        return event.payload[0]
+
+    def candidates(self, conversation: Conversation) -> list[str]:
+        """Get the IDs of the agents allowed to speak after the current one.
+
+        The current agent is the latest choice of the team logged in the conversation,
+        so concurrent conversations asking the same team do not affect each other.
+
+        Args:
+            conversation (Conversation): The conversation, with its log.
+        """
+        if self.allowed_transitions_str_dict is not None:
+            event = conversation.log.last(kind="team/choice", level="info", source=self.id)
+            if event is not None and event.payload:
+                allowed = self.allowed_transitions_str_dict.get(event.payload[0])
+                if allowed is not None:
+                    return allowed
+        return list(self.agents_dict)
+
+    def _route(self, conversation: Conversation, candidates: list[str]) -> Optional[str]:
+        for router in self.routers:
+            next_agent_id = router.route(conversation, candidates)
+            if next_agent_id is None:
+                continue
+            if next_agent_id not in candidates:
+                logger.error(
+                    "[Team %s] router %s selected a not allowed agent_id: %s",
+                    self.id,
+                    router.name,
+                    next_agent_id,
+                )
+                continue
+            logger.debug(
+                "[Team %s] router %s selected agent_id: %s",
+                self.id,
+                router.name,
+                next_agent_id,
+            )
+            conversation.log.append(
+                ("info", "team/choice", self.id, next_agent_id, f"router:{router.name}")
+            )
+            return next_agent_id
+        return None
+
+    def _select_next_agent(
+        self, conversation: Conversation, candidates: Optional[list[str]] = None
+    ):
+        if candidates is None:
+            # Read before this choice is logged
+            candidates = self.candidates(conversation)
+        # Forced choices skip the orchestrator LLM round trip
+        next_agent_id = self._route(conversation, candidates)
+        if next_agent_id is not None:
+            return next_agent_id
+
         system_prompt = """
 You are a team orchestrator that uses a chat history to determine the next best speaker in the conversation.
 Your task is to return the agent_id of the speaker that is best suited to proceed based on the context provided in the chat history and the description of the agents.
@@ -180,6 +314,7 @@ BE SURE TO READ AGAIN THE INSTUCTIONS ABOVE BEFORE PROCEEDING.
                 messages=local_messages,
                 temperature=0,
                 response_format=AgentChoiceResponse,
+                **supported_kwargs(self.llm.ask, timeout=conversation.time_remaining()),
             )
             logger.debug(
                 "[Team %s] selected agent_id: %s, (reason: '%s')",
@@ -198,39 +333,32 @@ BE SURE TO READ AGAIN THE INSTUCTIONS ABOVE BEFORE PROCEEDING.
             )
             next_agent_id = result.parsed.agent_id
         else:
-            result, usage = self.llm.ask(messages=local_messages, temperature=0)
+            result, usage = self.llm.ask(
+                messages=local_messages,
+                temperature=0,
+                **supported_kwargs(self.llm.ask, timeout=conversation.time_remaining()),
+            )
             next_agent_id = result.content.split(" ")[-1].strip()
             logger.debug("[Team %s] selected agent_id: %s", self.id, next_agent_id)
             conversation.log.append(("info", "team/choice", self.id, next_agent_id))
 
         if usage is not None:
             # Update conversation metrics with response usage
-            conversation.metrics.total_tokens += usage["total_tokens"]
-            conversation.metrics.prompt_tokens += usage["prompt_tokens"]
-            conversation.metrics.completion_tokens += usage["completion_tokens"]
+            conversation.metrics.add(usage)
 
         if next_agent_id not in self.agents_dict:
             logger.error(
                 "[Team %s] invalid agent_id selected: %s", self.id, next_agent_id
             )
             conversation.log.append(("error", "team/choice", self.id, next_agent_id))
-            return self._select_next_agent(conversation)
-
-        if (
-            self.allowed_transitions_str_dict is not None
-            and self.current_agent is not None
-        ):
-            if (
-                next_agent_id
-                not in self.allowed_transitions_str_dict[self.current_agent.id]
-            ):
-                logger.error(
-                    "[Team %s] invalid agent_id selected: %s", self.id, next_agent_id
-                )
-                conversation.log.append(
-                    ("error", "team/choice", self.id, next_agent_id)
-                )
-                return self._select_next_agent(conversation)
+            return self._select_next_agent(conversation, candidates)
+
+        if next_agent_id not in candidates:
+            logger.error(
+                "[Team %s] invalid agent_id selected: %s", self.id, next_agent_id
+            )
+            conversation.log.append(("error", "team/choice", self.id, next_agent_id))
+            return self._select_next_agent(conversation, candidates)
 
         return next_agent_id
 
@@ -0,0 +1,482 @@
+from abc import ABC, abstractmethod
+from collections import Counter, OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor, wait
+import functools
+import heapq
+import inspect
+import json
+import math
+import re
+import threading
+import time
+from typing import Any, Callable, Literal, NamedTuple, Optional
+import weakref
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+# Word boundaries inside camelCase identifiers
+_CAMEL_CASE_PATTERN = re.compile(r"(?<=[a-z0-9])(?=[A-Z])")
+
+
+def tool_name(tool: dict) -> str:
+    """Get the name of a tool, given its schema."""
+    return tool["function"]["name"]
+
+
+def tool_text(tool: dict) -> str:
+    """Get the searchable text of a tool: its name, description and parameters."""
+    function = tool["function"]
+    parts = [function["name"], function.get("description", "")]
+    properties = function.get("parameters", {}).get("properties", {})
+    for name, schema in properties.items():
+        parts.append(name)
+        parts.append(schema.get("description", ""))
+    return " ".join(parts)
+
+
+def tokenize(text: str) -> list[str]:
+    """Split a text into lowercase words, also splitting snake_case and camelCase identifiers."""
+    return _TOKEN_PATTERN.findall(_CAMEL_CASE_PATTERN.sub(" ", text).lower())
+
+
+class ToolSelector(ABC):
+    """Base class for tool selectors, choosing the subset of an agent tools sent to the LLM for the current turn.
+
+    Tools are indexed incrementally as they are registered. On each call, the
+    `top_k` tools most relevant to the latest user message are selected, along with
+    the pinned tools, which are always sent. A selector indexes the tools of a
+    single agent.
+    """
+
+    def __init__(self, top_k: int = 5, pinned: Optional[list[str]] = None):
+        """Initialize the ToolSelector.
+
+        Args:
+            top_k (int): The number of most relevant tools to select, besides the pinned ones.
+            pinned (list[str]): The names of the tools always selected. Optional.
+        """
+        self.top_k = top_k
+        self.pinned = set(pinned or [])
+
+    @abstractmethod
+    def add(self, tools: list[dict]):
+        """Index the given tools, given their schemas."""
+        pass
+
+    @abstractmethod
+    def rank(self, query: str, k: int) -> list[tuple[str, float]]:
+        """Find the k indexed tools most relevant to the query.
+
+        Args:
+            query (str): The text to match, typically the latest user message.
+            k (int): The maximum number of tools to return.
+
+        Returns:
+            list[tuple[str, float]]: The (tool name, score) pairs of the relevant tools, best first.
+        """
+        pass
+
+    def select(self, tools: list[dict], query: str) -> list[dict]:
+        """Select the pinned and most relevant tools, in their registration order.
+
+        Args:
+            tools (list[dict]): The schemas of all the agent tools.
+            query (str): The text to match, typically the latest user message.
+        """
+        ranked = self.rank(query, self.top_k + len(self.pinned))
+        relevant = [name for name, _ in ranked if name not in self.pinned]
+        selected = self.pinned | set(relevant[: self.top_k])
+        logger.debug("Selected tools %s", selected)
+        # Keep the registration order, so the same selection yields the same prompt
+        return [tool for tool in tools if tool_name(tool) in selected]
+
+
+class BM25ToolSelector(ToolSelector):
+    """A tool selector ranking tools with the Okapi BM25 function over their names, descriptions and parameters.
+
+    The inverted index is updated incrementally, and term statistics are computed at
+    query time, so tools can be registered at any time. Dependency-free.
+    """
+
+    def __init__(
+        self,
+        top_k: int = 5,
+        pinned: Optional[list[str]] = None,
+        k1: float = 1.5,
+        b: float = 0.75,
+    ):
+        """Initialize the BM25ToolSelector.
+
+        Args:
+            top_k (int): The number of most relevant tools to select, besides the pinned ones.
+            pinned (list[str]): The names of the tools always selected. Optional.
+            k1 (float): The BM25 term frequency saturation.
+            b (float): The BM25 document length normalization.
+        """
+        super().__init__(top_k=top_k, pinned=pinned)
+        self.k1 = k1
+        self.b = b
+        self._names = []
+        self._lengths = []
+        self._total_length = 0
+        # Term -> {tool row: term frequency}
+        self._postings = defaultdict(dict)
+        self._lock = threading.Lock()
+
+    def add(self, tools: list[dict]):
+        with self._lock:
+            for tool in tools:
+                row = len(self._names)
+                terms = tokenize(tool_text(tool))
+                self._names.append(tool_name(tool))
+                self._lengths.append(len(terms))
+                self._total_length += len(terms)
+                for term, frequency in Counter(terms).items():
+                    self._postings[term][row] = frequency
+
+    def rank(self, query: str, k: int) -> list[tuple[str, float]]:
+        with self._lock:
+            count = len(self._names)
+            if count == 0 or k <= 0:
+                return []
+            average_length = self._total_length / count or 1.0
+            scores = defaultdict(float)
+            for term in set(tokenize(query)):
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for row, frequency in postings.items():
+                    norm = self.k1 * (
+                        1 - self.b + self.b * self._lengths[row] / average_length
+                    )
+                    scores[row] += idf * frequency * (self.k1 + 1) / (frequency + norm)
+            best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+            return [(self._names[row], score) for row, score in best]
+
+
+class ToolResultCache:
+    """A cache of tool results, keyed by tool name, tool function and canonicalized arguments.
+
+    Results expire after a TTL, and the least recently used ones are evicted beyond
+    the maximum size. With "conversation" scope each conversation has its own
+    entries, released with the conversation, while with "global" scope the entries
+    are shared by all the conversations. Different functions registered under the same
+    name never share results. Errors and timeout results are never cached.
+
+    Example:
+        @agent.register_tool(description="Look up a customer", cache=ToolResultCache(ttl=60))
+        def lookup_customer(customer_id: str) -> str:
+            ...
+    """
+
+    def __init__(
+        self,
+        ttl: Optional[float] = None,
+        max_size: int = 256,
+        scope: Literal["conversation", "global"] = "conversation",
+    ):
+        """Initialize the ToolResultCache.
+
+        Args:
+            ttl (float): How long a result is reused, in seconds. Optional, results never expire when not provided.
+            max_size (int): The maximum number of results kept, per conversation with "conversation" scope.
+            scope (str): Whether results are reused within a "conversation" only, or across all of them ("global").
+        """
+        if scope not in ("conversation", "global"):
+            raise ValueError(f"Invalid cache scope: {scope}")
+        self.ttl = ttl
+        self.max_size = max_size
+        self.scope = scope
+        self.hits = 0
+        self.misses = 0
+        self._global = OrderedDict()
+        self._conversations = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def bind(self, name: str, function: Callable, conversation: Any) -> Callable:
+        """Bind a tool function to the cache, for the given conversation.
+
+        Args:
+            name (str): The name of the tool.
+            function (Callable): The tool function, called on cache misses with keyword arguments.
+            conversation (Conversation): The conversation calling the tool, scoping the entries with "conversation" scope.
+        """
+
+        def _cached(**kwargs):
+            return self.call(name, function, kwargs, conversation)
+
+        return _cached
+
+    def call(self, name: str, function: Callable, kwargs: dict, conversation: Any = None):
+        """Get the cached result of a tool call, calling the tool on a miss."""
+        # The function wrappers, e.g. of a ToolExecutor, are not part of its identity
+        key = (name, inspect.unwrap(function), canonical_arguments(kwargs))
+        entries = self._entries(conversation)
+        now = time.monotonic()
+        with self._lock:
+            entry = entries.get(key)
+            if entry is not None and (self.ttl is None or now - entry[0] < self.ttl):
+                entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        # Concurrent misses may both call the tool, the last result wins
+        result = function(**kwargs)
+        if isinstance(result, ToolTimeoutResult):
+            return result
+        with self._lock:
+            entries[key] = (time.monotonic(), result)
+            entries.move_to_end(key)
+            while len(entries) > self.max_size:
+                entries.popitem(last=False)
+        return result
+
+    def clear(self):
+        """Drop all the cached results."""
+        with self._lock:
+            self._global.clear()
+            self._conversations.clear()
+
+    def _entries(self, conversation: Any) -> OrderedDict:
+        if self.scope == "global" or conversation is None:
+            return self._global
+        with self._lock:
+            entries = self._conversations.get(conversation)
+            if entries is None:
+                entries = OrderedDict()
+                self._conversations[conversation] = entries
+            return entries
+
+
+def canonical_arguments(kwargs: dict) -> str:
+    """Serialize tool call arguments to a canonical JSON string, independent of the arguments order."""
+    return json.dumps(kwargs, sort_keys=True, separators=(",", ":"), default=str)
+
+
+class ToolTimeoutError(Exception):
+    """Raised when a tool call does not complete in time, distinct from the timeouts raised by the tool itself."""
+
+    pass
+
+
+class ToolTimeoutResult(str):
+    """The structured result returned to the model when a tool call times out, as a JSON string."""
+
+    pass
+
+
+class ToolPolicy(NamedTuple):
+    """How a ToolExecutor runs a tool.
+
+    Args:
+        timeout (float): The maximum time of a call in seconds, waiting for a free slot included. Optional, calls are not timed out when not provided.
+        max_concurrency (int): The maximum number of concurrent calls of the tool, across all the agents sharing the executor. Optional, unbounded when not provided.
+        retries (int): The number of times a failed call is retried. Timed out calls are not retried.
+        backoff (float): The delay before the first retry in seconds, doubled on each following retry.
+        retry_on (tuple[type[Exception], ...]): The exceptions that trigger a retry.
+    """
+
+    timeout: Optional[float] = None
+    max_concurrency: Optional[int] = None
+    retries: int = 0
+    backoff: float = 0.5
+    retry_on: tuple = (Exception,)
+
+
+class ToolExecutor:
+    """Runs tool calls on a thread pool, enforcing a timeout, a concurrency limit and a retry policy per tool.
+
+    A call that does not complete in time returns a structured timeout result to the
+    model, instead of blocking the turn; the call keeps running in the background
+    until it completes, holding its concurrency slot. The per-tool concurrency limits
+    act as bulkheads protecting downstream services, and are shared by all the
+    agents using the same executor. Calls are timed out earlier if the conversation
+    deadline expires first, and their latency is recorded in the conversation metrics.
+
+    Example:
+        executor = ToolExecutor(policy=ToolPolicy(timeout=10))
+        agent = Agent(..., tool_executor=executor)
+
+        @agent.register_tool(description="Search orders", policy=ToolPolicy(timeout=3, max_concurrency=4, retries=2))
+        def search_orders(query: str) -> str:
+            ...
+    """
+
+    _default = None
+    _default_lock = threading.Lock()
+
+    def __init__(self, policy: ToolPolicy = ToolPolicy(), max_workers: int = 32):
+        """Initialize the ToolExecutor.
+
+        Args:
+            policy (ToolPolicy): The policy of the tools registered without their own.
+            max_workers (int): The maximum number of threads running timed tool calls.
+        """
+        self.policy = policy
+        self._pool = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="tool"
+        )
+        self._semaphores = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def default(cls) -> "ToolExecutor":
+        """Get the executor shared by the agents having tool policies but no executor."""
+        with cls._default_lock:
+            if cls._default is None:
+                cls._default = cls()
+            return cls._default
+
+    def bind(
+        self,
+        name: str,
+        function: Callable,
+        conversation: Any,
+        policy: Optional[ToolPolicy] = None,
+    ) -> Callable:
+        """Bind a tool function to the executor, for the given conversation.
+
+        Args:
+            name (str): The name of the tool.
+            function (Callable): The tool function, called with keyword arguments.
+            conversation (Conversation): The conversation calling the tool, whose deadline and metrics are used.
+            policy (ToolPolicy): The policy of the tool. Optional, the executor policy when not provided.
+        """
+
+        @functools.wraps(function)
+        def _executed(**kwargs):
+            return self.call(name, function, kwargs, conversation, policy)
+
+        return _executed
+
+    def call(
+        self,
+        name: str,
+        function: Callable,
+        kwargs: dict,
+        conversation: Any = None,
+        policy: Optional[ToolPolicy] = None,
+    ):
+        """Call a tool according to its policy.
+
+        Returns:
+            The tool result, or a structured timeout result as a JSON string.
+
+        Raises:
+            Exception: The error of the last attempt, once the retries are exhausted.
+        """
+        policy = policy or self.policy
+        start = time.monotonic()
+        budget = self._budget(policy, conversation)
+        outcome = "error"
+        try:
+            attempt = 0
+            while True:
+                # The retries share the time budget of the call
+                timeout = (
+                    max(budget - (time.monotonic() - start), 0.0)
+                    if budget is not None
+                    else None
+                )
+                try:
+                    result = self._run(name, function, kwargs, policy, timeout)
+                    outcome = "ok"
+                    return result
+                except ToolTimeoutError:
+                    outcome = "timeout"
+                    logger.warning("Tool %s timed out after %s seconds", name, budget)
+                    if conversation is not None:
+                        conversation.log.append(("error", "tool/timeout", name, budget))
+                    return timeout_result(name, budget)
+                except policy.retry_on as e:
+                    if attempt >= policy.retries:
+                        raise
+                    delay = policy.backoff * 2**attempt
+                    if budget is not None and delay >= budget - (time.monotonic() - start):
+                        # No time left for another attempt, report the actual error
+                        logger.debug("Not retrying tool %s, its time budget would be exceeded", name)
+                        raise
+                    attempt += 1
+                    logger.debug("Retrying tool %s in %s seconds: %s", name, delay, e)
+                    time.sleep(delay)
+        finally:
+            latency = time.monotonic() - start
+            logger.debug("Tool %s completed (%s) in %.3f seconds", name, outcome, latency)
+            if conversation is not None:
+                conversation.metrics.add_tool_call(latency, outcome)
+
+    def shutdown(self, wait: bool = True):
+        """Release the threads of the executor."""
+        self._pool.shutdown(wait=wait)
+
+    def _budget(self, policy: ToolPolicy, conversation: Any) -> Optional[float]:
+        timeouts = []
+        if policy.timeout is not None:
+            timeouts.append(policy.timeout)
+        remaining = conversation.time_remaining() if conversation is not None else None
+        if remaining is not None:
+            timeouts.append(remaining)
+        return min(timeouts) if timeouts else None
+
+    def _run(self, name: str, function: Callable, kwargs: dict, policy: ToolPolicy, timeout: Optional[float]):
+        semaphore = self._semaphore(name, policy)
+        start = time.monotonic()
+        if semaphore is not None and not semaphore.acquire(timeout=timeout):
+            # No free slot in time
+            raise ToolTimeoutError()
+        if timeout is None:
+            # Nothing to enforce, run inline
+            return _invoke(semaphore, function, kwargs)
+
+        remaining = max(timeout - (time.monotonic() - start), 0.0)
+        try:
+            future = self._pool.submit(_invoke, semaphore, function, kwargs)
+        except BaseException:
+            if semaphore is not None:
+                semaphore.release()
+            raise
+        # The slot is released by the call itself, even after a timeout
+        done, _ = wait([future], timeout=remaining)
+        if not done:
+            raise ToolTimeoutError()
+        return future.result()
+
+    def _semaphore(self, name: str, policy: ToolPolicy) -> Optional[threading.Semaphore]:
+        if policy.max_concurrency is None:
+            return None
+        # Keyed by the bound too, so tools sharing a name under different policies keep their own limit
+        key = (name, policy.max_concurrency)
+        with self._lock:
+            semaphore = self._semaphores.get(key)
+            if semaphore is None:
+                semaphore = threading.BoundedSemaphore(policy.max_concurrency)
+                self._semaphores[key] = semaphore
+            return semaphore
+
+
+def _invoke(semaphore: Optional[threading.Semaphore], function: Callable, kwargs: dict):
+    try:
+        return function(**kwargs)
+    finally:
+        if semaphore is not None:
+            semaphore.release()
+
+
+def timeout_result(name: str, timeout: Optional[float]) -> ToolTimeoutResult:
+    """Build the structured result returned to the model when a tool call times out."""
+    return ToolTimeoutResult(
+        json.dumps(
+            {
+                "error": "timeout",
+                "tool": name,
+                "timeout": timeout,
+                "message": f"The tool {name} did not complete in time, its result is unavailable",
+            }
+        )
+    )
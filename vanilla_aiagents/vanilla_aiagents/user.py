@@ -45,7 +45,7 @@ class User(Askable):
         if self.mode == "interactive":
             # Get user input from command line prompt
             user_input = self.interaction_function(f"{self.id}: ")
-            conversation.messages.append(
+            conversation.append_messages(
                 {"role": "user", "content": user_input, "name": self.id}
             )
             return None
@@ -1,8 +1,10 @@
-import queue
-import threading
-from typing import Union
+from concurrent.futures import Executor
+from typing import Optional, Union
 from .askable import Askable
+from .blobs import externalize_message
+from .cancellation import CancellationToken, Deadline
 from .conversation import Conversation
+from .stream import StreamFilter, StreamSession
 import base64
 
 import logging
@@ -14,7 +16,11 @@ class WorkflowInput:
     """A class to represent the input to a workflow."""
 
     def __init__(
-        self, text: str, images: list[str] = [], name: str = "user", role: str = "user"
+        self,
+        text: str,
+        images: list[str] = None,
+        name: str = "user",
+        role: str = "user",
     ):
         """Initialize the WorkflowInput object.
 
@@ -23,7 +29,8 @@ class WorkflowInput:
             images (list[str]): The list of image URLs to include in the input. Optional
         """
         self.text = text
-        self.images = images
+        # Copied, so adding images never changes the caller list
+        self.images = list(images) if images else []
         self.name = name
         self.role = role
 
@@ -79,6 +86,7 @@ class Workflow:
         askable: Askable,
         conversation: Conversation = None,
         system_prompt: str = "",
+        timeout: Optional[float] = None,
     ):
         """Initialize the Workflow object.
 
@@ -86,10 +94,12 @@ class Workflow:
             askable (Askable): The Askable object to use for the workflow.
             conversation (Conversation): The conversation to use for the workflow. Optional, when not provided, a new conversation will be created.
             system_prompt (str): The system prompt to use for the workflow. Optional.
+            timeout (float): The time budget of each run, in seconds. When exceeded, the askables stop and the run returns "deadline-exceeded". Optional, runs are unbounded when not provided.
         """
         self.askable = askable
         self.conversation = conversation or Conversation(messages=[], variables={})
         self.system_prompt = system_prompt
+        self.timeout = timeout
 
         logger.debug("Workflow initialized")
 
@@ -108,86 +118,124 @@ class Workflow:
 
         return execution_result
 
+    def cancel(self, reason: str = "cancelled"):
+        """Cancel the current run, stopping its askables as soon as possible.
+
+        Args:
+            reason (str): The reason of the cancellation.
+        """
+        self.conversation.cancellation.cancel(reason)
+
     def _handle_workflow_input(self, workflow_input):
         logger.debug("Running workflow with input: %s", workflow_input)
+        # Each run can be cancelled independently of the previous ones
+        self.conversation.cancellation = CancellationToken()
+        self.conversation.deadline = (
+            Deadline(self.timeout) if self.timeout is not None else None
+        )
 
         logger.debug("Conversation length: %s", len(self.conversation.messages))
+        messages = []
         if len(self.conversation.messages) == 0:
-            self.conversation.messages.append(
-                {"role": "system", "content": self.system_prompt}
-            )
+            messages.append({"role": "system", "content": self.system_prompt})
             logger.debug("Added system prompt to messages: %s", self.system_prompt)
 
         if isinstance(workflow_input, WorkflowInput):
-            self.conversation.messages.append(workflow_input.to_message())
-            logger.debug("Added user input to messages: %s", workflow_input.text)
+            messages.append(self._externalize(workflow_input.to_message()))
         elif isinstance(workflow_input, dict):
-            self.conversation.messages.append(
-                WorkflowInput.from_dict(workflow_input).to_message()
+            messages.append(
+                self._externalize(WorkflowInput.from_dict(workflow_input).to_message())
             )
         elif isinstance(workflow_input, str):
-            self.conversation.messages.append(
-                {"role": "user", "name": "user", "content": workflow_input}
-            )
+            messages.append({"role": "user", "name": "user", "content": workflow_input})
+        self.conversation.append_messages(messages)
         logger.debug("Added user input to messages: %s", workflow_input)
 
-    def run_stream(self, workflow_input: Union[str, WorkflowInput, dict]):
+    def _externalize(self, message: dict) -> dict:
+        # Keep images out of the conversation messages when a blob store is available
+        if self.conversation.blob_store is None:
+            return message
+        return externalize_message(message, self.conversation.blob_store)
+
+    def run_stream(
+        self,
+        workflow_input: Union[str, WorkflowInput, dict],
+        timeout: Optional[float] = None,
+        stream_filter: Optional[StreamFilter] = None,
+    ):
         """Run the workflow with the given input and stream the conversation updates.
 
+        The stream ends once the askable completes, with a final "result" update.
+
         Args:
             workflow_input (Union[str, WorkflowInput]): The input to the workflow. This can be a string or a WorkflowInput object.
+            timeout (float): The maximum time to wait for the next update, in seconds. Optional.
+            stream_filter (StreamFilter): The filter selecting the updates to yield, e.g. only text deltas. Optional.
 
         Yields:
             list[str, any]: A list containing the mark and content of the conversation update.
         """
         self._handle_workflow_input(workflow_input)
 
-        result_queue = queue.Queue()
+        session = StreamSession(
+            self.askable,
+            self.conversation,
+            timeout=timeout,
+            stream_filter=stream_filter,
+        )
+        for mark, content in session:
+            logger.debug(f"Stream content: {mark}, {content}")
+            yield [mark, content]
+
+        logger.debug("Workflow execution result: %s", session.result)
 
-        def ask_in_thread():
-            try:
-                res = self.askable.ask(self.conversation, stream=True)
-            except Exception as e:
-                logger.error("Error during askable.ask: %s", e)
-                self.conversation.update(["error", e])
-                res = "error"
+        yield ["result", session.result]
 
-            logger.debug("Workflow execution result in thread: %s", res)
-            result_queue.put_nowait(res)
+    async def arun_stream(
+        self,
+        workflow_input: Union[str, WorkflowInput, dict],
+        timeout: Optional[float] = None,
+        stream_filter: Optional[StreamFilter] = None,
+        executor: Optional[Executor] = None,
+    ):
+        """Run the workflow with the given input and asynchronously stream the conversation updates.
 
-        thread = threading.Thread(target=ask_in_thread)
-        thread.start()
+        The askable runs in a thread pool, while updates are awaited without blocking the
+        loop. The stream ends once the askable completes, with a final "result" update.
 
-        # In order to break the stream, we need to keep track of nesting levels, using a stack count
-        stack_count = 0
-        for mark, content in self.conversation.stream():
-            # Always update the conversation with the stream content
-            logger.debug(f"Stream content: {mark}, {content}")
-            yield [mark, content]
+        Args:
+            workflow_input (Union[str, WorkflowInput]): The input to the workflow. This can be a string or a WorkflowInput object.
+            timeout (float): The maximum time to wait for the next update, in seconds. Optional.
+            stream_filter (StreamFilter): The filter selecting the updates to yield, e.g. only text deltas. Optional.
+            executor (Executor): The executor running the askable. Optional, the pool shared by all stream sessions when not provided.
 
-            # Keep track of the stack count to know when to break
-            if mark == "start":
-                stack_count += 1
-            elif mark == "end":
-                stack_count -= 1
+        Yields:
+            list[str, any]: A list containing the mark and content of the conversation update.
+        """
+        self._handle_workflow_input(workflow_input)
 
-            logger.debug("Stack count: %s", stack_count)
-            if stack_count == 0:
-                logger.debug("Received response and stack count is 0, breaking stream.")
-                break
-            if mark == "error":
-                logger.debug("Received error, breaking stream.")
-                break
+        session = StreamSession(
+            self.askable,
+            self.conversation,
+            timeout=timeout,
+            stream_filter=stream_filter,
+            executor=executor,
+        )
+        async for mark, content in session:
+            logger.debug(f"Stream content: {mark}, {content}")
+            yield [mark, content]
 
-        logger.debug("Joining thread")
-        thread.join()
-        result = result_queue.get()
-        logger.debug("Workflow execution result: %s", result)
+        logger.debug("Workflow execution result: %s", session.result)
 
-        yield ["result", result]
+        yield ["result", session.result]
 
     def restart(self):
         """Restart the workflow by clearing the conversation."""
-        self.conversation = Conversation(messages=[], variables={})
+        self.conversation = Conversation(
+            messages=[],
+            variables={},
+            blob_store=self.conversation.blob_store,
+            compact=self.conversation.compact,
+        )
         logger.debug("Conversation length: %s", len(self.conversation.messages))
         logger.debug("Restarted workflow, cleared conversation.")